@@ -0,0 +1,42 @@
+import argparse
+import glob
+import time
+
+from data_extractor import DataExtractor, ExtractionRequest, FIDELITY_LEVELS
+from loaders.pdf_loader import PDFLoader
+
+
+def time_level(file_path, fidelity, repeats):
+    """
+    Time PDF text extraction at one fidelity level.
+
+    Returns:
+        tuple: (best time in seconds over `repeats` runs, extracted text)
+    """
+    extractor = DataExtractor(PDFLoader(file_path), ExtractionRequest(kinds=['text'], fidelity=fidelity))
+    best, text = None, ''
+    for _ in range(repeats):
+        started = time.perf_counter()
+        text = extractor.extract_pdf_text(file_path)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, text
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare PDF text extraction speed across fidelity levels.")
+    parser.add_argument('files', nargs='*', help="PDF files to benchmark; defaults to input/*.pdf.")
+    parser.add_argument('--repeats', type=int, default=5, help="Runs per file and level; the best time is kept.")
+    args = parser.parse_args()
+
+    print(f"{'file':<30} {'level':<6} {'seconds':>9} {'speedup':>8} {'chars':>7}")
+    for file_path in args.files or sorted(glob.glob('input/*.pdf')):
+        results = {level: time_level(file_path, level, args.repeats) for level in FIDELITY_LEVELS}
+        baseline = results['full'][0]
+        for level in FIDELITY_LEVELS:
+            seconds, text = results[level]
+            print(f"{file_path[-30:]:<30} {level:<6} {seconds:>9.4f} {baseline / seconds:>7.1f}x {len(text):>7}")
+
+
+if __name__ == "__main__":
+    main()
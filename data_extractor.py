@@ -1,22 +1,245 @@
+from datetime import datetime
 from docx.opc.constants import RELATIONSHIP_TYPE as RT
 from loaders.pdf_loader import PDFLoader
 from loaders.docx_loader import DOCXLoader
 from loaders.ppt_loader import PPTLoader
 from pdfminer.high_level import extract_text
+from pdfminer.layout import LAParams
 import pdfplumber
+import pypdfium2
+import tempfile
+from storage.part_cache import PackageParts
+from storage.pdf_images import SpilledImage, encode_pdf_image, estimated_size
+
+# Artifact kinds in the order the storage layer saves them
+KINDS = ('text', 'links', 'images', 'tables', 'metadata')
+# Kinds read from the content parts of a DOCX or PPTX package (metadata has its own part)
+PART_KINDS = ('text', 'links', 'images', 'tables')
+
+# PDF text fidelity levels, from cheapest to most faithful:
+#   raw   - pdfium's text layer in content order; no layout analysis (suited to search indexing)
+#   lines - pdfminer groups characters into words and lines but skips reading-order analysis
+#   full  - pdfminer's default layout analysis, including reading order of text boxes
+FIDELITY_LEVELS = ('raw', 'lines', 'full')
+
+
+class ExtractionRequest:
+    """Describe which artifact kinds and which pages (or slides) an extraction job needs."""
+
+    def __init__(self, kinds=None, pages=None, fidelity='full'):
+        """
+        Args:
+            kinds (iterable): Artifact kinds to extract, a subset of KINDS; None extracts everything.
+            pages (iterable): 1-based page or slide numbers to extract from; None uses every page.
+                DOCX files have no fixed pages, so this is ignored for them.
+            fidelity (str): PDF text fidelity level, one of FIDELITY_LEVELS.
+
+        Raises:
+            ValueError: If an unknown artifact kind or fidelity level, or a page below 1, is requested.
+        """
+        if fidelity not in FIDELITY_LEVELS:
+            raise ValueError(f"Unknown fidelity level: {fidelity} (choose from {', '.join(FIDELITY_LEVELS)})")
+        self.fidelity = fidelity
+        kinds = set(KINDS if kinds is None else kinds)
+        unknown = kinds - set(KINDS)
+        if unknown:
+            raise ValueError(f"Unknown artifact kinds: {', '.join(sorted(unknown))}")
+        self.kinds = [kind for kind in KINDS if kind in kinds]
+        self.pages = None if pages is None else sorted(set(pages))
+        if self.pages is not None and (not self.pages or self.pages[0] < 1):
+            # pdfminer and pdfplumber would treat an empty page list as "every page"
+            raise ValueError("Page numbers start at 1 and at least one page must be requested")
+
+    @classmethod
+    def from_spec(cls, kinds=None, pages=None, fidelity=None):
+        """
+        Build a request from command-line style strings.
+
+        Args:
+            kinds (str): Comma-separated artifact kinds, e.g. "text,links".
+            pages (str): Comma-separated page numbers and ranges, e.g. "1-3,7".
+            fidelity (str): PDF text fidelity level; None uses "full".
+
+        Raises:
+            ValueError: If a kind or fidelity level is unknown, or a page spec is malformed,
+                below 1 or a reversed range such as "5-3".
+        """
+        kind_set = None if not kinds else {kind.strip() for kind in kinds.split(',') if kind.strip()}
+        page_set = None
+        if pages:
+            page_set = set()
+            for part in filter(None, (part.strip() for part in pages.split(','))):
+                start, _, end = part.partition('-')
+                try:
+                    start, end = int(start), int(end or start)
+                except ValueError:
+                    raise ValueError(f"Invalid page spec: {part} (use numbers and ranges such as 1-3,7)") from None
+                if start < 1:
+                    raise ValueError(f"Invalid page spec: {part} (page numbers start at 1)")
+                if end < start:
+                    raise ValueError(f"Invalid page spec: {part} (range ends before it starts)")
+                page_set.update(range(start, end + 1))
+        return cls(kind_set, page_set, fidelity or 'full')
+
+    def includes_page(self, page_number):
+        """Check whether a 1-based page or slide number is part of the request."""
+        return self.pages is None or page_number in self.pages
+
 
 class DataExtractor:
     """A class to extract text, links, images, and tables from various document formats."""
 
-    def __init__(self, file_loader):
+    def __init__(self, file_loader, request=None, part_cache=None, image_spill_mb=None):
         """
         Initialize the DataExtractor with a specific file loader.
 
+        The file is loaded lazily, on first access to `content`, so jobs that only need
+        PDF data (which is read straight from the file path) never parse it twice.
+
         Args:
             file_loader: An instance of PDFLoader, DOCXLoader, or PPTLoader that handles loading files.
+            request (ExtractionRequest): The artifact kinds and pages to extract; None extracts everything.
+            part_cache (PartCache): When given, DOCX and PPTX results are cached per package part
+                (slide, document body, core properties) and only changed parts are parsed again.
+            image_spill_mb (float): Images larger than this many megabytes are kept in temporary
+                files instead of memory, so a document's image list does not have to fit in RAM.
         """
         self.file_loader = file_loader
-        self.content = self.file_loader.load_file()  # Load the file using the provided file loader
+        self.request = request or ExtractionRequest()
+        self.part_cache = part_cache
+        self.spill_bytes = None if image_spill_mb is None else int(image_spill_mb * 1024 * 1024)
+        self._content = None
+        self._package = None
+        self._part_results = None
+        self._results = {}  # text, links, tables and metadata, once extracted
+
+    def _memoized(self, kind, extract):
+        """Extract an artifact kind once; the SQL and filesystem sinks (and service results) share it."""
+        if kind not in self._results:
+            self._results[kind] = extract()
+        return self._results[kind]
+
+    @property
+    def content(self):
+        """The loaded document, loaded on first use with the provided file loader."""
+        if self._content is None:
+            self._content = self.file_loader.load_file()
+        return self._content
+
+    def _open_pdf(self, file_path):
+        """Open a PDF with pdfplumber, restricted to the requested pages."""
+        return pdfplumber.open(file_path, pages=self.request.pages)
+
+    def _selected_slides(self):
+        """Yield the slides of a presentation that are part of the request."""
+        for _, slide in self._numbered_slides():
+            yield slide
+
+    def _numbered_slides(self):
+        """Yield (1-based slide number, slide) for the slides that are part of the request."""
+        for slide_number, slide in enumerate(self.content.slides, start=1):
+            if self.request.includes_page(slide_number):
+                yield slide_number, slide
+
+    def _uses_part_cache(self):
+        return self.part_cache is not None and isinstance(self.file_loader, (DOCXLoader, PPTLoader))
+
+    def _cached_part(self, part_name, compute, kinds=None):
+        """
+        Return a part's result from the part cache, computing and caching it on a miss.
+
+        With `kinds`, the cached result is a dict holding one entry per artifact kind;
+        only the kinds it lacks are computed (as `compute(missing_kinds)`) and merged in,
+        so a request for some kinds never parses the part for the others.
+        """
+        if self._package is None:
+            self._package = PackageParts(self.file_loader.file_path)
+        if part_name not in self._package.entries:
+            # e.g. no core properties part: python-docx and python-pptx fill in defaults
+            return compute() if kinds is None else compute(kinds)
+        fingerprint = self._package.fingerprint(part_name)
+        result = self.part_cache.get(fingerprint)
+        if kinds is None:
+            if result is None:
+                result = compute()
+                self.part_cache.put(fingerprint, part_name, result)
+            return result
+        missing = [kind for kind in kinds if result is None or kind not in result]
+        if missing:
+            result = dict(result or {}, **compute(missing))
+            self.part_cache.put(fingerprint, part_name, result)
+        return result
+
+    def _content_part_results(self, kind):
+        """
+        Return the per-part results of the requested slides (PPTX) or of the document body (DOCX).
+
+        Each result holds, per artifact kind, the part's 'text' fragments, 'links', 'tables'
+        or the package names of its 'images'. `kind` and the other requested kinds are
+        filled in; parts are only parsed for kinds their cached result lacks, and the
+        document is only loaded if at least one part has to be parsed.
+
+        Returns:
+            list: (slide number, result) pairs; the slide number is None for DOCX.
+        """
+        if self._part_results is None or any(kind not in result for _, result in self._part_results):
+            kinds = [name for name in PART_KINDS if name == kind or name in self.request.kinds]
+            if self._package is None:
+                self._package = PackageParts(self.file_loader.file_path)
+            if isinstance(self.file_loader, PPTLoader):
+                self._part_results = [
+                    (index + 1,
+                     self._cached_part(part_name, lambda missing, index=index:
+                                       self._parse_slide(self.content.slides[index], missing), kinds))
+                    for index, part_name in enumerate(self._package.slide_parts())
+                    if self.request.includes_page(index + 1)
+                ]
+            else:
+                self._part_results = [(None, self._cached_part('word/document.xml', self._parse_document_body, kinds))]
+        return self._part_results
+
+    def _parse_slide(self, slide, kinds):
+        """Extract the given artifact kinds from one slide, in one pass over its shapes."""
+        result = {kind: [] for kind in kinds}
+        for shape in slide.shapes:
+            if 'text' in result and hasattr(shape, "text"):
+                result['text'].append(shape.text)
+            if 'links' in result and shape.has_text_frame:
+                for paragraph in shape.text_frame.paragraphs:
+                    for run in paragraph.runs:
+                        if run.hyperlink and run.hyperlink.address:
+                            result['links'].append(run.hyperlink.address)
+            if 'images' in result and shape.shape_type == 13:  # Picture
+                image_part = slide.part.related_part(shape._element.blip_rId)
+                result['images'].append(image_part.partname.lstrip('/'))
+            if 'tables' in result and shape.has_table:
+                result['tables'].append([[cell.text for cell in row.cells] for row in shape.table.rows])
+        return result
+
+    def _parse_document_body(self, kinds):
+        """Extract the given artifact kinds from the body of a DOCX document."""
+        parsers = {
+            'text': lambda: [paragraph.text for paragraph in self.content.paragraphs],
+            'links': self.extract_docx_links,
+            'images': lambda: [rel.target_part.partname.lstrip('/')
+                               for rel in self.content.part.rels.values() if "image" in rel.target_ref],
+            'tables': self.extract_docx_tables,
+        }
+        return {kind: parsers[kind]() for kind in kinds}
+
+    def _cached_artifact(self, kind, with_pages=False):
+        """Assemble one artifact kind from the per-part results, optionally as (page number, item) pairs."""
+        results = self._content_part_results(kind)
+        if kind == 'text':
+            return '\n'.join(text for _, result in results for text in result['text'])
+        if kind == 'images':
+            # Image bytes are read straight from the package; unchanged media never goes through the parser
+            named = [(page_number, name) for page_number, result in results for name in result['images']]
+            images = self._package.read([name for _, name in named], self.spill_bytes)
+            return [(page_number, image) for (page_number, _), image in zip(named, images)] if with_pages else images
+        if with_pages:
+            return [(page_number, item) for page_number, result in results for item in result[kind]]
+        return [item for _, result in results for item in result[kind]]
 
     def extract_text(self):
         """
@@ -25,9 +248,13 @@ class DataExtractor:
         Returns:
             str: The extracted text as a single string.
         """
+        return self._memoized('text', self._extract_text)
+
+    def _extract_text(self):
+        if self._uses_part_cache():
+            return self._cached_artifact('text')
         if isinstance(self.file_loader, PDFLoader):
-            # Extract text from a PDF file using pdfminer
-            text = extract_text(self.file_loader.file_path)
+            text = self.extract_pdf_text(self.file_loader.file_path)
             if text.strip():
                 return text  # Directly return PDF content if extracted text is not empty
         elif isinstance(self.file_loader, DOCXLoader):
@@ -36,43 +263,82 @@ class DataExtractor:
         elif isinstance(self.file_loader, PPTLoader):
             # Join all shape texts from each slide in a PPT presentation
             return '\n'.join(
-                shape.text for slide in self.content.slides for shape in slide.shapes if hasattr(shape, "text")
+                shape.text for slide in self._selected_slides() for shape in slide.shapes if hasattr(shape, "text")
             )
         return ""
 
-    def extract_links(self):
+    def extract_pdf_text(self, file_path):
+        """
+        Extract text from a PDF file at the requested fidelity level.
+
+        Args:
+            file_path (str): Path to the PDF file.
+
+        Returns:
+            str: The extracted text.
+        """
+        page_numbers = None if self.request.pages is None else [page - 1 for page in self.request.pages]
+        if self.request.fidelity == 'raw':
+            # pdfium reads the text layer directly, without building a layout tree
+            pdf = pypdfium2.PdfDocument(file_path)
+            try:
+                texts = []
+                for index in range(len(pdf)) if page_numbers is None else page_numbers:
+                    if not 0 <= index < len(pdf):
+                        continue
+                    text_page = pdf[index].get_textpage()
+                    texts.append(text_page.get_text_range().replace('\r\n', '\n'))
+                    text_page.close()
+                return '\n\f'.join(texts)
+            finally:
+                pdf.close()
+        # Extract text from a PDF file using pdfminer
+        laparams = LAParams(boxes_flow=None) if self.request.fidelity == 'lines' else LAParams()
+        return extract_text(file_path, page_numbers=page_numbers, laparams=laparams)
+
+    def extract_links(self, with_pages=False):
         """
         Extract hyperlinks from the loaded file.
 
+        Args:
+            with_pages (bool): Return (page number, link) pairs; the page number is None for DOCX.
+
         Returns:
             list: A list of extracted hyperlinks.
         """
+        links = self._memoized('links', self._extract_links)
+        return links if with_pages else [link for _, link in links]
+
+    def _extract_links(self):
+        if self._uses_part_cache():
+            return self._cached_artifact('links', with_pages=True)
         if isinstance(self.file_loader, PDFLoader):
-            return self.extract_pdf_links(self.file_loader.file_path)
+            return self.extract_pdf_links(self.file_loader.file_path, with_pages=True)
         elif isinstance(self.file_loader, DOCXLoader):
-            return self.extract_docx_links()
+            return [(None, link) for link in self.extract_docx_links()]
         elif isinstance(self.file_loader, PPTLoader):
-            return self.extract_ppt_links()
+            return self.extract_ppt_links(with_pages=True)
         return []
 
-    def extract_pdf_links(self, file_path):
+    def extract_pdf_links(self, file_path, with_pages=False):
         """
         Extract links from a PDF file.
 
         Args:
             file_path (str): Path to the PDF file.
+            with_pages (bool): Return (page number, link) pairs.
 
         Returns:
             list: A list of extracted PDF links (URIs).
         """
         links = []
-        with pdfplumber.open(file_path) as pdf:
+        with self._open_pdf(file_path) as pdf:
             # Iterate through PDF pages to extract annotations containing URIs (links)
             for page in pdf.pages:
                 if page.annots:
                     for annotation in page.annots:
                         if annotation.get("uri"):
-                            links.append(annotation["uri"])
+                            links.append((page.page_number, annotation["uri"]) if with_pages else annotation["uri"])
         return links
 
     def extract_docx_links(self):
@@ -89,37 +355,48 @@ class DataExtractor:
                 links.append(rel._target)
         return links
 
-    def extract_ppt_links(self):
+    def extract_ppt_links(self, with_pages=False):
         """
         Extract links from a PPTX file.
 
+        Args:
+            with_pages (bool): Return (slide number, link) pairs.
+
         Returns:
             list: A list of extracted hyperlinks in the PPTX presentation.
         """
         links = []
-        for slide in self.content.slides:
+        for slide_number, slide in self._numbered_slides():
             for shape in slide.shapes:
                 if shape.has_text_frame:
                     for paragraph in shape.text_frame.paragraphs:
                         for run in paragraph.runs:
                             # Check for hyperlinks in text runs and extract addresses
                             if run.hyperlink and run.hyperlink.address:
-                                links.append(run.hyperlink.address)
+                                address = run.hyperlink.address
+                                links.append((slide_number, address) if with_pages else address)
         return links
 
-    def extract_images(self):
+    def extract_images(self, with_pages=False):
         """
         Extract images from the loaded file.
 
+        Args:
+            with_pages (bool): Return (page number, image) pairs; the page number is None for DOCX.
+
         Returns:
             list: A list of extracted images (binary data).
         """
+        if self._uses_part_cache():
+            return self._cached_artifact('images', with_pages)
         if isinstance(self.file_loader, PDFLoader):
-            return self.extract_pdf_images(self.file_loader.file_path)
+            images = self.extract_pdf_images(self.file_loader.file_path)
+            return [(image['page_number'], image) for image in images] if with_pages else images
         elif isinstance(self.file_loader, DOCXLoader):
-            return self.extract_docx_images()
+            images = self.extract_docx_images()
+            return [(None, image) for image in images] if with_pages else images
         elif isinstance(self.file_loader, PPTLoader):
-            return self.extract_ppt_images()
+            return self.extract_ppt_images(with_pages)
         return []
 
     def extract_pdf_images(self, file_path):
@@ -133,72 +410,105 @@ class DataExtractor:
             list: A list of images extracted from the PDF.
         """
         images = []
-        with pdfplumber.open(file_path) as pdf:
+        with self._open_pdf(file_path) as pdf:
             # Extract images from each PDF page
             for page in pdf.pages:
                 if page.images:
-                    images.extend(page.images)
+                    images.extend(page.images if self.spill_bytes is None else map(self._spill_pdf_image, page.images))
+                if self.spill_bytes is not None:
+                    page.close()  # drop the page's cached layout objects before the next page
         return images
 
+    def _spill_pdf_image(self, image):
+        """Encode a large PDF image and move it into a temporary file."""
+        stream = image['stream']
+        if estimated_size(stream) <= self.spill_bytes:
+            return image
+        return dict(image, stream=SpilledImage(stream.attrs, encode_pdf_image(stream)))
+
     def extract_docx_images(self):
         """
         Extract images from a DOCX file.
 
         Returns:
-            list: A list of images (binary data) in the DOCX document.
+            list: A list of images (binary data, or temporary files above the spill threshold) in the DOCX document.
         """
         images = []
         for rel in self.content.part.rels.values():
             # Extract images based on relationships in the DOCX file
             if "image" in rel.target_ref:
-                images.append(rel.target_part.blob)
+                images.append(self._spill_blob(rel.target_part.blob))
         return images
 
-    def extract_ppt_images(self):
+    def extract_ppt_images(self, with_pages=False):
         """
         Extract images from a PPTX file.
 
+        Args:
+            with_pages (bool): Return (slide number, image) pairs.
+
         Returns:
-            list: A list of images (binary data) in the PPTX presentation.
+            list: A list of images (binary data, or temporary files above the spill threshold) in the PPTX presentation.
         """
         images = []
-        for slide in self.content.slides:
+        for slide_number, slide in self._numbered_slides():
             for shape in slide.shapes:
                 # Check if the shape is an image (Picture)
                 if shape.shape_type == 13:  # Shape type 13 corresponds to Picture
-                    images.append(shape.image.blob)
+                    blob = self._spill_blob(shape.image.blob)
+                    images.append((slide_number, blob) if with_pages else blob)
         return images
 
-    def extract_tables(self):
+    def _spill_blob(self, blob):
+        """Move a large DOCX or PPTX image into a temporary file, as the part cache does with large media."""
+        if self.spill_bytes is None or len(blob) <= self.spill_bytes:
+            return blob
+        spilled = tempfile.TemporaryFile()
+        spilled.write(blob)
+        spilled.seek(0)
+        return spilled
+
+    def extract_tables(self, with_pages=False):
         """
         Extract tables from the loaded file.
 
+        Args:
+            with_pages (bool): Return (page number, table) pairs; the page number is None for DOCX.
+
         Returns:
             list: A list of tables extracted from the file.
         """
+        tables = self._memoized('tables', self._extract_tables)
+        return tables if with_pages else [table for _, table in tables]
+
+    def _extract_tables(self):
+        if self._uses_part_cache():
+            return self._cached_artifact('tables', with_pages=True)
         if isinstance(self.file_loader, PDFLoader):
-            return self.extract_pdf_tables(self.file_loader.file_path)
+            return self.extract_pdf_tables(self.file_loader.file_path, with_pages=True)
         elif isinstance(self.file_loader, DOCXLoader):
-            return self.extract_docx_tables()
+            return [(None, table) for table in self.extract_docx_tables()]
         elif isinstance(self.file_loader, PPTLoader):
-            return self.extract_ppt_tables()
+            return self.extract_ppt_tables(with_pages=True)
         return []
 
-    def extract_pdf_tables(self, file_path):
+    def extract_pdf_tables(self, file_path, with_pages=False):
         """
         Extract tables from a PDF file.
 
         Args:
             file_path (str): Path to the PDF file.
+            with_pages (bool): Return (page number, table) pairs.
 
         Returns:
             list: A list of tables extracted from the PDF.
         """
         tables = []
-        with pdfplumber.open(file_path) as pdf:
+        with self._open_pdf(file_path) as pdf:
             # Extract tables from each PDF page
             for page in pdf.pages:
-                tables.extend(page.extract_tables())
+                page_tables = page.extract_tables()
+                tables.extend([(page.page_number, table) for table in page_tables] if with_pages else page_tables)
         return tables
 
     def extract_docx_tables(self):
@@ -215,20 +525,23 @@ class DataExtractor:
             tables.append(table_data)
         return tables
 
-    def extract_ppt_tables(self):
+    def extract_ppt_tables(self, with_pages=False):
         """
         Extract tables from a PPTX file.
 
+        Args:
+            with_pages (bool): Return (slide number, table) pairs.
+
         Returns:
             list: A list of tables extracted from the PPTX presentation.
         """
         tables = []
-        for slide in self.content.slides:
+        for slide_number, slide in self._numbered_slides():
             for shape in slide.shapes:
                 # Check if the shape contains a table and extract its content
                 if shape.has_table:
                     table_data = [[cell.text for cell in row.cells] for row in shape.table.rows]
-                    tables.append(table_data)
+                    tables.append((slide_number, table_data) if with_pages else table_data)
         return tables
 
     def extract_metadata(self):
@@ -238,12 +551,25 @@ class DataExtractor:
         Returns:
             dict: A dictionary containing extracted metadata.
         """
+        return self._memoized('metadata', self._extract_metadata)
+
+    def _extract_metadata(self):
+        if self._uses_part_cache():
+            return self._cached_metadata()
         if isinstance(self.file_loader, PDFLoader):
             return self.extract_pdf_metadata(self.file_loader.file_path)
         elif isinstance(self.file_loader, DOCXLoader) or isinstance(self.file_loader, PPTLoader):
             return self.extract_document_metadata()
         return {}
 
+    def _cached_metadata(self):
+        """Return the document metadata, parsing it only when the core properties part changed."""
+        metadata = self._cached_part('docProps/core.xml', self.extract_document_metadata)
+        for key in ('created', 'modified'):
+            if isinstance(metadata.get(key), str):
+                metadata[key] = datetime.fromisoformat(metadata[key])
+        return metadata
+
     def extract_pdf_metadata(self, file_path):
         """
         Extract metadata from a PDF file.
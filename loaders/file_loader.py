@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+import hashlib
 import os
 # Abstract Class for File Loading
 class FileLoader(ABC):
@@ -7,6 +8,24 @@ class FileLoader(ABC):
         """Verify if the file is valid."""
         return os.path.isfile(self.file_path)
 
+    def content_hash(self) -> str:
+        """
+        Compute the SHA-256 digest of the file contents.
+
+        The digest identifies a document independently of its path, so re-ingesting
+        the same file always maps to the same document record.
+
+        Returns:
+            str: The hex-encoded SHA-256 digest of the file.
+        """
+        if getattr(self, '_content_hash', None) is None:
+            digest = hashlib.sha256()
+            with open(self.file_path, 'rb') as file:
+                for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            self._content_hash = digest.hexdigest()
+        return self._content_hash
+
     @abstractmethod
     def load_file(self):
         """Load the file and retrieve its content."""
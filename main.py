@@ -1,9 +1,26 @@
 from loaders.pdf_loader import PDFLoader
 from loaders.docx_loader import DOCXLoader
 from loaders.ppt_loader import PPTLoader
-from data_extractor import DataExtractor
+from data_extractor import DataExtractor, ExtractionRequest, FIDELITY_LEVELS, KINDS
 from storage.storage import Storage
 from storage.storage import StorageSQL
+from storage.blob_store import create_blob_store
+from storage.compression import CompressionPolicy
+from storage.bundle import StorageBundle
+from storage.part_cache import PartCache
+from storage.image_dedup import ImageDeduplicator
+from pipeline.journal import BatchJournal, QUEUED, EXTRACTING, FAILED
+from pipeline.worker import WorkerLimits, WorkerFailure
+from pipeline.scheduler import BatchScheduler, CostModel, report_costs
+from pipeline.governor import MemoryGovernor
+from pipeline.probe import probe_document
+from pipeline.job_queue import JobQueue, QueueWorkerNode
+from pipeline.watcher import DirectoryWatcher, WatchDaemon
+from pipeline.service import ExtractionService
+import argparse
+import asyncio
+import json
+import mysql.connector
 import os
 from dotenv import load_dotenv
 import shutil
@@ -21,7 +38,58 @@ def clear_output_folder(folder_path):
     else:
         os.makedirs(folder_path)  # Create the directory if it doesn't exist
 
-def process_file(loader_class, db_path, base_output_folder):
+_sinks = {}
+
+def get_sinks():
+    """
+    Set up the storage sink configuration once per process and reuse it for every document.
+
+    Long-lived workers (batch workers and the service pool) keep their database
+    connection open between documents instead of reconnecting for each file.
+
+    Returns:
+        dict: The open database connection ('conn'), the blob store ('blob_store'), the
+            compression policy ('compression'), the filesystem output format ('output_format')
+            the DOCX/PPTX part cache ('part_cache'), the image spill threshold in MB ('image_spill_mb')
+            and the near-duplicate image deduplicator ('image_dedup').
+    """
+    if not _sinks or not _sinks['conn'].is_connected():
+        # Get the database config from the environment variables
+        db_config = {
+            'host': os.getenv('host'),
+            'user': os.getenv('user'),
+            'password': os.getenv('password'),
+            'database': os.getenv('database')
+        }
+        _sinks['conn'] = mysql.connector.connect(**db_config)
+
+        # Store image bytes out of line when a blob store location is configured
+        _sinks['blob_store'] = None
+        if os.getenv('blob_store'):
+            _sinks['blob_store'] = create_blob_store(os.getenv('blob_store'), os.getenv('blob_store_endpoint'))
+
+        # Compress text-heavy artifacts when a compression spec such as "zstd:text=19" is configured
+        _sinks['compression'] = CompressionPolicy.from_spec(os.getenv('compression'))
+
+        # Write one bundle file per document ("bundle" or "bundle-msgpack") instead of a file tree
+        _sinks['output_format'] = os.getenv('output_format', 'files')
+
+        # Cache DOCX/PPTX results per package part so re-ingesting an edited file only parses what changed
+        if 'part_cache' not in _sinks:
+            _sinks['part_cache'] = PartCache(os.getenv('part_cache')) if os.getenv('part_cache') else None
+
+        # Keep images larger than this in temporary files instead of memory
+        _sinks['image_spill_mb'] = float(os.getenv('image_spill_mb', '16'))
+
+        # Cluster near-duplicate images ("clusters") and optionally store one per cluster ("representatives")
+        _sinks['image_dedup'] = ImageDeduplicator.from_spec(os.getenv('image_dedup'))
+    return _sinks
+
+def warm_up_worker():
+    """Initialize the storage sinks in a worker process before it receives documents."""
+    get_sinks()
+
+def process_file(loader_class, db_path, base_output_folder, request=None, with_results=False):
     """
     Process a file with the specified loader, extracting data and saving it to both a database and the local filesystem.
 
@@ -29,73 +97,399 @@ def process_file(loader_class, db_path, base_output_folder):
         loader_class: An instance of a file loader (PDFLoader, DOCXLoader, or PPTLoader) initialized with the file path.
         db_path: Path to the MySQL database for storing extracted data.
         base_output_folder: Directory path where extracted data will be saved on the filesystem.
-    """
-    extractor = DataExtractor(loader_class)
+        request: The ExtractionRequest selecting artifact kinds and pages; None extracts everything.
+        with_results: Also return the extracted data under 'results' (see `extraction_results`).
 
-    # Get the database config from the environment variables
-    db_config = {
-        'host': os.getenv('host'),
-        'user': os.getenv('user'),
-        'password': os.getenv('password'),
-        'database': os.getenv('database')
-    }
+    Returns:
+        dict: A summary of the stored document (path, document id and artifact kinds).
+
+    Raises:
+        StorageError: If any artifact could not be saved; the document should be recorded as failed.
+    """
+    sinks = get_sinks()
+    extractor = DataExtractor(loader_class, request, sinks['part_cache'], sinks['image_spill_mb'])
 
     # Save data to SQL database
-    sql_storage = StorageSQL(extractor, db_config)
-    sql_storage.save_text()          
-    sql_storage.save_links()         
-    sql_storage.save_images()        
-    sql_storage.save_tables()        
-    sql_storage.save_metadata()      
-    sql_storage.close()              
+    sql_storage = StorageSQL(extractor, None, sinks['blob_store'], sinks['compression'], conn=sinks['conn'],
+                             image_dedup=sinks['image_dedup'])
+    try:
+        sql_storage.save_requested()
+    finally:
+        sql_storage.close()
 
     # Save data to the filesystem
-    fs_storage = Storage(extractor, base_output_folder)
-    fs_storage.save_text()          
-    fs_storage.save_links()         
-    fs_storage.save_images()        
-    fs_storage.save_tables()        
-    fs_storage.save_metadata()      
+    if sinks['output_format'].startswith('bundle'):
+        manifest_format = 'msgpack' if sinks['output_format'] == 'bundle-msgpack' else 'json'
+        fs_storage = StorageBundle(extractor, base_output_folder, sinks['compression'], manifest_format,
+                                   sinks['image_dedup'])
+    else:
+        fs_storage = Storage(extractor, base_output_folder, sinks['compression'], sinks['image_dedup'])
+    fs_storage.save_requested()
+
+    summary = {
+        'file_path': loader_class.file_path,
+        'document_id': loader_class.content_hash(),
+        'kinds': extractor.request.kinds,
+    }
+    if with_results:
+        summary['results'] = extraction_results(extractor)
+    return summary
 
-def main():
+def extraction_results(extractor):
     """
-    Main function that prompts the user for file paths and initiates the extraction process for each file type.
-    Clears the output folder before starting the extraction process.
+    Return the requested artifacts of a processed document in JSON-serialisable form.
+
+    Text, links, tables and metadata were already extracted for storage and are not
+    extracted again. Image bytes are not included; they are read back by document id
+    and position (`StorageSQL.open_image`).
+
+    Returns:
+        dict: 'text', 'links' and 'tables' (as {'page_number', ...} records) and 'metadata',
+            for the requested kinds.
     """
-    db_path = 'extracted_data.db'  # Path to the database
-    base_output_folder = 'extracted_output'  # Folder where extracted data will be saved
+    results = {}
+    kinds = extractor.request.kinds
+    if 'text' in kinds:
+        results['text'] = extractor.extract_text()
+    if 'links' in kinds:
+        results['links'] = [{'page_number': page_number, 'link': link}
+                            for page_number, link in extractor.extract_links(with_pages=True)]
+    if 'tables' in kinds:
+        results['tables'] = [{'page_number': page_number, 'rows': table}
+                             for page_number, table in extractor.extract_tables(with_pages=True)]
+    if 'metadata' in kinds:
+        results['metadata'] = extractor.extract_metadata()
+    return results
 
-    # Clear the output folder before starting the extraction process
-    clear_output_folder(base_output_folder)
+def get_loader(file_path):
+    """
+    Pick the loader matching a file's extension.
 
-    # Ask user for file paths
-    file_paths = input("Enter the file paths (separated by commas): ").split(',')
-    
-    for file_path in file_paths:
-        file_path = file_path.strip()  # Clean up any surrounding spaces
+    Args:
+        file_path: Path to the document.
+
+    Returns:
+        An instance of PDFLoader, DOCXLoader or PPTLoader, or None if the format is unsupported.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.pdf':
+        return PDFLoader(file_path)
+    elif extension == '.docx':
+        return DOCXLoader(file_path)
+    elif extension == '.pptx':
+        return PPTLoader(file_path)
+    return None
+
+def process_path(file_path, db_path, base_output_folder, request=None):
+    """
+    Load a file by path and process it; this is the task run inside supervised workers.
+
+    Args:
+        file_path: Path to the document.
+        db_path: Path to the MySQL database for storing extracted data.
+        base_output_folder: Directory path where extracted data will be saved on the filesystem.
+        request: The ExtractionRequest selecting artifact kinds and pages; None extracts everything.
+    """
+    loader = get_loader(file_path)
+    if loader is None:
+        raise ValueError(f"Unsupported file format: {file_path}")
+    return process_file(loader, db_path, base_output_folder, request)
+
+def serve_path(file_path, db_path, base_output_folder, request=None):
+    """
+    Process a document for the extraction service and return its extracted data with the summary.
 
+    Args:
+        file_path: Path to the document.
+        db_path: Path to the MySQL database for storing extracted data.
+        base_output_folder: Directory path where extracted data will be saved on the filesystem.
+        request: The ExtractionRequest selecting artifact kinds and pages; None extracts everything.
+    """
+    loader = get_loader(file_path)
+    if loader is None:
+        raise ValueError(f"Unsupported file format: {file_path}")
+    return process_file(loader, db_path, base_output_folder, request, with_results=True)
+
+def parse_args(argv=None):
+    """
+    Parse command-line arguments.
+
+    Args:
+        argv: Argument list; None uses sys.argv.
+    """
+    parser = argparse.ArgumentParser(description="Extract text, links, images, tables and metadata from documents.")
+    parser.add_argument('files', nargs='*', help="Documents to process; prompts for paths when omitted.")
+    parser.add_argument('--output', default='extracted_output', help="Folder where extracted data is saved.")
+    parser.add_argument('--journal', default='batch_journal.db', help="Checkpoint journal recording per-document state.")
+    parser.add_argument('--resume', action='store_true',
+                        help="Resume the previous batch: keep existing output and skip documents already stored.")
+    parser.add_argument('--retry-failed', action='store_true',
+                        help="With --resume, only reprocess documents that failed in the previous batch.")
+    parser.add_argument('--kinds', help=f"Comma-separated artifact kinds to extract ({','.join(KINDS)}); default all.")
+    parser.add_argument('--pages', help="Pages or slides to extract from, e.g. '1-3,7'; default all.")
+    parser.add_argument('--fidelity', choices=FIDELITY_LEVELS, default='full',
+                        help="PDF text fidelity: 'raw' (fastest, no layout analysis), 'lines' "
+                             "(word and line grouping, no reading order) or 'full' (default).")
+    parser.add_argument('--probe', action='store_true',
+                        help="Only summarize the documents from their structure (pages, text layer, images, "
+                             "tables, links, encryption, estimated cost) as JSON lines, without extracting them.")
+    parser.add_argument('--serve', action='store_true',
+                        help="Run as a long-lived extraction service instead of processing a batch.")
+    parser.add_argument('--host', default='127.0.0.1', help="Interface the service listens on.")
+    parser.add_argument('--port', type=int, default=8765, help="TCP port the service listens on.")
+    parser.add_argument('--socket', help="Serve on this Unix socket instead of TCP.")
+    parser.add_argument('--serve-root', action='append', default=[],
+                        help="Directory whose documents the service may read with /extract?path= (repeatable); "
+                             "without one, only uploads are accepted.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes for batches and the service.")
+    parser.add_argument('--cost-model',
+                        help="Cost estimator coefficients, e.g. 'base=0.2,pages=0.05,megabytes=0.3,images=0.02'.")
+    parser.add_argument('--cost-report', help="Save predicted versus actual cost per document to this CSV file.")
+    parser.add_argument('--queue',
+                        help="Shared job queue: 'mysql' for the configured database, or a SQLite file path. "
+                             "Files given on the command line are added to the queue.")
+    parser.add_argument('--queue-worker', action='store_true', help="Claim and process documents from --queue.")
+    parser.add_argument('--follow', action='store_true',
+                        help="With --queue-worker, keep waiting for new documents instead of exiting when drained.")
+    parser.add_argument('--lease', type=float, default=60, help="Seconds a queue claim lasts without a heartbeat.")
+    parser.add_argument('--watch', action='append',
+                        help="Watch this directory and process new documents as they arrive (repeatable).")
+    parser.add_argument('--settle', type=float, default=2.0,
+                        help="Seconds a watched file must stay unchanged before it is processed.")
+    parser.add_argument('--poll-interval', type=float, default=1.0,
+                        help="Seconds between directory scans when inotify is unavailable.")
+    parser.add_argument('--stats-file', help="JSON file where the watch daemon writes queue depth and latency stats.")
+    parser.add_argument('--timeout', type=float, help="Wall-time limit in seconds for processing one document.")
+    parser.add_argument('--cpu-limit', type=int, help="CPU-time limit in seconds for processing one document.")
+    parser.add_argument('--memory-limit', type=int, help="Memory (address space) limit of the worker process in MB.")
+    parser.add_argument('--memory-budget', type=float,
+                        help="Memory in MB all batch workers may use together; documents are held back "
+                             "until their estimated footprint fits.")
+    args = parser.parse_args(argv)
+    try:
+        args.request = ExtractionRequest.from_spec(args.kinds, args.pages, args.fidelity)
+    except ValueError as e:
+        parser.error(str(e))  # prints the usage and exits with status 2
+    return args
+
+def run_batch(file_paths, journal, scheduler, db_path, base_output_folder, request=None, cost_report=None):
+    """
+    Process a batch of files, recording each document's progress in the journal.
+
+    Documents already stored with unchanged contents are skipped, so re-running an
+    interrupted batch picks up where it stopped. The scheduler dispatches the rest to
+    its supervised workers, most expensive first; a document that hangs or exhausts
+    its limits is recorded as failed and the batch moves on.
+
+    Args:
+        file_paths: Paths of the documents to process.
+        journal: The BatchJournal recording per-document state.
+        scheduler: The BatchScheduler that dispatches documents to workers.
+        db_path: Path to the MySQL database for storing extracted data.
+        base_output_folder: Directory path where extracted data will be saved on the filesystem.
+        request: The ExtractionRequest selecting artifact kinds and pages; None extracts everything.
+        cost_report: Optional CSV path for the predicted versus actual cost of each document.
+    """
+    journal.enqueue(file_paths)
+    content_hashes = {}
+    for file_path in file_paths:
         if not os.path.isfile(file_path):
             print(f"File not found: {file_path}")
+            journal.mark_failed(file_path, "File not found")
             continue
-        
+
         # Determine the file type and assign the appropriate loader
-        if file_path.endswith('.pdf'):
-            loader = PDFLoader(file_path)
-        elif file_path.endswith('.docx'):
-            loader = DOCXLoader(file_path)
-        elif file_path.endswith('.pptx'):
-            loader = PPTLoader(file_path)
-        else:
+        loader = get_loader(file_path)
+        if loader is None:
             print(f"Unsupported file format: {file_path}")
+            journal.mark_failed(file_path, "Unsupported file format")
+            continue
+
+        content_hash = loader.content_hash()
+        if journal.is_stored(file_path, content_hash):
+            print(f"Already processed, skipping: {file_path}")
             continue
-        
+        content_hashes[file_path] = content_hash
+
+    def process(worker, file_path):
         # Process the file
+        journal.mark_extracting(file_path, content_hashes[file_path])
         try:
-            process_file(loader, db_path, base_output_folder)
+            worker.run(process_path, file_path, db_path, base_output_folder, request)
+            journal.mark_stored(file_path)
             print(f"Processed file: {file_path}")
-        except Exception as e:
+        except WorkerFailure as e:
+            journal.mark_failed(file_path, e)
             print(f"Error processing file {file_path}: {e}")
 
+    records = scheduler.run(list(content_hashes), process)
+    report_costs(records, cost_report)
+
+def run_probe(file_paths, cost_model=None):
+    """
+    Print a structural summary of each document as one JSON object per line.
+
+    Args:
+        file_paths: Paths of the documents to probe.
+        cost_model: The CostModel used for the estimated processing time.
+    """
+    for file_path in file_paths:
+        print(json.dumps(probe_document(file_path, cost_model)), flush=True)
+
+def run_queue_mode(args, limits, db_path, base_output_folder, request=None):
+    """
+    Submit documents to a shared job queue and/or work on it as one of many worker nodes.
+
+    Args:
+        args: Parsed command-line arguments.
+        limits: The WorkerLimits applied to each document.
+        db_path: Path to the MySQL database for storing extracted data.
+        base_output_folder: Directory path where extracted data will be saved on the filesystem.
+        request: The ExtractionRequest selecting artifact kinds and pages; None extracts everything.
+    """
+    db_config = {
+        'host': os.getenv('host'),
+        'user': os.getenv('user'),
+        'password': os.getenv('password'),
+        'database': os.getenv('database')
+    }
+    job_queue = JobQueue.open(args.queue, db_config)
+    try:
+        if args.files:
+            # Store absolute paths so nodes with a different working directory find the files
+            file_paths = [os.path.abspath(file_path) for file_path in args.files]
+            cost_model = CostModel.from_spec(args.cost_model)
+            priorities = {file_path: cost_model.estimate(file_path)['predicted']
+                          for file_path in file_paths if os.path.isfile(file_path)}
+            job_queue.enqueue(file_paths, priorities)
+            print(f"Queued {len(file_paths)} documents: {job_queue.stats()}")
+        if args.queue_worker:
+            os.makedirs(base_output_folder, exist_ok=True)
+            node = QueueWorkerNode(job_queue, args.workers, limits, args.lease)
+
+            def process(worker, file_path):
+                worker.run(process_path, file_path, db_path, base_output_folder, request)
+
+            try:
+                node.run(process, follow=args.follow)
+            finally:
+                node.close()
+            print(f"Queue: {job_queue.stats()}")
+    finally:
+        job_queue.close()
+
+def run_watch_mode(args, limits, db_path, base_output_folder, request=None):
+    """
+    Run as a daemon that processes documents as soon as they land in the watched directories.
+
+    The checkpoint journal is kept across restarts, so documents already stored with
+    unchanged contents are not processed again.
+
+    Args:
+        args: Parsed command-line arguments.
+        limits: The WorkerLimits applied to each document.
+        db_path: Path to the MySQL database for storing extracted data.
+        base_output_folder: Directory path where extracted data will be saved on the filesystem.
+        request: The ExtractionRequest selecting artifact kinds and pages; None extracts everything.
+    """
+    os.makedirs(base_output_folder, exist_ok=True)
+    journal = BatchJournal(args.journal)
+    watcher = DirectoryWatcher(args.watch, args.settle, args.poll_interval)
+    daemon = WatchDaemon(watcher, args.workers, limits, args.stats_file)
+
+    def process(worker, file_path):
+        loader = get_loader(file_path)
+        if loader is None:
+            print(f"Unsupported file type, skipping: {file_path}")
+            return False
+        try:
+            content_hash = loader.content_hash()
+        except OSError as e:
+            print(f"Error reading file {file_path}: {e}")
+            return False
+        if journal.is_stored(file_path, content_hash):
+            print(f"Already processed, skipping: {file_path}")
+            return True
+        journal.mark_extracting(file_path, content_hash)
+        try:
+            worker.run(process_path, file_path, db_path, base_output_folder, request)
+            journal.mark_stored(file_path)
+            print(f"Processed file: {file_path}")
+            return True
+        except WorkerFailure as e:
+            journal.mark_failed(file_path, e)
+            print(f"Error processing file {file_path}: {e}")
+            return False
+
+    try:
+        daemon.run(process)
+    except KeyboardInterrupt:
+        print("Watch daemon stopped.")
+    finally:
+        daemon.close()
+        journal.close()
+
+def main(argv=None):
+    """
+    Main function that collects file paths and initiates the extraction process for each file type.
+    Clears the output folder before starting the extraction process, unless resuming a previous batch.
+    """
+    args = parse_args(argv)
+    db_path = 'extracted_data.db'  # Path to the database
+    base_output_folder = args.output  # Folder where extracted data will be saved
+    request = args.request
+    limits = WorkerLimits(args.timeout, args.cpu_limit, args.memory_limit)
+
+    if args.probe:
+        run_probe(args.files, CostModel.from_spec(args.cost_model))
+        return
+
+    if args.serve:
+        # Keep pre-warmed workers around and extract documents as they are submitted
+        os.makedirs(base_output_folder, exist_ok=True)
+        service = ExtractionService(serve_path, (db_path, base_output_folder), args.workers, limits, warm_up_worker,
+                                    allowed_roots=args.serve_root)
+        try:
+            asyncio.run(service.serve(args.host, args.port, args.socket))
+        except KeyboardInterrupt:
+            print("Extraction service stopped.")
+        return
+
+    if args.watch:
+        run_watch_mode(args, limits, db_path, base_output_folder, request)
+        return
+
+    if args.queue:
+        run_queue_mode(args, limits, db_path, base_output_folder, request)
+        return
+
+    journal = BatchJournal(args.journal)
+    governor = MemoryGovernor(args.memory_budget) if args.memory_budget else None
+    scheduler = BatchScheduler(args.workers, limits, CostModel.from_spec(args.cost_model), governor)
+
+    if args.resume:
+        # Keep existing output; finished documents are skipped using the journal
+        states = [FAILED] if args.retry_failed else [QUEUED, EXTRACTING, FAILED]
+        file_paths = args.files or journal.paths(states)
+        print(f"Resuming batch: {journal.summary()}")
+    else:
+        # Clear the output folder before starting the extraction process
+        clear_output_folder(base_output_folder)
+        journal.reset()
+        file_paths = args.files
+        if not file_paths:
+            # Ask user for file paths
+            file_paths = input("Enter the file paths (separated by commas): ").split(',')
+
+    file_paths = [file_path.strip() for file_path in file_paths if file_path.strip()]
+    try:
+        run_batch(file_paths, journal, scheduler, db_path, base_output_folder, request, args.cost_report)
+        print(f"Batch finished: {journal.summary()}")
+    finally:
+        scheduler.close()
+        journal.close()
+
 # If the script is executed directly, call the main function to begin processing
 if __name__ == "__main__":
     main()
@@ -0,0 +1,114 @@
+import os
+import threading
+
+MEGABYTE = 1024 * 1024
+try:
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):  # not available on every platform
+    PAGE_SIZE = 4096
+
+
+def process_rss_mb(pid):
+    """
+    Return the resident set size of a process in megabytes.
+
+    Returns:
+        float: The RSS, or None where /proc is unavailable or the process is gone.
+    """
+    try:
+        with open(f'/proc/{pid}/statm') as file:
+            resident_pages = int(file.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * PAGE_SIZE / MEGABYTE
+
+
+class MemoryGovernor:
+    """
+    Admit documents to workers only while they fit a global memory budget.
+
+    Every document gets an estimated footprint from its structure (pages, size,
+    embedded images). A busy worker counts as the larger of its measured RSS and
+    its RSS before the document plus the footprint reserved for it; an idle worker
+    counts its measured RSS. A document is admitted when the total stays within the
+    budget, or when nothing else is running (so an oversized document still gets
+    processed, alone). Workers whose RSS stays high after a document are recycled,
+    returning memory the allocator kept.
+    """
+
+    def __init__(self, budget_mb, base=60.0, pages=1.5, megabytes=6.0, images=2.0, recycle_mb=None):
+        """
+        Args:
+            budget_mb (float): Memory all workers together may use, in megabytes.
+            base (float): Estimated megabytes per document regardless of its contents.
+            pages (float): Estimated megabytes per page or slide.
+            megabytes (float): Estimated megabytes per megabyte of input (parsed objects and decoded streams).
+            images (float): Estimated megabytes per embedded image.
+            recycle_mb (float): Recycle a worker whose idle RSS exceeds this; None recycles workers
+                that stay above an equal share of the budget.
+        """
+        self.budget_mb = budget_mb
+        self.base = base
+        self.weights = {'pages': pages, 'megabytes': megabytes, 'images': images}
+        self.recycle_mb = recycle_mb
+        self._reserved = {}  # worker -> (RSS before the document, reserved footprint)
+        self._condition = threading.Condition()
+
+    def footprint(self, features):
+        """Return the estimated peak memory of a document in megabytes from its features."""
+        return self.base + sum(weight * features.get(name, 0) for name, weight in self.weights.items())
+
+    def _rss(self, worker):
+        if worker.process is None:
+            return 0.0
+        return process_rss_mb(worker.process.pid) or 0.0
+
+    def _usage(self, workers):
+        total = 0.0
+        for worker in workers:
+            rss = self._rss(worker)
+            if worker in self._reserved:
+                before, footprint = self._reserved[worker]
+                rss = max(rss, before + footprint)
+            total += rss
+        return total
+
+    def try_admit(self, worker, workers, footprint):
+        """
+        Reserve memory for a document on `worker` if it fits the budget.
+
+        Args:
+            worker (SupervisedWorker): The worker that would process the document.
+            workers (list): All workers sharing the budget.
+            footprint (float): The document's estimated footprint in megabytes.
+
+        Returns:
+            bool: True if the document was admitted.
+        """
+        with self._condition:
+            if self._reserved and self._usage(workers) + footprint > self.budget_mb:
+                return False
+            self._reserved[worker] = (self._rss(worker), footprint)
+            return True
+
+    def release(self, worker, workers):
+        """
+        Release a worker's reservation and recycle it if it kept too much memory.
+
+        Recycling only stops the process; its replacement is started on the worker's
+        next document, from a dispatcher thread, so it goes through a fork server rather
+        than a plain fork (see `SupervisedWorker.start`).
+        """
+        with self._condition:
+            self._reserved.pop(worker, None)
+            limit = self.recycle_mb or self.budget_mb / max(1, len(workers))
+            rss = self._rss(worker)
+            if rss > limit:
+                print(f"Recycling worker holding {rss:.0f} MB (limit {limit:.0f} MB)")
+                worker.recycle()
+            self._condition.notify_all()
+
+    def wait(self, timeout=1.0):
+        """Wait until a reservation is released or `timeout` passes (RSS may drop in the meantime)."""
+        with self._condition:
+            self._condition.wait(timeout)
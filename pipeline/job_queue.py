@@ -0,0 +1,360 @@
+import hashlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from pipeline.worker import SupervisedWorker
+
+PENDING = 'pending'
+CLAIMED = 'claimed'
+DONE = 'done'
+FAILED = 'failed'
+
+SQLITE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS queue_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        file_path TEXT NOT NULL UNIQUE,
+        priority REAL NOT NULL DEFAULT 0,
+        state TEXT NOT NULL,
+        worker_id TEXT,
+        lease_expires_at REAL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        updated_at REAL NOT NULL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_queue_jobs_claim ON queue_jobs (state, priority DESC, id)',
+    'CREATE INDEX IF NOT EXISTS idx_queue_jobs_lease ON queue_jobs (state, lease_expires_at)',
+]
+
+MYSQL_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS queue_jobs (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        file_path TEXT NOT NULL,
+        path_hash CHAR(64) NOT NULL,
+        priority DOUBLE NOT NULL DEFAULT 0,
+        state VARCHAR(16) NOT NULL,
+        worker_id VARCHAR(255),
+        lease_expires_at DOUBLE,
+        attempts INT NOT NULL DEFAULT 0,
+        error TEXT,
+        updated_at DOUBLE NOT NULL,
+        UNIQUE KEY uq_queue_jobs_path_hash (path_hash),
+        INDEX idx_queue_jobs_claim (state, priority DESC, id),
+        INDEX idx_queue_jobs_lease (state, lease_expires_at)
+    )
+    ''',
+]
+
+
+def path_hash(file_path):
+    """Return the hex SHA-256 of a path, the key that keeps queued paths unique in MySQL."""
+    return hashlib.sha256(file_path.encode('utf-8')).hexdigest()
+
+
+class JobQueue:
+    """
+    A durable queue of documents shared by any number of worker nodes.
+
+    Workers claim a document with a time-limited lease and keep renewing it with
+    heartbeats while they work. If a node dies, its lease runs out and the
+    document becomes claimable again; after `max_attempts` expired or failed
+    attempts it is marked failed instead.
+
+    The queue lives in a database table, either in the project's MySQL database
+    or, as a local stand-in, in a SQLite file (only share it between processes on
+    one host or on a filesystem with working locks).
+    """
+
+    def __init__(self, conn, dialect, max_attempts=3):
+        """
+        Args:
+            conn: An open DB-API connection (sqlite3 in autocommit mode, or mysql.connector).
+            dialect (str): 'sqlite' or 'mysql'.
+            max_attempts (int): Attempts a document gets before it is marked failed.
+        """
+        self.conn = conn
+        self.dialect = dialect
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._placeholder = '?' if dialect == 'sqlite' else '%s'
+        cursor = self.conn.cursor()
+        for sql in SQLITE_SCHEMA if dialect == 'sqlite' else MYSQL_SCHEMA:
+            cursor.execute(sql)
+        if dialect == 'mysql':
+            self.conn.commit()
+
+    @classmethod
+    def open(cls, location, db_config=None, max_attempts=3):
+        """
+        Open a queue from a location string.
+
+        Args:
+            location (str): 'mysql' to use the MySQL database described by `db_config`,
+                otherwise the path of a SQLite file (optionally prefixed with 'sqlite:///').
+            db_config (dict): Connection arguments for mysql.connector.
+            max_attempts (int): Attempts a document gets before it is marked failed.
+        """
+        if location == 'mysql':
+            import mysql.connector
+            return cls(mysql.connector.connect(**db_config), 'mysql', max_attempts)
+        path = location[len('sqlite:///'):] if location.startswith('sqlite:///') else location
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return cls(conn, 'sqlite', max_attempts)
+
+    def _sql(self, sql):
+        return sql.replace('?', self._placeholder)
+
+    def _begin(self, cursor):
+        # SQLite: take the write lock up front so concurrent claims serialize.
+        # MySQL: READ COMMITTED, so a locking read only locks the rows it returns
+        # instead of every row (and gap) it scanned, and claims don't queue up behind each other
+        if self.dialect == 'sqlite':
+            cursor.execute('BEGIN IMMEDIATE')
+        else:
+            self.conn.start_transaction(isolation_level='READ COMMITTED')
+
+    def _commit(self, cursor):
+        if self.dialect == 'sqlite':
+            cursor.execute('COMMIT')
+        else:
+            self.conn.commit()
+
+    def _rollback(self, cursor):
+        if self.dialect == 'sqlite':
+            cursor.execute('ROLLBACK')
+        else:
+            self.conn.rollback()
+
+    def _execute_in_transaction(self, statements):
+        """Run (sql, params) pairs in one transaction and return the last cursor's row count."""
+        with self._lock:
+            cursor = self.conn.cursor()
+            self._begin(cursor)
+            try:
+                rowcount = 0
+                for sql, params in statements:
+                    cursor.execute(self._sql(sql), params)
+                    rowcount = cursor.rowcount
+                self._commit(cursor)
+            except Exception:
+                self._rollback(cursor)
+                raise
+            return rowcount
+
+    def enqueue(self, file_paths, priorities=None):
+        """
+        Add documents to the queue; documents already queued keep their state.
+
+        Args:
+            file_paths (list): The documents to add.
+            priorities (dict): Optional map of path to priority (e.g. the estimated cost);
+                higher priorities are claimed first.
+        """
+        priorities = priorities or {}
+        now = time.time()
+        if self.dialect == 'sqlite':
+            self._execute_in_transaction([
+                ('INSERT OR IGNORE INTO queue_jobs (file_path, priority, state, attempts, updated_at) '
+                 'VALUES (?, ?, ?, 0, ?)',
+                 (file_path, priorities.get(file_path, 0), PENDING, now))
+                for file_path in file_paths
+            ])
+            return
+        self._execute_in_transaction([
+            ('INSERT IGNORE INTO queue_jobs (file_path, path_hash, priority, state, attempts, updated_at) '
+             'VALUES (?, ?, ?, ?, 0, ?)',
+             (file_path, path_hash(file_path), priorities.get(file_path, 0), PENDING, now))
+            for file_path in file_paths
+        ])
+
+    def requeue_expired(self):
+        """
+        Return documents whose lease expired to the queue.
+
+        A document that already used all its attempts is marked failed instead.
+        This runs in its own short transaction, so the claim itself only ever
+        reads pending documents.
+
+        Returns:
+            int: The number of expired leases.
+        """
+        now = time.time()
+        return self._execute_in_transaction([(
+            'UPDATE queue_jobs SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, '
+            'error = CASE WHEN attempts >= ? THEN ? ELSE ? END, lease_expires_at = NULL, updated_at = ? '
+            'WHERE state = ? AND lease_expires_at < ?',
+            (self.max_attempts, FAILED, PENDING, self.max_attempts, "Lease expired on the final attempt",
+             "Lease expired", now, CLAIMED, now))])
+
+    def claim(self, worker_id, lease_seconds):
+        """
+        Claim the highest-priority pending document.
+
+        Expired leases are first returned to the queue (see `requeue_expired`).
+        The claim then walks the (state, priority, id) index from its top and,
+        on MySQL, skips rows other nodes are claiming at the same moment.
+
+        Returns:
+            dict: The claimed job ('id', 'file_path', 'attempts'), or None if nothing is available.
+        """
+        self.requeue_expired()
+        now = time.time()
+        lock_clause = ' FOR UPDATE SKIP LOCKED' if self.dialect == 'mysql' else ''
+        with self._lock:
+            cursor = self.conn.cursor()
+            self._begin(cursor)
+            try:
+                cursor.execute(self._sql(
+                    'SELECT id, file_path, attempts FROM queue_jobs WHERE state = ? '
+                    'ORDER BY priority DESC, id LIMIT 1' + lock_clause),
+                    (PENDING,))
+                row = cursor.fetchone()
+                if row is not None:
+                    cursor.execute(self._sql(
+                        'UPDATE queue_jobs SET state = ?, worker_id = ?, lease_expires_at = ?, '
+                        'attempts = attempts + 1, updated_at = ? WHERE id = ?'),
+                        (CLAIMED, worker_id, now + lease_seconds, now, row[0]))
+                self._commit(cursor)
+            except Exception:
+                self._rollback(cursor)
+                raise
+        if row is None:
+            return None
+        return {'id': row[0], 'file_path': row[1], 'attempts': row[2] + 1}
+
+    def heartbeat(self, job_id, worker_id, lease_seconds):
+        """
+        Extend the lease on a claimed document.
+
+        Returns:
+            bool: False if the lease was lost (it expired and another worker took the document).
+        """
+        now = time.time()
+        updated = self._execute_in_transaction([(
+            'UPDATE queue_jobs SET lease_expires_at = ?, updated_at = ? WHERE id = ? AND worker_id = ? AND state = ?',
+            (now + lease_seconds, now, job_id, worker_id, CLAIMED))])
+        return updated > 0
+
+    def complete(self, job_id, worker_id):
+        """Mark a claimed document as done."""
+        self._execute_in_transaction([(
+            'UPDATE queue_jobs SET state = ?, error = NULL, updated_at = ? WHERE id = ? AND worker_id = ?',
+            (DONE, time.time(), job_id, worker_id))])
+
+    def fail(self, job_id, worker_id, reason):
+        """Record a failed attempt; the document is requeued until it runs out of attempts."""
+        self._execute_in_transaction([(
+            'UPDATE queue_jobs SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, error = ?, '
+            'lease_expires_at = NULL, updated_at = ? WHERE id = ? AND worker_id = ?',
+            (self.max_attempts, FAILED, PENDING, str(reason), time.time(), job_id, worker_id))])
+
+    def stats(self):
+        """Return the number of documents in each state."""
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT state, COUNT(*) FROM queue_jobs GROUP BY state')
+            counts = dict.fromkeys((PENDING, CLAIMED, DONE, FAILED), 0)
+            counts.update(dict(cursor.fetchall()))
+            if self.dialect == 'mysql':
+                self.conn.commit()  # end the read snapshot so later calls see other nodes' writes
+        return counts
+
+    def close(self):
+        """Close the queue's database connection."""
+        self.conn.close()
+
+
+class QueueWorkerNode:
+    """
+    Run supervised workers that claim documents from a shared JobQueue.
+
+    Start one node per host; nodes coordinate only through the queue, so adding
+    hosts adds throughput.
+    """
+
+    def __init__(self, job_queue, workers=1, limits=None, lease_seconds=60, poll_interval=2.0):
+        """
+        Args:
+            job_queue (JobQueue): The shared queue.
+            workers (int): Number of worker processes on this node.
+            limits (WorkerLimits): Per-document limits applied in every worker.
+            lease_seconds (float): Lease length; heartbeats renew it every third of this.
+            poll_interval (float): Seconds to wait before polling an empty queue again.
+        """
+        self.job_queue = job_queue
+        self.workers = [SupervisedWorker(limits) for _ in range(max(1, workers))]
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.node_id = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self._held = {}
+        self._held_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def run(self, process, follow=False):
+        """
+        Claim and process documents until the queue is drained (or forever with `follow`).
+
+        Args:
+            process: Called as `process(worker, file_path)`; it should raise on failure.
+            follow (bool): Keep polling for new documents instead of stopping when the queue is empty.
+        """
+        for worker in self.workers:
+            worker.start()
+        heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        heartbeat.start()
+        threads = [threading.Thread(target=self._work_loop, args=(f'{self.node_id}-{index}', worker, process, follow),
+                                    daemon=True)
+                   for index, worker in enumerate(self.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        finally:
+            self._stop.set()
+            heartbeat.join()
+
+    def _work_loop(self, worker_id, worker, process, follow):
+        while not self._stop.is_set():
+            job = self.job_queue.claim(worker_id, self.lease_seconds)
+            if job is None:
+                stats = self.job_queue.stats()
+                if not follow and stats[PENDING] == 0 and stats[CLAIMED] == 0:
+                    return
+                # Wait for new work, or for a dead node's lease to expire
+                self._stop.wait(self.poll_interval)
+                continue
+            with self._held_lock:
+                self._held[job['id']] = worker_id
+            try:
+                process(worker, job['file_path'])
+                self.job_queue.complete(job['id'], worker_id)
+                print(f"Processed file: {job['file_path']}")
+            except Exception as e:
+                self.job_queue.fail(job['id'], worker_id, e)
+                print(f"Error processing file {job['file_path']} (attempt {job['attempts']}): {e}")
+            finally:
+                with self._held_lock:
+                    self._held.pop(job['id'], None)
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            with self._held_lock:
+                held = list(self._held.items())
+            for job_id, worker_id in held:
+                if not self.job_queue.heartbeat(job_id, worker_id, self.lease_seconds):
+                    print(f"Lost the lease on job {job_id}; another worker may be processing it.")
+
+    def close(self):
+        """Stop the worker processes."""
+        for worker in self.workers:
+            worker.close()
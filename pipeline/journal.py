@@ -0,0 +1,139 @@
+import os
+import sqlite3
+import threading
+import time
+
+QUEUED = 'queued'
+EXTRACTING = 'extracting'
+STORED = 'stored'
+FAILED = 'failed'
+STATES = (QUEUED, EXTRACTING, STORED, FAILED)
+
+
+class BatchJournal:
+    """
+    A durable record of per-document progress through a batch run.
+
+    The journal is a small SQLite database. Every state change is committed
+    before the run moves on, so after a crash the journal shows which documents
+    are stored, which failed, and which were interrupted while being extracted.
+    """
+
+    def __init__(self, journal_path):
+        """
+        Open (or create) a journal.
+
+        Args:
+            journal_path (str): Path to the SQLite file holding the journal.
+        """
+        self.journal_path = journal_path
+        directory = os.path.dirname(journal_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Parallel batches update the journal from several dispatcher threads
+        self.conn = sqlite3.connect(journal_path, check_same_thread=False)
+        self._lock = threading.RLock()
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=FULL')
+        self.conn.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS batch_documents (
+                file_path TEXT PRIMARY KEY,
+                content_hash TEXT,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated_at REAL NOT NULL
+            )
+            '''
+        )
+        self.conn.commit()
+
+    def reset(self):
+        """Forget all recorded documents, e.g. before a fresh (non-resumed) batch."""
+        with self._lock:
+            self.conn.execute('DELETE FROM batch_documents')
+            self.conn.commit()
+
+    def enqueue(self, file_paths):
+        """Record documents as queued, leaving documents the journal already knows untouched."""
+        now = time.time()
+        with self._lock:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO batch_documents (file_path, state, updated_at) VALUES (?, ?, ?)',
+                [(file_path, QUEUED, now) for file_path in file_paths]
+            )
+            self.conn.commit()
+
+    def mark_extracting(self, file_path, content_hash=None):
+        """Record that a document is being extracted and count the attempt."""
+        with self._lock:
+            self.conn.execute(
+                '''
+                INSERT INTO batch_documents (file_path, content_hash, state, attempts, error, updated_at)
+                VALUES (?, ?, ?, 1, NULL, ?)
+                ON CONFLICT(file_path) DO UPDATE SET content_hash = excluded.content_hash, state = excluded.state,
+                    attempts = attempts + 1, error = NULL, updated_at = excluded.updated_at
+                ''',
+                (file_path, content_hash, EXTRACTING, time.time())
+            )
+            self.conn.commit()
+
+    def mark_stored(self, file_path):
+        """Record that all of a document's artifacts were stored."""
+        self._set_state(file_path, STORED)
+
+    def mark_failed(self, file_path, reason):
+        """Record that a document failed, keeping the reason for later inspection."""
+        self._set_state(file_path, FAILED, str(reason))
+
+    def state(self, file_path):
+        """Return the recorded state of a document, or None if it is not in the journal."""
+        row = self.conn.execute('SELECT state FROM batch_documents WHERE file_path = ?', (file_path,)).fetchone()
+        return row[0] if row else None
+
+    def is_stored(self, file_path, content_hash=None):
+        """
+        Check whether a document was already stored.
+
+        Args:
+            file_path (str): The document path.
+            content_hash (str): When given, the document only counts as stored if its
+                contents are unchanged since it was processed.
+        """
+        row = self.conn.execute('SELECT state, content_hash FROM batch_documents WHERE file_path = ?',
+                                (file_path,)).fetchone()
+        if row is None or row[0] != STORED:
+            return False
+        return content_hash is None or row[1] == content_hash
+
+    def paths(self, states=STATES):
+        """Return the paths of documents in any of the given states, in the order they were queued."""
+        placeholders = ', '.join('?' * len(states))
+        rows = self.conn.execute(
+            f'SELECT file_path FROM batch_documents WHERE state IN ({placeholders}) ORDER BY rowid', tuple(states)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def failures(self):
+        """Return a dictionary mapping failed document paths to their failure reasons."""
+        rows = self.conn.execute('SELECT file_path, error FROM batch_documents WHERE state = ? ORDER BY rowid',
+                                 (FAILED,)).fetchall()
+        return dict(rows)
+
+    def summary(self):
+        """Return the number of documents in each state."""
+        counts = dict.fromkeys(STATES, 0)
+        for state, count in self.conn.execute('SELECT state, COUNT(*) FROM batch_documents GROUP BY state'):
+            counts[state] = count
+        return counts
+
+    def _set_state(self, file_path, state, error=None):
+        with self._lock:
+            self.conn.execute('UPDATE batch_documents SET state = ?, error = ?, updated_at = ? WHERE file_path = ?',
+                              (state, error, time.time(), file_path))
+            self.conn.commit()
+
+    def close(self):
+        """Close the journal database."""
+        self.conn.close()
@@ -0,0 +1,120 @@
+import os
+import re
+import time
+import zipfile
+
+from pdfminer.pdfdocument import PDFDocument, PDFPasswordIncorrect
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdftypes import resolve1
+
+from pipeline.scheduler import SLIDE_PATTERN, CostModel, estimate_docx_pages
+from storage.pdf_images import pdf_name
+
+# OOXML files protected with a password are stored as OLE compound files, not ZIP packages
+OLE_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+HYPERLINK_RELATIONSHIP = re.compile(rb'relationships/hyperlink"')
+
+
+def _probe_pdf(file, summary):
+    try:
+        document = PDFDocument(PDFParser(file))
+    except PDFPasswordIncorrect:
+        summary['encrypted'] = True
+        summary['error'] = "Password required"
+        return
+    summary['encrypted'] = document.encryption is not None
+    pages = text_pages = scanned_pages = images = links = 0
+    for page in PDFPage.create_pages(document):
+        pages += 1
+        resources = resolve1(page.resources) or {}
+        has_fonts = bool(resolve1(resources.get('Font')))
+        page_images = 0
+        # Only the resource dictionaries are read; content streams are never decoded
+        for xobject in (resolve1(resources.get('XObject')) or {}).values():
+            xobject = resolve1(xobject)
+            subtype = pdf_name(xobject.get('Subtype')) if hasattr(xobject, 'get') else None
+            if subtype == 'Image':
+                page_images += 1
+            elif subtype == 'Form':
+                has_fonts = has_fonts or bool(resolve1((resolve1(xobject.get('Resources')) or {}).get('Font')))
+        for annotation in resolve1(page.annots) or []:
+            annotation = resolve1(annotation)
+            action = resolve1(annotation.get('A')) if hasattr(annotation, 'get') else None
+            if pdf_name(annotation.get('Subtype')) == 'Link' and action and action.get('URI'):
+                links += 1
+        images += page_images
+        if has_fonts:
+            text_pages += 1
+        elif page_images:
+            scanned_pages += 1
+    summary.update(pages=pages, images=images, links=links, text_pages=text_pages, scanned_pages=scanned_pages,
+                   needs_ocr=scanned_pages > 0)
+
+
+def _probe_ooxml(file_path, summary):
+    with zipfile.ZipFile(file_path) as package:
+        names = package.namelist()
+        summary['images'] = sum(1 for name in names if '/media/' in name)
+        if file_path.lower().endswith('.pptx'):
+            slides = [name for name in names if SLIDE_PATTERN.fullmatch(name)]
+            summary['pages'] = len(slides)
+            summary['tables'] = sum(package.read(name).count(b'<a:tbl>') for name in slides)
+            summary['links'] = sum(len(HYPERLINK_RELATIONSHIP.findall(package.read(name))) for name in names
+                                   if name.startswith('ppt/slides/_rels/'))
+        else:
+            summary['pages'] = estimate_docx_pages(package)
+            summary['tables'] = package.read('word/document.xml').count(b'<w:tbl>')
+            if 'word/_rels/document.xml.rels' in names:
+                summary['links'] = len(HYPERLINK_RELATIONSHIP.findall(package.read('word/_rels/document.xml.rels')))
+    summary['text_pages'] = summary['pages']
+    summary['needs_ocr'] = False
+
+
+def probe_document(file_path, cost_model=None):
+    """
+    Summarize a document from its structure alone, without extracting it.
+
+    PDFs are read through the cross-reference table, the page tree and each page's
+    resource dictionary; DOCX and PPTX files through their package listing and
+    relationship parts. Content streams and page layouts are never parsed, so a
+    probe takes milliseconds.
+
+    Args:
+        file_path (str): Path to the document.
+        cost_model (CostModel): Estimator for the processing time; None uses the defaults.
+
+    Returns:
+        dict: 'file_path', 'file_type', 'megabytes', 'encrypted', 'pages' (pages or slides,
+            estimated for DOCX), 'text_pages', 'scanned_pages' and 'needs_ocr' (PDF pages with
+            images but no fonts have no text layer), 'images', 'tables' (None for PDFs, which have
+            no table structure), 'links', 'estimated_seconds' and 'probe_ms'. Unreadable documents
+            also get an 'error'.
+    """
+    started = time.perf_counter()
+    file_type = os.path.splitext(file_path)[1].lstrip('.').lower()
+    summary = {
+        'file_path': file_path, 'file_type': file_type, 'megabytes': 0.0, 'encrypted': False,
+        'pages': 0, 'text_pages': 0, 'scanned_pages': 0, 'needs_ocr': False,
+        'images': 0, 'tables': None, 'links': 0,
+    }
+    try:
+        summary['megabytes'] = os.path.getsize(file_path) / (1024 * 1024)
+        with open(file_path, 'rb') as file:
+            if file_type == 'pdf':
+                _probe_pdf(file, summary)
+            elif file_type in ('docx', 'pptx'):
+                if file.read(len(OLE_MAGIC)) == OLE_MAGIC:
+                    summary['encrypted'] = True
+                    summary['error'] = "Password-protected Office document"
+                else:
+                    _probe_ooxml(file_path, summary)
+            else:
+                summary['error'] = "Unsupported file format"
+    except Exception as e:
+        summary['error'] = f"{type(e).__name__}: {e}"
+    features = {'pages': max(1, summary['pages']), 'megabytes': summary['megabytes'], 'images': summary['images']}
+    summary['estimated_seconds'] = round((cost_model or CostModel()).predict(features), 3)
+    summary['megabytes'] = round(summary['megabytes'], 3)
+    summary['probe_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return summary
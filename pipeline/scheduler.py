@@ -0,0 +1,278 @@
+import csv
+import os
+import re
+import threading
+import time
+import zipfile
+
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdftypes import resolve1
+
+from pipeline.worker import SupervisedWorker
+
+PDF_IMAGE_PATTERN = re.compile(rb'/Subtype\s*/Image')
+SCAN_CHUNK_BYTES = 1024 * 1024
+# Bytes carried over between chunks, so a match split across a chunk boundary is still found
+SCAN_OVERLAP_BYTES = 256
+# Uncompressed bytes of word/document.xml that roughly make up one page
+DOCX_BYTES_PER_PAGE = 30000
+SLIDE_PATTERN = re.compile(r'ppt/slides/slide\d+\.xml')
+
+
+def estimate_docx_pages(package):
+    """Estimate the page count of an open DOCX package from the size of its body part."""
+    return max(1, round(package.getinfo('word/document.xml').file_size / DOCX_BYTES_PER_PAGE))
+
+
+def document_features(file_path):
+    """
+    Read the cost-relevant features of a document without extracting it.
+
+    Only document structure is touched: the PDF page tree, or the OOXML package
+    listing for DOCX and PPTX files.
+
+    Args:
+        file_path (str): Path to the document.
+
+    Returns:
+        dict: 'pages' (pages or slides, estimated for DOCX), 'megabytes' and 'images'.
+    """
+    size = os.path.getsize(file_path)
+    features = {'pages': 1, 'megabytes': size / (1024 * 1024), 'images': 0}
+    extension = os.path.splitext(file_path)[1].lower()
+    try:
+        if extension == '.pdf':
+            with open(file_path, 'rb') as file:
+                document = PDFDocument(PDFParser(file))
+                features['pages'] = int(resolve1(resolve1(document.catalog['Pages'])['Count']))
+                file.seek(0)
+                # Image XObjects inside compressed object streams are missed; this is an estimate
+                features['images'] = count_matches(file, PDF_IMAGE_PATTERN)
+        elif extension in ('.docx', '.pptx'):
+            with zipfile.ZipFile(file_path) as package:
+                names = package.namelist()
+                features['images'] = sum(1 for name in names if '/media/' in name)
+                if extension == '.pptx':
+                    features['pages'] = sum(1 for name in names if SLIDE_PATTERN.fullmatch(name))
+                else:
+                    features['pages'] = estimate_docx_pages(package)
+    except Exception as e:
+        print(f"Could not read structure of {file_path}, estimating from size only: {e}")
+    return features
+
+
+def count_matches(file, pattern):
+    """
+    Count the matches of a bytes pattern in a file, reading it in chunks.
+
+    Matches longer than SCAN_OVERLAP_BYTES that straddle a chunk boundary are missed.
+
+    Args:
+        file: A binary file object, positioned where scanning starts.
+        pattern: A compiled bytes regular expression.
+
+    Returns:
+        int: The number of matches.
+    """
+    count, tail = 0, b''
+    while True:
+        chunk = file.read(SCAN_CHUNK_BYTES)
+        if not chunk:
+            return count
+        buffer = tail + chunk
+        # Matches lying entirely inside the carried-over tail were counted with the previous chunk
+        count += sum(1 for match in pattern.finditer(buffer) if match.end() > len(tail))
+        tail = buffer[-SCAN_OVERLAP_BYTES:]
+
+
+class CostModel:
+    """A linear model predicting a document's processing time in seconds from its features."""
+
+    FEATURES = ('pages', 'megabytes', 'images')
+
+    def __init__(self, base=0.2, pages=0.05, megabytes=0.3, images=0.02):
+        """
+        Args:
+            base (float): Fixed seconds per document.
+            pages (float): Seconds per page or slide.
+            megabytes (float): Seconds per megabyte of input.
+            images (float): Seconds per embedded image.
+        """
+        self.base = base
+        self.weights = {'pages': pages, 'megabytes': megabytes, 'images': images}
+
+    @classmethod
+    def from_spec(cls, spec):
+        """
+        Build a model from a string such as `base=0.2,pages=0.05,megabytes=0.3,images=0.02`.
+
+        Coefficients that are left out keep their default values; None or an empty
+        spec returns the default model.
+        """
+        coefficients = {}
+        for item in filter(None, (spec or '').split(',')):
+            name, _, value = item.partition('=')
+            coefficients[name.strip()] = float(value)
+        return cls(**coefficients)
+
+    def predict(self, features):
+        """Return the predicted processing time in seconds for a feature dictionary."""
+        return self.base + sum(self.weights[name] * features[name] for name in self.FEATURES)
+
+    def estimate(self, file_path):
+        """
+        Estimate the cost of a document.
+
+        Returns:
+            dict: The document's features plus 'file_path' and 'predicted' seconds.
+        """
+        features = document_features(file_path)
+        return dict(features, file_path=file_path, predicted=self.predict(features))
+
+    @classmethod
+    def fit(cls, records):
+        """
+        Fit a model to observed runs by least squares.
+
+        Args:
+            records (list): Dictionaries with the feature keys and the measured 'actual' seconds.
+
+        Returns:
+            CostModel: The fitted model, with negative coefficients clipped to zero.
+        """
+        import numpy as np
+
+        matrix = np.array([[1.0] + [record[name] for name in cls.FEATURES] for record in records])
+        actual = np.array([record['actual'] for record in records])
+        coefficients = np.clip(np.linalg.lstsq(matrix, actual, rcond=None)[0], 0, None)
+        return cls(*coefficients.tolist())
+
+    def __repr__(self):
+        weights = ', '.join(f'{name}={self.weights[name]:.4f}' for name in self.FEATURES)
+        return f'CostModel(base={self.base:.4f}, {weights})'
+
+
+class BatchScheduler:
+    """
+    Dispatch a batch across supervised workers, most expensive documents first.
+
+    Every worker pulls the next most expensive document as soon as it is free
+    (longest-processing-time-first), so a giant file starts early instead of
+    landing last while the other workers sit idle.
+    """
+
+    def __init__(self, workers=1, limits=None, cost_model=None, governor=None):
+        """
+        Args:
+            workers (int): Number of worker processes.
+            limits (WorkerLimits): Per-document limits applied in every worker.
+            cost_model (CostModel): The estimator; None uses the default coefficients.
+            governor (MemoryGovernor): When given, a document is only dispatched while its
+                estimated footprint fits the memory budget; otherwise the most expensive
+                document that fits goes first.
+        """
+        self.workers = [SupervisedWorker(limits) for _ in range(max(1, workers))]
+        self.cost_model = cost_model or CostModel()
+        self.governor = governor
+
+    def plan(self, file_paths):
+        """Estimate every document and return the estimates in dispatch order (most expensive first)."""
+        estimates = [self.cost_model.estimate(file_path) for file_path in file_paths]
+        if self.governor is not None:
+            for estimate in estimates:
+                estimate['footprint'] = self.governor.footprint(estimate)
+        return sorted(estimates, key=lambda estimate: estimate['predicted'], reverse=True)
+
+    def _next(self, pending, lock, worker):
+        """Take the next document for a worker, waiting while none fits the memory budget."""
+        while True:
+            with lock:
+                if not pending:
+                    return None
+                if self.governor is None:
+                    return pending.pop(0)
+                for index, estimate in enumerate(pending):
+                    if self.governor.try_admit(worker, self.workers, estimate['footprint']):
+                        return pending.pop(index)
+            self.governor.wait()
+
+    def run(self, file_paths, process):
+        """
+        Process a batch.
+
+        Args:
+            file_paths (list): The documents to process.
+            process: Called as `process(worker, file_path)` on a dispatcher thread; it should
+                handle its own errors.
+
+        Returns:
+            list: One record per document with the estimate, the measured 'actual' seconds and
+                the 'worker' index, in completion order.
+        """
+        pending = self.plan(file_paths)
+        records = []
+        lock = threading.Lock()
+
+        def dispatch(index, worker):
+            while True:
+                estimate = self._next(pending, lock, worker)
+                if estimate is None:
+                    return
+                started = time.perf_counter()
+                try:
+                    process(worker, estimate['file_path'])
+                finally:
+                    if self.governor is not None:
+                        self.governor.release(worker, self.workers)
+                record = dict(estimate, actual=time.perf_counter() - started, worker=index)
+                with lock:
+                    records.append(record)
+
+        # Fork the worker processes before any dispatcher thread is running
+        for worker in self.workers:
+            worker.start()
+        threads = [threading.Thread(target=dispatch, args=(index, worker), daemon=True)
+                   for index, worker in enumerate(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return records
+
+    def close(self):
+        """Stop the worker processes."""
+        for worker in self.workers:
+            worker.close()
+
+
+def report_costs(records, report_path=None):
+    """
+    Print predicted versus actual processing time, optionally saving the records as CSV.
+
+    With enough records a refitted CostModel is printed, ready to tune the estimator.
+
+    Args:
+        records (list): Records returned by BatchScheduler.run.
+        report_path (str): CSV file to write the per-document records to.
+    """
+    if not records:
+        return
+    print(f"{'predicted':>10} {'actual':>10}  file")
+    for record in sorted(records, key=lambda record: record['predicted'], reverse=True):
+        print(f"{record['predicted']:>9.2f}s {record['actual']:>9.2f}s  {record['file_path']}")
+    predicted = sum(record['predicted'] for record in records)
+    actual = sum(record['actual'] for record in records)
+    if predicted > 0:
+        print(f"Total predicted {predicted:.2f}s, actual {actual:.2f}s (actual/predicted {actual / predicted:.2f})")
+    else:
+        print(f"Total predicted {predicted:.2f}s, actual {actual:.2f}s")
+    if len(records) > len(CostModel.FEATURES) + 1:
+        print(f"Refitted estimator: {CostModel.fit(records)}")
+    if report_path:
+        columns = ['file_path', 'pages', 'megabytes', 'images', 'predicted', 'actual', 'worker']
+        with open(report_path, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.DictWriter(file, fieldnames=columns, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(records)
+        print(f"Cost report saved to {report_path}")
@@ -0,0 +1,267 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from data_extractor import ExtractionRequest
+from pipeline.worker import SupervisedWorker, WorkerFailure
+
+HTTP_REASONS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+                405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class ExtractionService:
+    """
+    A long-lived extraction server backed by a pool of pre-warmed supervised workers.
+
+    The server speaks a small subset of HTTP/1.1 over TCP or a Unix socket:
+
+    - `POST /extract?path=<file>` queues a document already on disk, inside one of the allowed roots.
+    - `POST /extract?filename=<name>` with the file as the request body queues an upload; the
+      spooled copy is deleted once the job finishes.
+    - `GET /jobs/<job_id>` returns the state and result of a job.
+    - `GET /health` returns worker and queue statistics.
+
+    `/extract` accepts `kinds`, `pages` and `fidelity` (see ExtractionRequest.from_spec) and `wait=1`
+    to respond with the result instead of a job ID.
+    """
+
+    def __init__(self, task, task_args=(), workers=2, limits=None, warmup=None,
+                 spool_dir='service_uploads', max_upload_mb=512, max_jobs=10000, allowed_roots=()):
+        """
+        Args:
+            task: Module-level function called in a worker as `task(file_path, *task_args, request)`.
+            task_args (tuple): Extra picklable arguments passed to the task.
+            workers (int): Number of worker processes.
+            limits (WorkerLimits): Per-document limits applied in every worker.
+            warmup: Module-level function run in each worker before it accepts documents, and again
+                in the replacement for a worker recycled after a failure.
+            spool_dir (str): Directory where uploaded documents are written.
+            max_upload_mb (int): Largest accepted upload.
+            max_jobs (int): Number of finished jobs remembered for `/jobs` lookups.
+            allowed_roots (iterable): Directories `?path=` may point into; with none, only uploads
+                are accepted.
+        """
+        self.task = task
+        self.task_args = tuple(task_args)
+        self.workers = [SupervisedWorker(limits, warmup) for _ in range(workers)]
+        self.warmup = warmup
+        self.spool_dir = spool_dir
+        self.max_upload_bytes = max_upload_mb * 1024 * 1024
+        self.max_jobs = max_jobs
+        self.allowed_roots = [os.path.realpath(root) for root in allowed_roots]
+        self.jobs = OrderedDict()
+        self._spooled = {}  # spooled upload path -> number of unfinished jobs using it
+        self.queue = None
+        self._consumers = []
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.completed = 0
+        self.failed = 0
+
+    async def start_workers(self):
+        """Start every worker process and run the warm-up function in it."""
+        loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        # Fork every worker before the executor starts any threads; a recycled worker
+        # is warmed up again by SupervisedWorker when it is replaced
+        for worker in self.workers:
+            worker.start()
+        for worker in self.workers:
+            await loop.run_in_executor(self.executor, worker.warm_up)
+        self._consumers = [asyncio.create_task(self._consume(worker)) for worker in self.workers]
+
+    async def serve(self, host='127.0.0.1', port=8765, socket_path=None):
+        """
+        Start the workers and serve requests until cancelled.
+
+        Args:
+            host (str): Interface to listen on for TCP.
+            port (int): TCP port.
+            socket_path (str): Listen on this Unix socket instead of TCP.
+        """
+        os.makedirs(self.spool_dir, exist_ok=True)
+        await self.start_workers()
+        if socket_path:
+            server = await asyncio.start_unix_server(self._handle_connection, path=socket_path)
+            print(f"Extraction service listening on {socket_path} with {len(self.workers)} workers")
+        else:
+            server = await asyncio.start_server(self._handle_connection, host, port)
+            print(f"Extraction service listening on http://{host}:{port} with {len(self.workers)} workers")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop the worker processes."""
+        for worker in self.workers:
+            worker.close()
+        self.executor.shutdown(wait=False)
+
+    def submit(self, file_path, request):
+        """
+        Queue a document for extraction.
+
+        Returns:
+            dict: The job record; its 'done' future resolves when the job finishes.
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            'job_id': job_id,
+            'file_path': file_path,
+            'state': 'queued',
+            'submitted_at': time.time(),
+            'done': asyncio.get_running_loop().create_future(),
+        }
+        self.jobs[job_id] = job
+        while len(self.jobs) > self.max_jobs:
+            oldest = next(iter(self.jobs.values()))
+            if oldest['state'] not in ('done', 'failed'):
+                break
+            self.jobs.popitem(last=False)
+        self.queue.put_nowait((job, request))
+        return job
+
+    async def _consume(self, worker):
+        """Feed queued jobs to one worker, one at a time."""
+        loop = asyncio.get_running_loop()
+        while True:
+            job, request = await self.queue.get()
+            job['state'] = 'running'
+            job['started_at'] = time.time()
+            try:
+                job['result'] = await loop.run_in_executor(
+                    self.executor, worker.run, self.task, job['file_path'], *self.task_args, request)
+                job['state'] = 'done'
+                self.completed += 1
+            except Exception as e:
+                # Not only WorkerFailure: any error must fail this job, not end the consumer
+                job['state'] = 'failed'
+                job['error'] = str(e) if isinstance(e, WorkerFailure) else f"{type(e).__name__}: {e}"
+                self.failed += 1
+            finally:
+                job['finished_at'] = time.time()
+                self._release_upload(job['file_path'])
+                job['done'].set_result(None)
+                self.queue.task_done()
+
+    def _release_upload(self, file_path):
+        """Delete a spooled upload once no queued or running job needs it any more."""
+        if file_path not in self._spooled:
+            return
+        self._spooled[file_path] -= 1
+        if self._spooled[file_path] == 0:
+            del self._spooled[file_path]
+            try:
+                os.remove(file_path)
+            except OSError as e:
+                print(f"Could not delete upload {file_path}: {e}")
+
+    def _job_view(self, job):
+        """Return the JSON-serialisable part of a job record."""
+        return {key: value for key, value in job.items() if key != 'done'}
+
+    def stats(self):
+        """Return worker and queue statistics."""
+        return {
+            'workers': len(self.workers),
+            'queued': self.queue.qsize() if self.queue else 0,
+            'running': sum(1 for job in self.jobs.values() if job['state'] == 'running'),
+            'completed': self.completed,
+            'failed': self.failed,
+        }
+
+    async def _handle_connection(self, reader, writer):
+        """Serve HTTP requests on one connection until the client closes it."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                if length > self.max_upload_bytes:
+                    status, payload = 413, {'error': "Upload too large"}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    status, payload = await self._dispatch(method, target, headers, body)
+                    keep_alive = headers.get('connection', '').lower() != 'close'
+                data = json.dumps(payload, default=str).encode('utf-8')
+                writer.write(
+                    f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, target, headers, body):
+        """Route one request and return (status, payload)."""
+        url = urlsplit(target)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path == '/health' and method == 'GET':
+            return 200, self.stats()
+        if url.path.startswith('/jobs/') and method == 'GET':
+            job = self.jobs.get(url.path[len('/jobs/'):])
+            if job is None:
+                return 404, {'error': "Unknown job"}
+            return 200, self._job_view(job)
+        if url.path == '/extract':
+            if method != 'POST':
+                return 405, {'error': "Use POST"}
+            try:
+                request = ExtractionRequest.from_spec(query.get('kinds'), query.get('pages'), query.get('fidelity'))
+                file_path = self._resolve_document(query, headers, body)
+            except PermissionError as e:
+                return 403, {'error': str(e)}
+            except ValueError as e:
+                return 400, {'error': str(e)}
+            job = self.submit(file_path, request)
+            if query.get('wait', '0') not in ('0', 'false', ''):
+                await job['done']
+                return (200 if job['state'] == 'done' else 500), self._job_view(job)
+            return 202, {'job_id': job['job_id']}
+        return 404, {'error': "Not found"}
+
+    def _resolve_document(self, query, headers, body):
+        """Return the path of the document named by a request, spooling uploaded bytes to disk."""
+        if body:
+            filename = query.get('filename') or headers.get('x-filename')
+            if not filename:
+                raise ValueError("Uploads need a filename (query parameter or X-Filename header)")
+            extension = os.path.splitext(filename)[1].lower()
+            file_path = os.path.join(self.spool_dir, hashlib.sha256(body).hexdigest() + extension)
+            if file_path not in self._spooled:
+                with open(file_path, 'wb') as file:
+                    file.write(body)
+            # Identical uploads share one spooled file until the last of their jobs finishes
+            self._spooled[file_path] = self._spooled.get(file_path, 0) + 1
+            return file_path
+        file_path = query.get('path')
+        if not file_path:
+            raise ValueError("Provide a document path or upload the file as the request body")
+        real_path = os.path.realpath(file_path)
+        if not any(os.path.commonpath([root, real_path]) == root for root in self.allowed_roots):
+            raise PermissionError(f"Path is outside the directories the service may read: {file_path}")
+        if not os.path.isfile(real_path):
+            raise ValueError(f"File not found: {file_path}")
+        return real_path
@@ -0,0 +1,312 @@
+import ctypes
+import ctypes.util
+import json
+import os
+import queue
+import select
+import struct
+import threading
+import time
+from collections import deque
+
+from pipeline.worker import SupervisedWorker
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.docx', '.pptx')
+
+# inotify event masks (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class Inotify:
+    """A minimal ctypes binding to Linux inotify, used to hear about new files without rescanning."""
+
+    def __init__(self, directories):
+        """
+        Watch directories (not recursively) for created, written and moved-in files.
+
+        Raises:
+            OSError: If inotify is unavailable on this system.
+        """
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError("libc not found")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError("inotify is not available")
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = {}
+        for directory in directories:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory),
+                                             IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"Cannot watch {directory}")
+            self.directories[wd] = directory
+
+    def read(self, timeout):
+        """Wait up to `timeout` seconds and return the paths of files that changed."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if name and wd in self.directories:
+                paths.append(os.path.join(self.directories[wd], os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DirectoryWatcher:
+    """
+    Report documents that appear in watched directories once they stop changing.
+
+    A file is ready when its size and modification time have not changed for
+    `settle_seconds`, so documents that are still being copied in are not picked up
+    half-written. inotify is used to notice files promptly; without it the
+    directories are polled.
+    """
+
+    def __init__(self, directories, settle_seconds=2.0, poll_interval=1.0, use_inotify=True):
+        """
+        Args:
+            directories (list): Directories to watch (not recursively).
+            settle_seconds (float): How long a file must stay unchanged before it is ready.
+            poll_interval (float): Seconds between directory scans when polling.
+            use_inotify (bool): Try inotify before falling back to polling.
+        """
+        self.directories = [os.path.abspath(directory) for directory in directories]
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.inotify = None
+        if use_inotify:
+            try:
+                self.inotify = Inotify(self.directories)
+            except (OSError, AttributeError) as e:
+                print(f"inotify unavailable, polling every {poll_interval}s: {e}")
+        self._pending = {}  # path -> (signature, first_seen, last_change)
+        self._reported = {}  # path -> signature reported as ready, until the file disappears
+        self._last_scan = 0.0
+
+    def _signature(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    @staticmethod
+    def is_candidate(path):
+        """Check whether a path looks like a supported, finished document (not a hidden or temp file)."""
+        name = os.path.basename(path)
+        return name.lower().endswith(SUPPORTED_EXTENSIONS) and not name.startswith(('.', '~$'))
+
+    def _scan(self):
+        """Return the files in the watched directories and the set of directories that could be read."""
+        paths, scanned = [], set()
+        for directory in self.directories:
+            try:
+                with os.scandir(directory) as entries:
+                    paths.extend(entry.path for entry in entries if entry.is_file())
+                scanned.add(directory)
+            except OSError as e:
+                print(f"Cannot scan {directory}: {e}")
+        return paths, scanned
+
+    def _touch(self, path, now):
+        if not self.is_candidate(path):
+            return
+        signature = self._signature(path)
+        if signature is None or self._reported.get(path) == signature:
+            return
+        previous = self._pending.get(path)
+        if previous is None:
+            self._pending[path] = (signature, now, now)
+        elif previous[0] != signature:
+            self._pending[path] = (signature, previous[1], now)
+
+    def poll(self):
+        """
+        Wait briefly for changes and return the documents that became ready.
+
+        Returns:
+            list: (path, first_seen) tuples; first_seen is when the file was first noticed.
+        """
+        if self.inotify is not None:
+            for path in self.inotify.read(min(self.poll_interval, self.settle_seconds / 2)):
+                self._touch(path, time.time())
+        else:
+            time.sleep(min(self.poll_interval, self.settle_seconds / 2))
+        now = time.time()
+        # Rescan periodically even with inotify, to catch anything missed (e.g. event queue overflow)
+        rescan_interval = self.poll_interval if self.inotify is None else max(30.0, self.poll_interval)
+        if now - self._last_scan >= rescan_interval:
+            self._last_scan = now
+            paths, scanned = self._scan()
+            for path in paths:
+                self._touch(path, now)
+            # Forget reported files that were deleted or moved away, so the map only
+            # holds files still on disk (a file that stays is not reported again)
+            present = set(paths)
+            for path in list(self._reported):
+                if path not in present and os.path.dirname(path) in scanned:
+                    del self._reported[path]
+        # Re-check settling files: a file is ready once its signature stays unchanged
+        ready = []
+        for path, (signature, first_seen, last_change) in list(self._pending.items()):
+            current = self._signature(path)
+            if current is None:
+                del self._pending[path]
+            elif current != signature:
+                self._pending[path] = (current, first_seen, now)
+            elif now - last_change >= self.settle_seconds:
+                del self._pending[path]
+                self._reported[path] = signature
+                ready.append((path, first_seen))
+        return ready
+
+    @property
+    def settling(self):
+        """Number of files seen but not yet stable."""
+        return len(self._pending)
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+
+
+class WatchDaemon:
+    """
+    Feed documents from a DirectoryWatcher to a pool of supervised workers.
+
+    Queue depth and end-to-end latency (first noticed to stored) are tracked
+    and can be written periodically to a JSON stats file.
+    """
+
+    def __init__(self, watcher, workers=1, limits=None, stats_path=None, stats_interval=10.0):
+        """
+        Args:
+            watcher (DirectoryWatcher): Source of ready documents.
+            workers (int): Number of worker processes.
+            limits (WorkerLimits): Per-document limits applied in every worker.
+            stats_path (str): JSON file the stats are written to every `stats_interval` seconds.
+            stats_interval (float): Seconds between stats reports.
+        """
+        self.watcher = watcher
+        self.workers = [SupervisedWorker(limits) for _ in range(max(1, workers))]
+        self.stats_path = stats_path
+        self.stats_interval = stats_interval
+        self.queue = queue.Queue()
+        self.in_flight = 0
+        self.processed = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=1000)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def stats(self):
+        """Return queue depth and latency statistics."""
+        with self._lock:
+            latencies = sorted(self.latencies)
+            in_flight, processed, failed = self.in_flight, self.processed, self.failed
+
+        def percentile(fraction):
+            return round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))], 3) if latencies else None
+
+        return {
+            'settling': self.watcher.settling,
+            'queued': self.queue.qsize(),
+            'in_flight': in_flight,
+            'processed': processed,
+            'failed': failed,
+            'latency_p50_seconds': percentile(0.5),
+            'latency_p95_seconds': percentile(0.95),
+            'latency_max_seconds': round(latencies[-1], 3) if latencies else None,
+        }
+
+    def _write_stats(self):
+        stats = self.stats()
+        print(f"Watch stats: {stats}")
+        if self.stats_path:
+            tmp_path = self.stats_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump(dict(stats, updated_at=time.time()), file)
+            os.replace(tmp_path, self.stats_path)
+
+    def _work_loop(self, worker, process):
+        while not self._stop.is_set():
+            try:
+                file_path, first_seen = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            with self._lock:
+                self.in_flight += 1
+            ok = False
+            try:
+                ok = process(worker, file_path)
+            except Exception as e:
+                # Keep the thread alive: one bad document must not stall the daemon
+                print(f"Error processing file {file_path}: {e}")
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+                    if ok:
+                        self.processed += 1
+                        self.latencies.append(time.time() - first_seen)
+                    else:
+                        self.failed += 1
+                self.queue.task_done()
+
+    def run(self, process):
+        """
+        Watch and process documents until interrupted.
+
+        Args:
+            process: Called as `process(worker, file_path)`; returns True if the document was
+                stored (or skipped as already stored) and False if it failed.
+        """
+        for worker in self.workers:
+            worker.start()
+        threads = [threading.Thread(target=self._work_loop, args=(worker, process), daemon=True)
+                   for worker in self.workers]
+        for thread in threads:
+            thread.start()
+        print(f"Watching {', '.join(self.watcher.directories)} with {len(self.workers)} workers")
+        last_stats = time.time()
+        try:
+            while not self._stop.is_set():
+                for file_path, first_seen in self.watcher.poll():
+                    self.queue.put((file_path, first_seen))
+                if time.time() - last_stats >= self.stats_interval:
+                    last_stats = time.time()
+                    self._write_stats()
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            self._write_stats()
+
+    def stop(self):
+        """Ask the daemon to stop after the documents currently being processed."""
+        self._stop.set()
+
+    def close(self):
+        """Stop the worker processes and the watcher."""
+        for worker in self.workers:
+            worker.close()
+        self.watcher.close()
@@ -0,0 +1,178 @@
+import multiprocessing
+import signal
+import threading
+
+try:
+    import resource
+except ImportError:  # resource limits are only available on POSIX systems
+    resource = None
+
+
+class WorkerLimits:
+    """Resource limits applied to every document processed by a supervised worker."""
+
+    def __init__(self, wall_time=None, cpu_time=None, memory_mb=None):
+        """
+        Args:
+            wall_time (float): Seconds a single document may take before the worker is killed.
+            cpu_time (int): CPU seconds a single document may use (enforced with RLIMIT_CPU).
+            memory_mb (int): Address-space limit of the worker process in megabytes (RLIMIT_AS).
+        """
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.memory_mb = memory_mb
+
+
+class WorkerFailure(Exception):
+    """Raised when a supervised worker could not process a document."""
+
+
+def _start_context():
+    """
+    Return the multiprocessing context for starting a worker process now.
+
+    Forking copies the parent's memory cheaply, but only while no other thread is
+    running: a lock another thread holds at fork time stays held forever in the
+    child. Workers started (or replaced) once dispatcher threads exist are launched
+    through a fork server, or spawned where there is none, instead.
+    """
+    if threading.active_count() == 1:
+        return multiprocessing.get_context()
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+def _worker_loop(conn, limits):
+    """Run tasks received over `conn` until told to stop, reporting each outcome back."""
+    if resource is not None and limits.memory_mb:
+        memory_bytes = limits.memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        target, args = task
+        if resource is not None and limits.cpu_time:
+            # RLIMIT_CPU counts the whole process lifetime, so move the soft limit per document
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+            resource.setrlimit(resource.RLIMIT_CPU, (int(usage.ru_utime + usage.ru_stime + limits.cpu_time) + 1, hard))
+        try:
+            conn.send(('ok', target(*args)))
+        except MemoryError:
+            conn.send(('fatal', "Memory limit exceeded"))
+            break
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {e}"))
+
+
+class SupervisedWorker:
+    """
+    Process documents in a child process that is killed and replaced when it misbehaves.
+
+    A document that hangs, exceeds its CPU budget or runs out of memory only costs
+    the worker it ran in; the next document gets a fresh process.
+    """
+
+    def __init__(self, limits=None, warmup=None):
+        """
+        Args:
+            limits (WorkerLimits): Limits applied to each document; None applies no limits.
+            warmup: Module-level function run in every new worker process before its first
+                document, including the replacement for a recycled worker.
+        """
+        self.limits = limits or WorkerLimits()
+        self.warmup = warmup
+        self.process = None
+        self.conn = None
+
+    def start(self):
+        """Start the worker process (forked only while the caller is the process's sole thread)."""
+        context = _start_context()
+        parent_conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_loop, args=(child_conn, self.limits), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+
+    def run(self, target, *args):
+        """
+        Run `target(*args)` in the worker and wait for it within the wall-time limit.
+
+        Args:
+            target: A module-level function (it is pickled by reference).
+            *args: Picklable arguments for the function.
+
+        Returns:
+            The value returned by the function.
+
+        Raises:
+            WorkerFailure: If the function raised, or the worker was killed or exceeded a limit.
+        """
+        if self.process is None or not self.process.is_alive():
+            self.start()
+            self.warm_up()
+            if self.process is None:
+                self.start()  # the warm-up killed the worker; run the document in a fresh, cold one
+        return self._call(target, args)
+
+    def warm_up(self):
+        """Run the warm-up function in the current worker process; a failure is reported, not raised."""
+        if self.warmup is None:
+            return
+        try:
+            self._call(self.warmup, ())
+        except WorkerFailure as e:
+            print(f"Worker warm-up failed: {e}")
+
+    def _call(self, target, args):
+        self.conn.send((target, args))
+        if not self.conn.poll(self.limits.wall_time):
+            self.recycle()
+            raise WorkerFailure(f"Wall time limit of {self.limits.wall_time}s exceeded")
+        try:
+            status, payload = self.conn.recv()
+        except EOFError:
+            reason = self._exit_reason()
+            self.recycle()
+            raise WorkerFailure(reason)
+        if status == 'ok':
+            return payload
+        if status == 'fatal':
+            self.recycle()
+        raise WorkerFailure(payload)
+
+    def _exit_reason(self):
+        """Describe why the worker process died."""
+        self.process.join(1)
+        exitcode = self.process.exitcode
+        if exitcode == -getattr(signal, 'SIGXCPU', 24):
+            return f"CPU time limit of {self.limits.cpu_time}s exceeded"
+        if exitcode == -signal.SIGKILL:
+            return "Worker was killed (possibly out of memory)"
+        return f"Worker exited unexpectedly with code {exitcode}"
+
+    def recycle(self):
+        """Kill the current worker process; the next task starts a fresh one."""
+        if self.process is not None:
+            if self.process.is_alive():
+                self.process.kill()
+            self.process.join()
+            self.process = None
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def close(self):
+        """Stop the worker process once it finishes its current task."""
+        if self.process is not None and self.process.is_alive():
+            try:
+                self.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            self.process.join(5)
+        self.recycle()
@@ -0,0 +1,137 @@
+import hashlib
+import os
+import tempfile
+from abc import ABC, abstractmethod
+
+
+# Base abstract class for content-addressed blob storage
+class BlobStore(ABC):
+    """Store binary payloads out of line, addressed by the SHA-256 of their contents."""
+
+    @staticmethod
+    def digest(data):
+        """Return the SHA-256 hex digest used as the key of a blob."""
+        return hashlib.sha256(data).hexdigest()
+
+    @abstractmethod
+    def put(self, data):
+        """
+        Store a blob unless an identical one already exists.
+
+        Args:
+            data (bytes): The blob contents.
+
+        Returns:
+            tuple: (digest, location) where location is what `open` expects.
+        """
+        pass
+
+    @abstractmethod
+    def open(self, location):
+        """
+        Open a stored blob for streaming reads.
+
+        Args:
+            location (str): The location returned by `put`.
+
+        Returns:
+            A binary file-like object positioned at the start of the blob.
+        """
+        pass
+
+    def read(self, location):
+        """Read a stored blob fully into memory."""
+        with self.open(location) as stream:
+            return stream.read()
+
+
+# Concrete implementation backed by a local directory
+class LocalBlobStore(BlobStore):
+    def __init__(self, root):
+        """
+        Initialize the store under a root directory.
+
+        Blobs are laid out as `<root>/<aa>/<bb>/<digest>` to keep directories small.
+
+        Args:
+            root (str): The directory holding the blobs.
+        """
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path_for(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def put(self, data):
+        digest = self.digest(data)
+        path = self._path_for(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so readers never see a partial blob
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as file:
+                    file.write(data)
+                os.replace(tmp_path, path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        return digest, os.path.relpath(path, self.root)
+
+    def open(self, location):
+        return open(os.path.join(self.root, location), 'rb')
+
+
+# Concrete implementation for S3-compatible object stores (e.g. a local MinIO)
+class S3BlobStore(BlobStore):
+    def __init__(self, bucket, prefix='', endpoint_url=None):
+        """
+        Initialize the store on an S3 bucket.
+
+        Args:
+            bucket (str): The bucket name.
+            prefix (str): Key prefix under which blobs are stored.
+            endpoint_url (str): Endpoint of an S3-compatible server; None uses AWS.
+        """
+        try:
+            import boto3
+        except ImportError as e:
+            raise ImportError("S3 blob storage requires boto3 (pip install boto3)") from e
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+
+    def _key_for(self, digest):
+        key = f'{digest[:2]}/{digest[2:4]}/{digest}'
+        return f'{self.prefix}/{key}' if self.prefix else key
+
+    def put(self, data):
+        digest = self.digest(data)
+        key = self._key_for(digest)
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+        except self.client.exceptions.ClientError:
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=data)
+        return digest, f's3://{self.bucket}/{key}'
+
+    def open(self, location):
+        key = location[len(f's3://{self.bucket}/'):] if location.startswith('s3://') else location
+        return self.client.get_object(Bucket=self.bucket, Key=key)['Body']
+
+
+def create_blob_store(location, endpoint_url=None):
+    """
+    Create a blob store from a location string.
+
+    Args:
+        location (str): `s3://bucket/prefix` for an S3-compatible store, otherwise a local directory.
+        endpoint_url (str): Optional endpoint for S3-compatible servers.
+
+    Returns:
+        BlobStore: The configured store.
+    """
+    if location.startswith('s3://'):
+        bucket, _, prefix = location[len('s3://'):].partition('/')
+        return S3BlobStore(bucket, prefix, endpoint_url)
+    return LocalBlobStore(location)
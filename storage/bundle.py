@@ -0,0 +1,276 @@
+import json
+import os
+import struct
+import tempfile
+from io import BytesIO
+
+from PIL import Image
+
+from storage.compression import decompress
+from storage.image_dedup import HASH_NAMES
+from storage.storage import DataStorage
+
+try:
+    import msgpack
+except ImportError:  # msgpack manifests are optional; JSON is always available
+    msgpack = None
+
+BUNDLE_MAGIC = b'DXBUNDL\x01'
+# magic, manifest format (b'j' JSON / b'm' msgpack), padding, manifest offset, manifest length
+BUNDLE_HEADER = struct.Struct('<8sc7xQQ')
+
+
+class BundleWriter:
+    """
+    Write one document's artifacts into a single bundle file.
+
+    Layout: a fixed-size header, the artifact payloads back to back, then a manifest
+    (JSON or msgpack) listing each artifact's name, kind, offset, length and codec.
+    The header points at the manifest, so a reader can fetch any artifact with two
+    seeks without reading the rest of the bundle. The file is written to a temporary
+    path and renamed into place, so readers never see a partial bundle.
+    """
+
+    def __init__(self, path, manifest_format='json'):
+        """
+        Args:
+            path (str): Final path of the bundle.
+            manifest_format (str): 'json' or 'msgpack'.
+        """
+        if manifest_format == 'msgpack' and msgpack is None:
+            raise ImportError("msgpack manifests require msgpack (pip install msgpack)")
+        self.path = path
+        self.manifest_format = manifest_format
+        self.artifacts = []
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+        self._file = os.fdopen(fd, 'wb')
+        self._file.write(b'\0' * BUNDLE_HEADER.size)
+
+    def add(self, name, kind, payload, codec=None, **meta):
+        """
+        Append an artifact.
+
+        Args:
+            name (str): Unique artifact name, e.g. 'text' or 'images/1.jpeg'.
+            kind (str): Artifact kind ('text', 'links', 'images', 'tables', 'metadata').
+            payload (bytes): The stored bytes.
+            codec (str): Compression codec of the payload, or None.
+            **meta: Extra JSON-serialisable fields recorded in the manifest entry.
+        """
+        offset = self._file.tell()
+        self._file.write(payload)
+        self.artifacts.append(dict(meta, name=name, kind=kind, offset=offset, length=len(payload), codec=codec))
+
+    def close(self, **document):
+        """
+        Write the manifest and move the bundle into place.
+
+        Args:
+            **document: Document-level fields stored in the manifest (id, path, type, ...).
+        """
+        manifest = dict(document, artifacts=self.artifacts)
+        if self.manifest_format == 'msgpack':
+            data, flag = msgpack.packb(manifest, default=str), b'm'
+        else:
+            data, flag = json.dumps(manifest, default=str).encode('utf-8'), b'j'
+        offset = self._file.tell()
+        self._file.write(data)
+        self._file.seek(0)
+        self._file.write(BUNDLE_HEADER.pack(BUNDLE_MAGIC, flag, offset, len(data)))
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        """Discard a bundle that is being written."""
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class BundleReader:
+    """Random-access reader for bundles written by BundleWriter."""
+
+    def __init__(self, path):
+        """
+        Open a bundle and load its manifest.
+
+        Raises:
+            ValueError: If the file is not a bundle.
+        """
+        self.path = path
+        self._file = open(path, 'rb')
+        magic, flag, offset, length = BUNDLE_HEADER.unpack(self._file.read(BUNDLE_HEADER.size))
+        if magic != BUNDLE_MAGIC:
+            self._file.close()
+            raise ValueError(f"Not a document bundle: {path}")
+        self._file.seek(offset)
+        data = self._file.read(length)
+        if flag == b'm':
+            if msgpack is None:
+                raise ImportError("Reading msgpack manifests requires msgpack (pip install msgpack)")
+            self.manifest = msgpack.unpackb(data)
+        else:
+            self.manifest = json.loads(data)
+        self._index = {artifact['name']: artifact for artifact in self.manifest['artifacts']}
+
+    def names(self, kind=None):
+        """Return the artifact names in the bundle, optionally only those of one kind."""
+        return [artifact['name'] for artifact in self.manifest['artifacts'] if kind is None or artifact['kind'] == kind]
+
+    def entry(self, name):
+        """Return the manifest entry of an artifact."""
+        return self._index[name]
+
+    def read_raw(self, name):
+        """Read an artifact's stored bytes without decompressing them."""
+        artifact = self._index[name]
+        self._file.seek(artifact['offset'])
+        return self._file.read(artifact['length'])
+
+    def read(self, name):
+        """
+        Read one artifact, decompressing it if needed.
+
+        Raises:
+            KeyError: If the bundle has no artifact with that name.
+        """
+        payload = self.read_raw(name)
+        return decompress(payload) if self._index[name]['codec'] else payload
+
+    def read_text(self, name):
+        """Read a text artifact (text, links, tables, metadata) as a string."""
+        return self.read(name).decode('utf-8')
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Concrete implementation writing one bundle file per document
+class StorageBundle(DataStorage):
+    def __init__(self, extractor, base_path, compression=None, manifest_format='json', image_dedup=None):
+        """
+        Args:
+            extractor: The DataExtractor providing the data to store.
+            base_path (str): Directory under which `bundles/<document_id>.bundle` is written.
+            compression (CompressionPolicy): Compresses the text, link, table and metadata artifacts.
+            manifest_format (str): 'json' or 'msgpack'.
+            image_dedup (ImageDeduplicator): When given, near-duplicate images are clustered and each
+                image entry in the manifest records its cluster and perceptual hashes.
+        """
+        super().__init__(extractor, image_dedup)
+        self.base_path = base_path
+        self.compression = compression
+        self.manifest_format = manifest_format
+        self.bundle_path = os.path.join(base_path, 'bundles', f'{self._get_document_id()}.bundle')
+        self._writer = None
+        self._kinds = set()
+
+    def _get_writer(self):
+        if self._writer is None:
+            self._writer = BundleWriter(self.bundle_path, self.manifest_format)
+        return self._writer
+
+    def _add_text(self, name, kind, text):
+        payload, codec = text.encode('utf-8'), None
+        if self.compression is not None:
+            codec, payload = self.compression.compress(kind, payload)
+        self._get_writer().add(name, kind, payload, codec, content_type='text/plain; charset=utf-8')
+        self._kinds.add(kind)
+
+    def save_text(self):
+        """Add the extracted text to the bundle."""
+        self._add_text('text', 'text', self.extractor.extract_text().strip())
+
+    def save_links(self):
+        """Add the extracted links to the bundle, one per line."""
+        self._add_text('links', 'links', '\n'.join(self.extractor.extract_links()))
+
+    def save_images(self):
+        """Add the extracted images to the bundle as extracted; only decoded PDF bitmaps are re-encoded (as PNG)."""
+        writer = self._get_writer()
+        for idx, page_number, image_data, cluster in self._clustered_images():
+            if not self._is_stored(cluster):
+                continue
+            try:
+                payload = self._prepare_image_data(image_data).read()
+                image = Image.open(BytesIO(payload))  # reads the header only, for format and size
+                if isinstance(image_data, dict) and image.format == 'PNG':
+                    # A decoded PDF bitmap, written with fast, light compression: compress it properly to keep
+                    buffer = BytesIO()
+                    image.save(buffer, format='PNG')
+                    payload = buffer.getvalue()
+                meta = {}
+                if cluster is not None:
+                    meta = dict(cluster, **{name: f'{cluster[name]:016x}' for name in HASH_NAMES})
+                writer.add(f'images/{idx + 1}.{image.format.lower()}', 'images', payload,
+                           content_type=Image.MIME.get(image.format), width=image.width, height=image.height,
+                           page_number=page_number, **meta)
+            except Exception as e:
+                self._record_error(f"Error saving image {idx + 1}: {e}")
+        self._kinds.add('images')
+
+    def save_tables(self):
+        """Add the extracted tables to the bundle in CSV format."""
+        for idx, table in enumerate(self.extractor.extract_tables()):
+            self._add_text(f'tables/{idx + 1}.csv', 'tables', '\n'.join([','.join(map(str, row)) for row in table]))
+        self._kinds.add('tables')
+
+    def save_metadata(self):
+        """Add the extracted metadata to the bundle as JSON."""
+        self._add_text('metadata', 'metadata', json.dumps(self.extractor.extract_metadata(), default=str))
+
+    def save_requested(self):
+        """
+        Save the requested artifact kinds and write the bundle.
+
+        Raises:
+            StorageError: If any artifact, or the bundle itself, could not be saved.
+            Exception: Whatever an extraction step raised; the partial bundle is discarded.
+        """
+        self.errors = []
+        try:
+            for kind in self.extractor.request.kinds:
+                getattr(self, f'save_{kind}')()
+        except Exception:
+            # Extraction itself failed: don't leave a half-written .tmp bundle behind
+            if self._writer is not None:
+                self._writer.abort()
+                self._writer = None
+            raise
+        self.close()
+        self._raise_errors()
+
+    def close(self):
+        """
+        Write the bundle.
+
+        Artifacts of kinds that were not saved this time are carried over from an
+        existing bundle of the same document, so a partial re-extraction does not
+        drop them.
+        """
+        writer = self._get_writer()
+        try:
+            if os.path.exists(self.bundle_path):
+                with BundleReader(self.bundle_path) as previous:
+                    for artifact in previous.manifest['artifacts']:
+                        if artifact['kind'] not in self._kinds:
+                            meta = {key: value for key, value in artifact.items()
+                                    if key not in ('name', 'kind', 'offset', 'length', 'codec')}
+                            writer.add(artifact['name'], artifact['kind'], previous.read_raw(artifact['name']),
+                                       artifact['codec'], **meta)
+            writer.close(document_id=self._get_document_id(), file_path=self.extractor.file_loader.file_path,
+                         file_type=self._get_file_type())
+            print(f"Bundle successfully saved to {self.bundle_path}")
+        except Exception as e:
+            writer.abort()
+            self._record_error(f"Error saving bundle: {e}")
+        finally:
+            self._writer = None
+            self._kinds = set()
@@ -0,0 +1,103 @@
+import gzip
+
+try:
+    import zstandard
+except ImportError:  # zstd support is optional; gzip is always available
+    zstandard = None
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# File suffix appended to artifacts written by the filesystem sink
+FILE_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3}
+
+
+def compress(data, codec, level=None):
+    """
+    Compress bytes with the given codec.
+
+    Args:
+        data (bytes): The payload to compress.
+        codec (str): 'gzip' or 'zstd'.
+        level (int): Compression level; None uses the codec default.
+
+    Returns:
+        bytes: The compressed payload, self-identifying through its magic number.
+    """
+    level = DEFAULT_LEVELS[codec] if level is None else level
+    if codec == 'gzip':
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError("zstd compression requires zstandard (pip install zstandard)")
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    raise ValueError(f"Unsupported compression codec: {codec}")
+
+
+def decompress(data):
+    """
+    Decompress bytes produced by `compress`, detecting the codec from the magic number.
+
+    Data without a known magic number is returned unchanged, so plain payloads
+    written before compression was enabled read back transparently.
+    """
+    if data.startswith(GZIP_MAGIC):
+        return gzip.decompress(data)
+    if data.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise ImportError("Reading zstd-compressed data requires zstandard (pip install zstandard)")
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=2 ** 31)
+    return data
+
+
+class CompressionPolicy:
+    """Choose a codec and a per-artifact-type compression level."""
+
+    def __init__(self, codec, levels=None):
+        """
+        Args:
+            codec (str): 'gzip' or 'zstd'.
+            levels (dict): Maps artifact types ('text', 'links', 'tables', 'metadata') to a level.
+                A level of 0 stores that artifact type uncompressed.
+        """
+        if codec not in FILE_SUFFIXES:
+            raise ValueError(f"Unsupported compression codec: {codec}")
+        if codec == 'zstd' and zstandard is None:
+            raise ImportError("zstd compression requires zstandard (pip install zstandard)")
+        self.codec = codec
+        self.levels = levels or {}
+
+    @classmethod
+    def from_spec(cls, spec):
+        """
+        Build a policy from a string such as `zstd` or `zstd:text=19,tables=9,links=0`.
+
+        Returns:
+            CompressionPolicy: The policy, or None for an empty spec or `none`.
+        """
+        if not spec or spec.strip().lower() == 'none':
+            return None
+        codec, _, level_spec = spec.strip().partition(':')
+        levels = {}
+        for item in filter(None, level_spec.split(',')):
+            artifact_type, _, level = item.partition('=')
+            levels[artifact_type.strip()] = int(level)
+        return cls(codec.strip().lower(), levels)
+
+    def level_for(self, artifact_type):
+        """Return the level for an artifact type, or None if it should not be compressed."""
+        level = self.levels.get(artifact_type, DEFAULT_LEVELS[self.codec])
+        return level if level > 0 else None
+
+    def compress(self, artifact_type, data):
+        """
+        Compress a payload according to the policy.
+
+        Returns:
+            tuple: (codec, payload) where codec is None if the payload was left uncompressed.
+        """
+        level = self.level_for(artifact_type)
+        if level is None:
+            return None, data
+        return self.codec, compress(data, self.codec, level)
@@ -0,0 +1,276 @@
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8  # 8x8 bits per hash, packed into one uint64
+DCT_SIZE = 32  # pHash works on the low frequencies of a 32x32 thumbnail
+HASH_NAMES = ('ahash', 'dhash', 'phash')
+POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def _dct_matrix(size):
+    """Return the orthonormal DCT-II matrix, so a 2-D transform is two matrix products."""
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2.0 / size)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+DCT_MATRIX = _dct_matrix(DCT_SIZE)
+
+
+def _pack(bits):
+    """Pack an (n, 8, 8) boolean array into n uint64 hashes, first bit most significant."""
+    packed = np.packbits(bits.reshape(len(bits), -1), axis=1)
+    return packed.view('>u8').ravel().astype(np.uint64)
+
+
+def hamming_distance(a, b):
+    """Return the element-wise number of differing bits between uint64 hashes (broadcasting)."""
+    difference = np.bitwise_xor(np.asarray(a, dtype=np.uint64), np.asarray(b, dtype=np.uint64))
+    if hasattr(np, 'bitwise_count'):  # NumPy 2.0+
+        return np.bitwise_count(difference).astype(np.int64)
+    difference = np.ascontiguousarray(difference)
+    return POPCOUNT[difference.view(np.uint8)].reshape(difference.shape + (8,)).sum(axis=-1, dtype=np.int64)
+
+
+def _thumbnails(image):
+    """Return the 32x32 and 9x8 grayscale thumbnails of an image as float32 arrays."""
+    if image.format == 'JPEG':
+        image.draft('L', (DCT_SIZE * 2, DCT_SIZE * 2))  # let the decoder downscale by 1/2..1/8
+    gray = image.convert('L')
+    large = gray.resize((DCT_SIZE, DCT_SIZE), Image.LANCZOS, reducing_gap=2.0)
+    small = gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS, reducing_gap=2.0)
+    return np.asarray(large, dtype=np.float32), np.asarray(small, dtype=np.float32)
+
+
+def perceptual_hashes(images):
+    """
+    Compute the average, difference and DCT hashes of a batch of images.
+
+    Each image is reduced to grayscale thumbnails as soon as it is read, so the
+    batch never holds more than one full-size image; the hashes themselves are
+    computed for the whole batch at once. An image that fails to decode (e.g.
+    truncated data, which PIL only notices when it reads the pixels) is skipped.
+
+    Args:
+        images (iterable): PIL images.
+
+    Returns:
+        dict: 'ahash', 'dhash' and 'phash' arrays of uint64, 'size' with the
+            (width, height) of each hashed image and 'hashed' with the position
+            of each hashed image in `images`.
+    """
+    large, small, sizes, hashed = [], [], [], []
+    for position, image in enumerate(images):
+        try:
+            thumbnails = _thumbnails(image)
+        except Exception as e:
+            print(f"Error decoding image {position + 1} for deduplication: {e}")
+            continue
+        sizes.append(image.size)
+        large.append(thumbnails[0])
+        small.append(thumbnails[1])
+        hashed.append(position)
+    if not sizes:
+        empty = np.zeros(0, dtype=np.uint64)
+        return {'ahash': empty, 'dhash': empty, 'phash': empty, 'size': [], 'hashed': []}
+    large, small = np.stack(large), np.stack(small)
+    count = len(sizes)
+
+    # aHash: 4x4 block means compared with the image mean
+    blocks = large.reshape(count, HASH_SIZE, DCT_SIZE // HASH_SIZE, HASH_SIZE, DCT_SIZE // HASH_SIZE).mean(axis=(2, 4))
+    ahash = _pack(blocks > blocks.mean(axis=(1, 2), keepdims=True))
+
+    # dHash: whether each pixel is brighter than its right neighbour
+    dhash = _pack(small[:, :, 1:] > small[:, :, :-1])
+
+    # pHash: 8x8 lowest DCT frequencies compared with their median (the DC term is left out of the median)
+    low = (DCT_MATRIX @ large @ DCT_MATRIX.T)[:, :HASH_SIZE, :HASH_SIZE]
+    median = np.median(low.reshape(count, -1)[:, 1:], axis=1)
+    phash = _pack(low > median[:, None, None])
+
+    return {'ahash': ahash, 'dhash': dhash, 'phash': phash, 'size': sizes, 'hashed': hashed}
+
+
+class HammingIndex:
+    """
+    Find 64-bit hashes within a Hamming distance of each other without comparing every pair.
+
+    The hash is split into `max_distance + 1` bands. Two hashes that differ in at
+    most `max_distance` bits cannot differ in every band, so they share at least one
+    band value exactly; only hashes sharing a band bucket are compared.
+    """
+
+    def __init__(self, max_distance):
+        """
+        Args:
+            max_distance (int): Largest number of differing bits that still counts as a match (0-63).
+
+        Raises:
+            ValueError: If the distance is outside 0-63.
+        """
+        if not 0 <= max_distance < 64:
+            raise ValueError(f"Hamming distance must be between 0 and 63, got {max_distance}")
+        self.max_distance = max_distance
+        edges = np.linspace(0, 64, max_distance + 2).round().astype(int)
+        self._bands = [(int(start), int(end - start)) for start, end in zip(edges[:-1], edges[1:])]
+        self._buckets = [{} for _ in self._bands]
+        self.hashes = np.zeros(0, dtype=np.uint64)
+
+    def _band_keys(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        return [(hashes >> np.uint64(start)) & np.uint64((1 << width) - 1) for start, width in self._bands]
+
+    def add(self, hashes):
+        """
+        Add a batch of hashes; they get consecutive ids after those already indexed.
+
+        Returns:
+            np.ndarray: The ids of the added hashes.
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        ids = np.arange(len(self.hashes), len(self.hashes) + len(hashes))
+        for buckets, keys in zip(self._buckets, self._band_keys(hashes)):
+            for key, id_ in zip(keys.tolist(), ids.tolist()):
+                buckets.setdefault(key, []).append(id_)
+        self.hashes = np.concatenate([self.hashes, hashes])
+        return ids
+
+    def pairs(self):
+        """
+        Return every pair of indexed hashes within `max_distance` bits of each other.
+
+        Returns:
+            np.ndarray: An (n, 2) array of ids, smaller id first, each pair listed once.
+        """
+        found = []
+        for buckets in self._buckets:
+            for members in buckets.values():
+                if len(members) < 2:
+                    continue
+                members = np.array(members)
+                distances = hamming_distance(self.hashes[members][:, None], self.hashes[members][None, :])
+                first, second = np.nonzero(np.triu(distances <= self.max_distance, k=1))
+                found.append(np.stack([members[first], members[second]], axis=1))
+        if not found:
+            return np.zeros((0, 2), dtype=np.int64)
+        return np.unique(np.concatenate(found), axis=0)
+
+
+def cluster_hashes(phashes, dhashes, max_distance):
+    """
+    Group near-duplicate images from their hashes.
+
+    Candidate pairs come from a HammingIndex over the pHashes; a pair is a match
+    when its dHashes are within the distance as well. Matches are joined
+    transitively (union-find).
+
+    Returns:
+        np.ndarray: A label per image; images with the same label are near-duplicates.
+    """
+    parents = np.arange(len(phashes))
+
+    def root(node):
+        while parents[node] != node:
+            parents[node] = parents[parents[node]]
+            node = parents[node]
+        return node
+
+    index = HammingIndex(max_distance)
+    index.add(phashes)
+    pairs = index.pairs()
+    if len(pairs):
+        dhashes = np.asarray(dhashes, dtype=np.uint64)
+        pairs = pairs[hamming_distance(dhashes[pairs[:, 0]], dhashes[pairs[:, 1]]) <= max_distance]
+    for first, second in pairs.tolist():
+        first, second = root(first), root(second)
+        if first != second:
+            parents[max(first, second)] = min(first, second)
+    return np.array([root(node) for node in range(len(parents))], dtype=np.int64)
+
+
+class ImageDeduplicator:
+    """
+    Cluster the images of a document into groups of near-duplicates.
+
+    The same picture re-saved at another resolution or JPEG quality gets nearly the
+    same perceptual hashes, so it lands in the same cluster even though its bytes
+    differ. Each cluster's representative is its largest image (the first one on a tie).
+    """
+
+    def __init__(self, max_distance=10, representatives_only=False):
+        """
+        Args:
+            max_distance (int): Largest pHash/dHash Hamming distance between near-duplicates.
+            representatives_only (bool): Whether storage keeps only each cluster's representative.
+        """
+        HammingIndex(max_distance)  # validates the distance
+        self.max_distance = max_distance
+        self.representatives_only = representatives_only
+
+    @classmethod
+    def from_spec(cls, spec):
+        """
+        Build a deduplicator from a string such as `clusters`, `representatives` or `representatives:6`.
+
+        `clusters` records the cluster of every image and stores them all;
+        `representatives` stores one image per cluster. The optional number is
+        the largest Hamming distance between near-duplicates.
+
+        Returns:
+            ImageDeduplicator: The deduplicator, or None for an empty spec or `none`.
+
+        Raises:
+            ValueError: For an unknown mode.
+        """
+        if not spec or spec.strip().lower() == 'none':
+            return None
+        mode, _, distance = spec.strip().lower().partition(':')
+        if mode not in ('clusters', 'representatives'):
+            raise ValueError(f"Unknown image deduplication mode: {mode}")
+        return cls(int(distance) if distance else 10, mode == 'representatives')
+
+    def cluster(self, images):
+        """
+        Assign each image to a cluster of near-duplicates.
+
+        Args:
+            images (iterable): PIL images in extraction order; None marks an image that
+                could not be opened, which gets no cluster (nor does one that fails to decode).
+
+        Returns:
+            list: Per image, None or a dict with 'cluster_id' (1-based, in order of first
+                appearance), 'representative' (bool), 'cluster_size' and the 'ahash',
+                'dhash' and 'phash' values as ints.
+        """
+        present, total = [], 0
+        def readable():
+            nonlocal total
+            # Images are hashed as they arrive, so only one is decoded at a time
+            for idx, image in enumerate(images):
+                total = idx + 1
+                if image is not None:
+                    present.append(idx)
+                    yield image
+        hashes = perceptual_hashes(readable())
+        present = [present[position] for position in hashes['hashed']]
+        labels = cluster_hashes(hashes['phash'], hashes['dhash'], self.max_distance)
+        areas = [width * height for width, height in hashes['size']]
+
+        cluster_ids, representatives, sizes = {}, {}, {}
+        for position, label in enumerate(labels.tolist()):
+            cluster_ids.setdefault(label, len(cluster_ids) + 1)
+            sizes[label] = sizes.get(label, 0) + 1
+            if label not in representatives or areas[position] > areas[representatives[label]]:
+                representatives[label] = position
+
+        clusters = [None] * total
+        for position, (idx, label) in enumerate(zip(present, labels.tolist())):
+            clusters[idx] = {
+                'cluster_id': cluster_ids[label],
+                'representative': representatives[label] == position,
+                'cluster_size': sizes[label],
+                **{name: int(hashes[name][position]) for name in HASH_NAMES},
+            }
+        return clusters
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import posixpath
+import shutil
+import sqlite3
+import tempfile
+import threading
+import zipfile
+from xml.etree import ElementTree
+
+RELATIONSHIPS_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+OFFICE_RELATIONSHIPS_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PRESENTATION_NS = '{http://schemas.openxmlformats.org/presentationml/2006/main}'
+
+# Bump when the layout of cached part results changes, so stale entries are ignored
+PART_RESULT_VERSION = 1
+
+
+def relationships_part(part_name):
+    """Return the name of the relationships part belonging to a package part."""
+    directory, name = posixpath.split(part_name)
+    return posixpath.join(directory, '_rels', name + '.rels')
+
+
+class PackageParts:
+    """
+    Fingerprint the parts of an OOXML package (DOCX or PPTX) without parsing the document.
+
+    A part's fingerprint covers the part itself, its relationships part and every
+    part those relationships point at (a slide's media, a document's images, ...),
+    so it changes whenever anything extraction reads for that part changes. It is
+    built from SHA-256 digests of the parts' bytes; each part is hashed at most
+    once, so media shared between slides is only read once.
+    """
+
+    def __init__(self, file_path):
+        """
+        Args:
+            file_path (str): Path to the DOCX or PPTX file.
+
+        Raises:
+            zipfile.BadZipFile: If the file is not a ZIP package.
+        """
+        self.file_path = file_path
+        self._relationships = {}
+        self._digests = {}
+        with zipfile.ZipFile(file_path) as package:
+            self.entries = {info.filename: (info.CRC, info.file_size) for info in package.infolist()}
+            for name in self.entries:
+                if name.endswith('.rels'):
+                    self._relationships[name] = ElementTree.fromstring(package.read(name))
+            if 'ppt/presentation.xml' in self.entries:
+                self._presentation = ElementTree.fromstring(package.read('ppt/presentation.xml'))
+            else:
+                self._presentation = None
+
+    def related(self, part_name):
+        """
+        Return the internal targets of a part's relationships.
+
+        Returns:
+            dict: Relationship ID to the package name of the target part.
+        """
+        relationships = self._relationships.get(relationships_part(part_name))
+        if relationships is None:
+            return {}
+        directory = posixpath.dirname(part_name)
+        targets = {}
+        for relationship in relationships.iter(f'{RELATIONSHIPS_NS}Relationship'):
+            if relationship.get('TargetMode') == 'External':
+                continue  # external targets (hyperlinks) live in the relationships part itself
+            target = relationship.get('Target')
+            if target.startswith('/'):
+                targets[relationship.get('Id')] = target.lstrip('/')
+            else:
+                targets[relationship.get('Id')] = posixpath.normpath(posixpath.join(directory, target))
+        return targets
+
+    def fingerprint(self, part_name):
+        """Return a digest that changes whenever the part or anything it refers to changes."""
+        digest = hashlib.sha256(f'{PART_RESULT_VERSION}:{part_name}'.encode('utf-8'))
+        names = [part_name, relationships_part(part_name)] + sorted(set(self.related(part_name).values()))
+        with zipfile.ZipFile(self.file_path) as package:
+            for name in names:
+                digest.update(f'|{name}:{self._part_digest(package, name)}'.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _part_digest(self, package, name):
+        # CRC-32 and size alone collide too easily across a large corpus, so hash the bytes
+        if name not in self._digests:
+            if name not in self.entries:
+                self._digests[name] = None
+            else:
+                digest = hashlib.sha256()
+                with package.open(name) as part:
+                    for chunk in iter(lambda: part.read(1024 * 1024), b''):
+                        digest.update(chunk)
+                self._digests[name] = digest.hexdigest()
+        return self._digests[name]
+
+    def slide_parts(self):
+        """Return the slide part names of a presentation in slide order."""
+        if self._presentation is None:
+            return []
+        targets = self.related('ppt/presentation.xml')
+        return [targets[slide_id.get(f'{OFFICE_RELATIONSHIPS_NS}id')]
+                for slide_id in self._presentation.iter(f'{PRESENTATION_NS}sldId')]
+
+    def read(self, part_names, spill_bytes=None):
+        """
+        Read several parts with one pass over the package.
+
+        Args:
+            part_names (list): Package names of the parts.
+            spill_bytes (int): Parts larger than this are streamed into temporary files,
+                returned open at the start, instead of being held in memory.
+
+        Returns:
+            list: The bytes (or temporary file) of each part.
+        """
+        parts = []
+        with zipfile.ZipFile(self.file_path) as package:
+            for name in part_names:
+                if spill_bytes is not None and self.entries[name][1] > spill_bytes:
+                    spilled = tempfile.TemporaryFile()
+                    with package.open(name) as part:
+                        shutil.copyfileobj(part, spilled)
+                    spilled.seek(0)
+                    parts.append(spilled)
+                else:
+                    parts.append(package.read(name))
+        return parts
+
+
+class PartCache:
+    """
+    Extraction results of individual OOXML package parts, keyed by part fingerprint.
+
+    When one slide of a large deck is edited, only that slide's fingerprint changes;
+    every other slide (and the core properties) is served from the cache instead of
+    being parsed again. Results are JSON documents holding the part's text, links,
+    tables and the package names of its images. The cache is a SQLite file and can
+    be shared by the worker processes of one host.
+    """
+
+    def __init__(self, cache_path):
+        """
+        Open (or create) a part cache.
+
+        Args:
+            cache_path (str): Path to the SQLite file holding the cache.
+        """
+        self.cache_path = cache_path
+        directory = os.path.dirname(cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(cache_path, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS part_results (
+                fingerprint TEXT PRIMARY KEY,
+                part_name TEXT NOT NULL,
+                result TEXT NOT NULL
+            )
+            '''
+        )
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, fingerprint):
+        """Return the cached result for a part fingerprint, or None."""
+        with self._lock:
+            row = self.conn.execute('SELECT result FROM part_results WHERE fingerprint = ?', (fingerprint,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, fingerprint, part_name, result):
+        """Store the result extracted from a part."""
+        with self._lock:
+            self.conn.execute('INSERT OR REPLACE INTO part_results (fingerprint, part_name, result) VALUES (?, ?, ?)',
+                              (fingerprint, part_name, json.dumps(result, default=str)))
+            self.conn.commit()
+
+    def close(self):
+        """Close the cache database."""
+        self.conn.close()
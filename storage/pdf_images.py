@@ -0,0 +1,400 @@
+import struct
+import tempfile
+import zlib
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+from pdfminer.pdftypes import PDFStream, resolve1
+
+# Filters whose output is an encoded image file PIL can open as it is
+PASSTHROUGH_FILTERS = ('DCTDecode', 'DCT', 'JPXDecode')
+FLATE_FILTERS = ('FlateDecode', 'Fl')
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# PNG color type for a given number of components (1 uses a palette so raw sample values survive)
+PNG_COLOR_TYPES = {1: 3, 2: 4, 3: 2, 4: 6}
+# Default colour space for each number of components (ICCBased, DeviceN)
+FAMILY_BY_COMPONENTS = {1: 'Gray', 3: 'RGB', 4: 'CMYK'}
+COLOR_SPACE_FAMILIES = {
+    'DeviceGray': 'Gray', 'G': 'Gray', 'CalGray': 'Gray',
+    'DeviceRGB': 'RGB', 'RGB': 'RGB', 'CalRGB': 'RGB',
+    'DeviceCMYK': 'CMYK', 'CMYK': 'CMYK',
+}
+COMPONENTS = {'Gray': 1, 'RGB': 3, 'CMYK': 4, 'Lab': 3, 'Separation': 1}
+# Linear sRGB from CIE XYZ
+XYZ_TO_SRGB = np.array([[3.2406, -1.5372, -0.4986],
+                        [-0.9689, 1.8758, 0.0415],
+                        [0.0557, -0.2040, 1.0570]])
+
+
+def pdf_name(value):
+    """Return the name of a PDF name object (or the value itself if it is not one)."""
+    value = resolve1(value)
+    return getattr(value, 'name', value)
+
+
+def _color_space(value):
+    """
+    Describe a PDF colour space.
+
+    Returns:
+        dict: 'family' (Gray, RGB, CMYK, Lab, Separation, DeviceN or Indexed) and 'components',
+            plus 'base', 'hival' and 'palette' for Indexed and 'whitepoint'/'range' for Lab.
+    """
+    value = resolve1(value)
+    if not isinstance(value, list):
+        name = pdf_name(value) or 'DeviceGray'
+        if name not in COLOR_SPACE_FAMILIES:
+            raise ValueError(f"Unsupported image colour space: {name}")
+        family = COLOR_SPACE_FAMILIES[name]
+        return {'family': family, 'components': COMPONENTS[family]}
+    name = pdf_name(value[0])
+    if name in COLOR_SPACE_FAMILIES:  # e.g. [/CalRGB << ... >>]
+        family = COLOR_SPACE_FAMILIES[name]
+        return {'family': family, 'components': COMPONENTS[family]}
+    if name == 'ICCBased':
+        profile = resolve1(value[1])
+        components = int(resolve1(profile.get('N', 3)))
+        return {'family': FAMILY_BY_COMPONENTS.get(components, 'RGB'), 'components': components}
+    if name in ('Indexed', 'I'):
+        base = _color_space(value[1])
+        hival = int(resolve1(value[2]))
+        lookup = resolve1(value[3])
+        lookup = lookup.get_data() if isinstance(lookup, PDFStream) else lookup
+        if isinstance(lookup, str):
+            lookup = lookup.encode('latin-1')
+        palette = np.frombuffer(lookup, np.uint8)
+        size = (hival + 1) * base['components']
+        palette = np.pad(palette[:size], (0, max(0, size - palette.size)))
+        return {'family': 'Indexed', 'components': 1, 'base': base, 'hival': hival,
+                'palette': palette.reshape(hival + 1, base['components'])}
+    if name == 'Lab':
+        params = resolve1(value[1]) if len(value) > 1 else {}
+        return {'family': 'Lab', 'components': 3,
+                'whitepoint': [float(v) for v in resolve1(params.get('WhitePoint', [0.9505, 1.0, 1.089]))],
+                'range': [float(v) for v in resolve1(params.get('Range', [-100, 100, -100, 100]))]}
+    if name == 'Separation':
+        return {'family': 'Separation', 'components': 1}
+    if name == 'DeviceN':
+        components = len(resolve1(value[1]))
+        return {'family': 'CMYK' if components == 4 else 'DeviceN', 'components': components}
+    raise ValueError(f"Unsupported image colour space: {name}")
+
+
+def _raw_samples(stream):
+    """Return the stream data with pdfminer's stream decryption applied but no filters."""
+    data = stream.rawdata
+    if stream.decipher:
+        data = stream.decipher(stream.objid, stream.genno, data, stream.attrs)
+    return data
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def _png_predicted_samples(stream, width, height, components, bpc):
+    """
+    Decode a Flate stream with PNG predictors using PIL's PNG decoder.
+
+    The stream data is exactly a PNG image's IDAT contents, so it is wrapped in a PNG
+    container instead of being unfiltered row by row in Python. One-component images
+    get an identity palette so the sample values come back unscaled.
+
+    Returns:
+        tuple: (samples array of shape (height, width, components), effective bits per component)
+    """
+    if components not in PNG_COLOR_TYPES or (components > 1 and bpc < 8):
+        return None
+    color_type = 0 if components == 1 and bpc == 16 else PNG_COLOR_TYPES[components]
+    png = PNG_SIGNATURE + _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, bpc, color_type, 0, 0, 0))
+    if color_type == 3:
+        levels = np.arange(2 ** bpc, dtype=np.uint8)
+        png += _png_chunk(b'PLTE', np.repeat(levels, 3).tobytes())
+    png += _png_chunk(b'IDAT', _raw_samples(stream)) + _png_chunk(b'IEND', b'')
+    image = Image.open(BytesIO(png))
+    image.load()
+    samples = np.asarray(image)
+    if color_type == 0:
+        return samples.astype(np.uint16).reshape(height, width, 1), 16
+    # PIL reduces 16-bit multi-component PNGs to 8 bits
+    return samples.reshape(height, width, components), 8 if components > 1 else bpc
+
+
+def _unpack_samples(data, width, height, components, bpc):
+    """Unpack rows of packed samples (1, 2, 4, 8 or 16 bits each) into a (height, width, components) array."""
+    row_bytes = (width * components * bpc + 7) // 8
+    buffer = np.frombuffer(data, np.uint8)
+    if buffer.size < row_bytes * height:
+        # Truncated streams are common; the missing rows decode as zeros
+        buffer = np.pad(buffer, (0, row_bytes * height - buffer.size))
+    rows = buffer[:row_bytes * height].reshape(height, row_bytes)
+    count = width * components
+    if bpc == 8:
+        samples = rows[:, :count]
+    elif bpc == 16:
+        samples = rows[:, :count * 2].copy().view('>u2').astype(np.uint16)
+    elif bpc in (1, 2, 4):
+        shifts = np.arange(8 - bpc, -1, -bpc, dtype=np.uint8)
+        samples = ((rows[:, :, None] >> shifts) & (2 ** bpc - 1)).reshape(height, -1)[:, :count]
+    else:
+        raise ValueError(f"Unsupported bits per component: {bpc}")
+    return samples.reshape(height, width, components)
+
+
+def _samples(stream, width, height, components, bpc):
+    """Return the image samples of a stream, taking fast paths for Flate with predictors."""
+    filters = stream.get_filters()
+    if stream.data is None and stream.rawdata is not None and len(filters) == 1 \
+            and pdf_name(filters[0][0]) in FLATE_FILTERS:
+        params = filters[0][1] or {}
+        predictor = int(resolve1(params.get('Predictor', 1)))
+        matches = (int(resolve1(params.get('Colors', 1))) == components
+                   and int(resolve1(params.get('Columns', 1))) == width
+                   and int(resolve1(params.get('BitsPerComponent', 8))) == bpc)
+        if predictor >= 10 and matches:
+            try:
+                result = _png_predicted_samples(stream, width, height, components, bpc)
+                if result is not None:
+                    return result
+            except (OSError, SyntaxError, ValueError):
+                pass  # damaged data; fall back to pdfminer's decoder
+        elif predictor == 2 and matches and bpc == 8:
+            # TIFF predictor: every sample is the difference to its left neighbour
+            data = zlib.decompress(_raw_samples(stream))
+            samples = _unpack_samples(data, width, height, components, bpc)
+            return np.cumsum(samples, axis=1, dtype=np.uint8), bpc
+    return _unpack_samples(stream.get_data(), width, height, components, bpc), bpc
+
+
+def _decode_map(samples, bpc, decode, components):
+    """Map raw samples through a Decode array to floats (None keeps the default [0 1] mapping)."""
+    maximum = np.float32(2 ** bpc - 1)
+    if decode is None:
+        return samples / maximum
+    low = np.array(decode[0::2][:components], dtype=np.float32)
+    high = np.array(decode[1::2][:components], dtype=np.float32)
+    return low + samples * ((high - low) / maximum)
+
+
+def _scale_to_uint8(samples, bpc):
+    """Scale raw samples to 0-255 with integer operations (the default Decode mapping)."""
+    if bpc == 8:
+        return samples.astype(np.uint8, copy=False)
+    if bpc == 16:
+        return (samples >> 8).astype(np.uint8)
+    lookup = np.rint(np.arange(2 ** bpc) * (255 / (2 ** bpc - 1))).astype(np.uint8)
+    return lookup[samples]
+
+
+def _cmyk_to_rgb(cmyk):
+    """Convert 8-bit CMYK pixels to RGB with integer arithmetic."""
+    cmyk = cmyk.astype(np.uint16)
+    return ((255 - cmyk[..., :3]) * (255 - cmyk[..., 3:4]) // 255).astype(np.uint8)
+
+
+def _to_uint8(values):
+    return np.clip(np.rint(values * 255), 0, 255).astype(np.uint8)
+
+
+def _lab_to_rgb(lab, whitepoint):
+    """Convert CIE L*a*b* values to sRGB bytes."""
+    fy = (lab[..., 0] + 16) / 116
+    f = np.stack([fy + lab[..., 1] / 500, fy, fy - lab[..., 2] / 200], axis=-1)
+    xyz = np.where(f > 6 / 29, f ** 3, 3 * (6 / 29) ** 2 * (f - 4 / 29)) * np.array(whitepoint)
+    linear = np.clip(xyz @ XYZ_TO_SRGB.T, 0, 1)
+    srgb = np.where(linear <= 0.0031308, 12.92 * linear, 1.055 * linear ** (1 / 2.4) - 0.055)
+    return _to_uint8(srgb)
+
+
+def _to_pixels(values, color_space):
+    """
+    Convert decoded components (floats in the colour space's range) to 8-bit pixels.
+
+    Returns:
+        tuple: (pixel array, PIL mode)
+    """
+    family = color_space['family']
+    if family == 'Gray':
+        return _to_uint8(values[..., 0]), 'L'
+    if family == 'RGB':
+        return _to_uint8(values), 'RGB'
+    if family == 'CMYK':
+        return _cmyk_to_rgb(_to_uint8(values)), 'RGB'
+    if family == 'Lab':
+        return _lab_to_rgb(values, color_space['whitepoint']), 'RGB'
+    # Separation and DeviceN tints: 1 is full ink, so render as darkness
+    return _to_uint8(1 - values.mean(axis=-1)), 'L'
+
+
+def _indexed_pixels(indices, color_space):
+    """Look up palette indices and convert the palette colours."""
+    base = color_space['base']
+    # Convert the (small) palette once, then gather pixels from it
+    palette = color_space['palette'][np.newaxis]
+    if base['family'] == 'Gray':
+        converted, mode = palette[..., 0], 'L'
+    elif base['family'] == 'RGB':
+        converted, mode = palette, 'RGB'
+    elif base['family'] == 'CMYK':
+        converted, mode = _cmyk_to_rgb(palette), 'RGB'
+    else:
+        decode = [0, 100] + base['range'] if base['family'] == 'Lab' else None
+        converted, mode = _to_pixels(_decode_map(palette, 8, decode, base['components']), base)
+    return converted[0][np.clip(indices, 0, color_space['hival'])], mode
+
+
+def _mask_alpha(mask_stream, width, height):
+    """Decode a soft or explicit mask to an 8-bit alpha channel of the image's size."""
+    mask = decode_pdf_image(mask_stream).convert('L')
+    if mask.size != (width, height):
+        mask = mask.resize((width, height))
+    return mask
+
+
+def decode_pdf_image(stream):
+    """
+    Decode a PDF image XObject to a PIL image.
+
+    The stream dictionary (Width, Height, BitsPerComponent, ColorSpace, Decode,
+    ImageMask, SMask, Mask) drives the conversion, and all pixel work is done on
+    whole NumPy arrays. Supports 1-16 bit samples in DeviceGray/RGB/CMYK,
+    Cal*, ICCBased, Lab, Indexed, Separation and DeviceN colour spaces,
+    stencil masks, soft masks, explicit masks and colour-key masks. Flate
+    streams with PNG predictors are decoded by PIL's PNG decoder.
+
+    Args:
+        stream: The image's PDFStream.
+
+    Returns:
+        PIL.Image.Image: An L, LA, RGB or RGBA image.
+
+    Raises:
+        ValueError: If the image uses an unsupported filter or colour space.
+    """
+    attrs = stream.attrs
+    filters = [pdf_name(name) for name, _ in stream.get_filters()]
+    if filters and filters[-1] == 'JBIG2Decode':
+        raise ValueError("JBIG2 images are not supported")
+    width = int(resolve1(attrs.get('Width', attrs.get('W'))))
+    height = int(resolve1(attrs.get('Height', attrs.get('H'))))
+    decode = resolve1(attrs.get('Decode', attrs.get('D')))
+    decode = None if decode is None else [float(resolve1(value)) for value in decode]
+
+    if filters and filters[-1] in PASSTHROUGH_FILTERS:
+        image = Image.open(BytesIO(stream.get_data()))
+        image = image.convert('RGB') if image.mode not in ('L', 'RGB') else image
+        if decode is not None and decode[0] > decode[1]:
+            image = Image.fromarray(255 - np.asarray(image))
+    elif resolve1(attrs.get('ImageMask', attrs.get('IM'))):
+        samples, bpc = _samples(stream, width, height, 1, 1)
+        painted = samples[..., 0] == (1 if decode is not None and decode[0] == 1 else 0)
+        # Stencil masks have no colour of their own: paint black on transparent
+        pixels = np.zeros((height, width, 2), np.uint8)
+        pixels[..., 1] = painted * np.uint8(255)
+        return Image.fromarray(pixels, 'LA')
+    else:
+        color_space = _color_space(attrs.get('ColorSpace', attrs.get('CS')))
+        bpc = int(resolve1(attrs.get('BitsPerComponent', attrs.get('BPC', 8))))
+        samples, bpc = _samples(stream, width, height, color_space['components'], bpc)
+        if color_space['family'] == 'Indexed':
+            indices = samples[..., 0]
+            if decode is not None:
+                # For Indexed images the Decode array maps straight to palette indices
+                # (the default is [0 2**bpc-1]), so the result needs no further scaling
+                indices = np.clip(np.rint(_decode_map(indices, bpc, decode, 1)), 0, color_space['hival']).astype(np.int64)
+            pixels, mode = _indexed_pixels(indices, color_space)
+        else:
+            family = color_space['family']
+            if decode is None and family in ('Gray', 'RGB', 'CMYK'):
+                # The common case stays in integer arithmetic
+                pixels = _scale_to_uint8(samples, bpc)
+                if family == 'Gray':
+                    pixels, mode = pixels[..., 0], 'L'
+                elif family == 'CMYK':
+                    pixels, mode = _cmyk_to_rgb(pixels), 'RGB'
+                else:
+                    mode = 'RGB'
+            else:
+                if decode is None and family == 'Lab':
+                    decode = [0, 100] + color_space['range']
+                values = _decode_map(samples, bpc, decode, color_space['components'])
+                pixels, mode = _to_pixels(values, color_space)
+        image = Image.fromarray(pixels, mode)
+        mask = resolve1(attrs.get('Mask'))
+        if isinstance(mask, list):
+            # Colour-key masking: pixels whose raw samples all fall in the ranges are transparent
+            low = np.array([int(resolve1(value)) for value in mask[0::2]])
+            high = np.array([int(resolve1(value)) for value in mask[1::2]])
+            keyed = np.all((samples >= low) & (samples <= high), axis=-1)
+            image.putalpha(Image.fromarray(np.where(keyed, 0, 255).astype(np.uint8), 'L'))
+            return image
+
+    smask = resolve1(attrs.get('SMask'))
+    mask = resolve1(attrs.get('Mask'))
+    if isinstance(smask, PDFStream):
+        image.putalpha(_mask_alpha(smask, width, height))
+    elif isinstance(mask, PDFStream):
+        # Explicit masks are stencil masks: painted (opaque) where the mask sample is 0
+        image.putalpha(_mask_alpha(mask, width, height).point(lambda value: 255 - value))
+    return image
+
+
+def encode_pdf_image(stream):
+    """
+    Return a PDF image XObject as the bytes of an image file.
+
+    JPEG and JPEG 2000 streams without masks are returned unchanged; everything
+    else is decoded with decode_pdf_image and encoded as PNG.
+
+    Args:
+        stream: The image's PDFStream.
+
+    Returns:
+        bytes: A JPEG, JPEG 2000 or PNG file.
+    """
+    attrs = stream.attrs
+    filters = [pdf_name(name) for name, _ in stream.get_filters()]
+    if filters and filters[-1] in PASSTHROUGH_FILTERS and not any(
+            key in attrs for key in ('SMask', 'Mask', 'Decode', 'D')):
+        return stream.get_data()
+    buffer = BytesIO()
+    # Favour speed: every storage sink re-encodes decoded bitmaps at PIL's default level before keeping them
+    decode_pdf_image(stream).save(buffer, format='PNG', compress_level=1)
+    return buffer.getvalue()
+
+
+def estimated_size(stream):
+    """Estimate the decoded size of a PDF image in bytes from its stream dictionary."""
+    attrs = stream.attrs
+    width = int(resolve1(attrs.get('Width', attrs.get('W', 0))))
+    height = int(resolve1(attrs.get('Height', attrs.get('H', 0))))
+    bpc = int(resolve1(attrs.get('BitsPerComponent', attrs.get('BPC', 8))) or 1)
+    try:
+        components = _color_space(attrs.get('ColorSpace', attrs.get('CS')))['components']
+    except (ValueError, TypeError, AttributeError):
+        components = 4
+    return width * height * components * bpc // 8
+
+
+class SpilledImage:
+    """A PDF image, already encoded as an image file, kept in a temporary file instead of memory."""
+
+    def __init__(self, attrs, data):
+        """
+        Args:
+            attrs (dict): The stream dictionary of the original image stream.
+            data (bytes): The encoded image file (see encode_pdf_image).
+        """
+        self.attrs = attrs
+        self._file = tempfile.TemporaryFile()
+        self._file.write(data)
+
+    def open(self):
+        """Return the temporary file, positioned at the start of the image."""
+        self._file.seek(0)
+        return self._file
+
+    def get_data(self):
+        """Read the encoded image back into memory."""
+        return self.open().read()
@@ -1,3 +1,4 @@
+import json
 import os
 import mysql.connector
 from abc import ABC, abstractmethod
@@ -6,12 +7,21 @@ from io import BytesIO
 from loaders.pdf_loader import PDFLoader
 from loaders.docx_loader import DOCXLoader
 from loaders.ppt_loader import PPTLoader
+from storage.blob_store import BlobStore
+from storage.compression import FILE_SUFFIXES, decompress
+from storage.image_dedup import HASH_NAMES
+from storage.pdf_images import SpilledImage, encode_pdf_image
+
+class StorageError(Exception):
+    """Raised by `save_requested` when some artifacts of a document could not be saved."""
 
 
 # Base abstract class for data storage
 class DataStorage(ABC):
-    def __init__(self, extractor):
+    def __init__(self, extractor, image_dedup=None):
         self.extractor = extractor
+        self.image_dedup = image_dedup
+        self.errors = []
 
     @abstractmethod
     def save_text(self):
@@ -38,14 +48,80 @@ class DataStorage(ABC):
         """Save extracted metadata."""
         pass
 
+    def save_requested(self):
+        """
+        Save only the artifact kinds listed in the extractor's request; other stages never run.
+
+        Every kind is attempted even if an earlier one fails.
+
+        Raises:
+            StorageError: If any artifact could not be saved, so the caller can record the
+                document as failed and retry it.
+        """
+        self.errors = []
+        for kind in self.extractor.request.kinds:
+            getattr(self, f'save_{kind}')()
+        self._raise_errors()
+
+    def _record_error(self, message):
+        """Report an artifact that could not be saved; `save_requested` raises once all kinds ran."""
+        print(message)
+        self.errors.append(message)
+
+    def _raise_errors(self):
+        if self.errors:
+            raise StorageError(f"{len(self.errors)} artifact(s) not saved: {'; '.join(self.errors)}")
+
     def _prepare_image_data(self, image_data):
         """Prepare image data for saving."""
         if isinstance(image_data, dict):
-            return BytesIO(image_data['stream'].get_data())
+            # pdfplumber image: decode raw bitmaps (Flate, indexed, CMYK, masked, ...) to an image file
+            if isinstance(image_data['stream'], SpilledImage):
+                return image_data['stream'].open()
+            return BytesIO(encode_pdf_image(image_data['stream']))
         if isinstance(image_data, bytes):
             return BytesIO(image_data)
+        # A spilled package part (temporary file): rewind it, hashing may already have read it
+        image_data.seek(0)
         return image_data
 
+    def _open_for_hashing(self, image_data):
+        """Open an extracted image, or return None if it cannot be decoded."""
+        try:
+            return Image.open(self._prepare_image_data(image_data))
+        except Exception as e:
+            print(f"Error opening image for deduplication: {e}")
+            return None
+
+    def _clustered_images(self):
+        """
+        Return the extracted images, each with its near-duplicate cluster.
+
+        Without an image deduplicator no image has a cluster. With one, all images
+        are hashed before any is stored.
+
+        Returns:
+            list: (index, page_number, image_data, cluster) tuples, where index is the image's
+                0-based position among the extracted images, page_number is the page or slide
+                it comes from (None for DOCX) and cluster is None or the dict from
+                `ImageDeduplicator.cluster`.
+        """
+        images = self.extractor.extract_images(with_pages=True)
+        if self.image_dedup is None:
+            return [(idx, page_number, image_data, None) for idx, (page_number, image_data) in enumerate(images)]
+        clusters = self.image_dedup.cluster(self._open_for_hashing(image_data) for _, image_data in images)
+        return [(idx, page_number, image_data, cluster)
+                for idx, ((page_number, image_data), cluster) in enumerate(zip(images, clusters))]
+
+    def _is_stored(self, cluster):
+        """Return whether an image is stored; in representatives-only mode other cluster members are not."""
+        return (self.image_dedup is None or not self.image_dedup.representatives_only
+                or cluster is None or cluster['representative'])
+
+    def _get_document_id(self):
+        """Return the content hash identifying the document being stored."""
+        return self.extractor.file_loader.content_hash()
+
     def _get_file_type(self):
         """Determine the file type based on the file loader used."""
         file_loader_mapping = {PDFLoader: 'pdf', DOCXLoader: 'docx', PPTLoader: 'ppt'}
@@ -55,9 +131,19 @@ class DataStorage(ABC):
 
 # Concrete implementation for file-based storage
 class Storage(DataStorage):
-    def __init__(self, extractor, base_path):
-        super().__init__(extractor)
+    def __init__(self, extractor, base_path, compression=None, image_dedup=None):
+        """
+        Args:
+            extractor: The DataExtractor providing the data to store.
+            base_path (str): Directory under which artifacts are written.
+            compression (CompressionPolicy): When given, text, link, table and metadata files are
+                compressed and written with a `.gz`/`.zst` suffix; `read_artifact` reads them back.
+            image_dedup (ImageDeduplicator): When given, near-duplicate images are clustered and
+                `images/<file_type>_clusters.json` records the cluster of each image.
+        """
+        super().__init__(extractor, image_dedup)
         self.base_path = base_path
+        self.compression = compression
         self._folders = ['images', 'tables', 'text', 'links', 'metadata']
         self.ensure_directories_exist()
 
@@ -83,15 +169,25 @@ class Storage(DataStorage):
 
     def save_images(self):
         """Save extracted images to individual files."""
-        images = self.extractor.extract_images()
-        for idx, image_data in enumerate(images):
+        saved = {}
+        entries = self._clustered_images()
+        for idx, _, image_data, cluster in entries:
+            if not self._is_stored(cluster):
+                continue
             try:
                 image = Image.open(self._prepare_image_data(image_data))
                 image_path = os.path.join(self.base_path, 'images', f'{self._get_file_type()}_image_{idx + 1}.{image.format.lower()}')
                 image.save(image_path)
+                saved[idx] = os.path.basename(image_path)
                 print(f"Image {idx + 1} successfully saved.")
             except Exception as e:
-                print(f"Error saving image {idx + 1}: {e}")
+                self._record_error(f"Error saving image {idx + 1}: {e}")
+        if self.image_dedup is not None:
+            clusters = [dict(cluster, image=idx + 1, file=saved.get(idx),
+                             **{name: f'{cluster[name]:016x}' for name in HASH_NAMES})
+                        for idx, _, _, cluster in entries if cluster is not None]
+            file_path = os.path.join(self.base_path, 'images', f'{self._get_file_type()}_clusters.json')
+            self._attempt_save(file_path, json.dumps(clusters, indent=2), "Image clusters")
 
     def save_tables(self):
         """Save extracted tables in CSV format."""
@@ -110,61 +206,166 @@ class Storage(DataStorage):
         metadata_content = '\n'.join(f"{key}: {value}" for key, value in metadata.items())
         self._attempt_save(file_path, metadata_content, "Metadata")
 
+    def read_artifact(self, file_path):
+        """
+        Read back a saved text artifact, decompressing it if it was stored compressed.
+
+        Args:
+            file_path (str): The artifact path as built by the save methods, without a compression suffix.
+
+        Returns:
+            str: The artifact contents. If several encodings of the artifact exist, the most
+                recently written one is read.
+        """
+        candidates = [file_path + suffix for suffix in [''] + list(FILE_SUFFIXES.values())
+                      if os.path.exists(file_path + suffix)]
+        if not candidates:
+            raise FileNotFoundError(file_path)
+        with open(max(candidates, key=os.path.getmtime), 'rb') as file:
+            return decompress(file.read()).decode('utf-8')
+
     def _attempt_save(self, file_path, data, data_type):
         """Generalized method to attempt saving data with error handling."""
         try:
-            with open(file_path, 'w', encoding='utf-8') as file:
-                file.write(data)
+            base_path = file_path
+            payload = data.encode('utf-8')
+            if self.compression is not None:
+                # The artifact type is the folder the file is written to (text, links, tables, metadata)
+                artifact_type = os.path.basename(os.path.dirname(file_path))
+                codec, payload = self.compression.compress(artifact_type, payload)
+                if codec is not None:
+                    file_path += FILE_SUFFIXES[codec]
+            with open(file_path, 'wb') as file:
+                file.write(payload)
+            # Remove the artifact's other encodings from earlier runs, so it is never read back stale
+            for stale_path in [base_path + suffix for suffix in [''] + list(FILE_SUFFIXES.values())]:
+                if stale_path != file_path and os.path.exists(stale_path):
+                    os.remove(stale_path)
             print(f"{data_type} successfully saved to {file_path}")
         except Exception as e:
-            print(f"Error saving {data_type}: {e}")
+            self._record_error(f"Error saving {data_type}: {e}")
 
 
 # Concrete implementation for SQL-based storage
 class StorageSQL(DataStorage):
-    def __init__(self, extractor, db_config):
-        super().__init__(extractor)
-        self.conn = mysql.connector.connect(**db_config)
+    def __init__(self, extractor, db_config, blob_store=None, compression=None, conn=None, image_dedup=None):
+        """
+        Args:
+            extractor: The DataExtractor providing the data to store.
+            db_config (dict): Connection arguments for mysql.connector.
+            blob_store (BlobStore): When given, image bytes are written to this store and
+                `extracted_images` only keeps their hash, size, dimensions, format and location.
+            compression (CompressionPolicy): When given, text and table payloads are stored
+                compressed in `content_compressed`; `read_text` and `read_tables` decompress them.
+            conn: An open connection to reuse instead of connecting with `db_config`; it is
+                left open by `close`, so long-lived workers can keep one connection warm.
+            image_dedup (ImageDeduplicator): When given, near-duplicate images are clustered and
+                `extracted_images` records each image's cluster and perceptual hashes.
+        """
+        super().__init__(extractor, image_dedup)
+        self.blob_store = blob_store
+        self.compression = compression
+        self._owns_conn = conn is None
+        self.conn = mysql.connector.connect(**db_config) if conn is None else conn
+        self._document_registered = False
         self.create_tables()
 
     def create_tables(self):
-        """Create tables in the MySQL database for storing data."""
+        """
+        Create tables in the MySQL database for storing data.
+
+        Every artifact table references the `documents` table through `document_id`
+        (the SHA-256 of the file contents) and is unique on (document_id, position),
+        which lets re-ingesting a file overwrite its rows instead of appending new ones.
+        Tables left by versions before `document_id` are moved aside first (see `migrate_tables`).
+        """
+        self.migrate_tables()
         cursor = self.conn.cursor()
         tables_sql = [
+            '''
+            CREATE TABLE IF NOT EXISTS documents (
+                id CHAR(64) PRIMARY KEY,
+                file_path VARCHAR(1024),
+                file_type VARCHAR(255),
+                file_size BIGINT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                INDEX idx_documents_file_type (file_type)
+            )
+            ''',
             '''
             CREATE TABLE IF NOT EXISTS extracted_text (
                 id INT AUTO_INCREMENT PRIMARY KEY,
-                file_type VARCHAR(255),
-                content TEXT
+                document_id CHAR(64) NOT NULL,
+                position INT NOT NULL,
+                content LONGTEXT NULL,
+                content_codec VARCHAR(16) NULL,
+                content_compressed LONGBLOB NULL,
+                UNIQUE KEY uq_text_document_position (document_id, position),
+                FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE CASCADE
             )
             ''',
             '''
             CREATE TABLE IF NOT EXISTS extracted_links (
                 id INT AUTO_INCREMENT PRIMARY KEY,
-                file_type VARCHAR(255),
-                link TEXT
+                document_id CHAR(64) NOT NULL,
+                position INT NOT NULL,
+                page_number INT NULL,
+                link TEXT,
+                UNIQUE KEY uq_links_document_position (document_id, position),
+                INDEX idx_links_document_page (document_id, page_number),
+                FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE CASCADE
             )
             ''',
             '''
             CREATE TABLE IF NOT EXISTS extracted_images (
                 id INT AUTO_INCREMENT PRIMARY KEY,
-                file_type VARCHAR(255),
-                image LONGBLOB
+                document_id CHAR(64) NOT NULL,
+                position INT NOT NULL,
+                page_number INT NULL,
+                image LONGBLOB NULL,
+                blob_hash CHAR(64),
+                byte_size BIGINT,
+                width INT,
+                height INT,
+                format VARCHAR(16),
+                location VARCHAR(1024) NULL,
+                cluster_id INT NULL,
+                is_representative BOOLEAN NULL,
+                ahash BIGINT UNSIGNED NULL,
+                dhash BIGINT UNSIGNED NULL,
+                phash BIGINT UNSIGNED NULL,
+                UNIQUE KEY uq_images_document_position (document_id, position),
+                INDEX idx_images_document_page (document_id, page_number),
+                INDEX idx_images_blob_hash (blob_hash),
+                INDEX idx_images_document_cluster (document_id, cluster_id),
+                FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE CASCADE
             )
             ''',
             '''
             CREATE TABLE IF NOT EXISTS extracted_tables (
                 id INT AUTO_INCREMENT PRIMARY KEY,
-                file_type VARCHAR(255),
-                table_data TEXT
+                document_id CHAR(64) NOT NULL,
+                position INT NOT NULL,
+                page_number INT NULL,
+                table_data LONGTEXT NULL,
+                content_codec VARCHAR(16) NULL,
+                content_compressed LONGBLOB NULL,
+                UNIQUE KEY uq_tables_document_position (document_id, position),
+                INDEX idx_tables_document_page (document_id, page_number),
+                FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE CASCADE
             )
             ''',
             '''
             CREATE TABLE IF NOT EXISTS extracted_metadata (
                 id INT AUTO_INCREMENT PRIMARY KEY,
-                file_type VARCHAR(255),
+                document_id CHAR(64) NOT NULL,
+                position INT NOT NULL,
                 `key` VARCHAR(255),
-                `value` TEXT
+                `value` TEXT,
+                UNIQUE KEY uq_metadata_document_position (document_id, position),
+                INDEX idx_metadata_document_key (document_id, `key`),
+                FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE CASCADE
             )
             '''
         ]
@@ -172,72 +373,237 @@ class StorageSQL(DataStorage):
             cursor.execute(sql)
         self.conn.commit()
 
+    def _table_columns(self, table_name):
+        """Return the column names of a table in the current database (empty if it does not exist)."""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT column_name FROM information_schema.columns '
+                       'WHERE table_schema = DATABASE() AND table_name = %s', (table_name,))
+        return {row[0].lower() for row in cursor.fetchall()}
+
+    def migrate_tables(self):
+        """
+        Move aside artifact tables created before documents were keyed by content hash.
+
+        Those tables have no `document_id` column, so their rows cannot be matched to a
+        document; they are renamed to `<table>_legacy` so the rows are kept, and fresh
+        tables are created.
+
+        Raises:
+            RuntimeError: If a `<table>_legacy` table already exists.
+        """
+        cursor = self.conn.cursor()
+        for table_name in ('extracted_text', 'extracted_links', 'extracted_images', 'extracted_tables',
+                           'extracted_metadata'):
+            columns = self._table_columns(table_name)
+            if not columns or 'document_id' in columns:
+                continue
+            legacy_name = f'{table_name}_legacy'
+            if self._table_columns(legacy_name):
+                raise RuntimeError(f"Cannot migrate {table_name}: {legacy_name} already exists")
+            cursor.execute(f'RENAME TABLE {table_name} TO {legacy_name}')
+            print(f"Moved pre-document table {table_name} to {legacy_name}")
+        self.conn.commit()
+
     def save_text(self):
         """Save extracted text to the database."""
         text = self.extractor.extract_text()
-        file_type = self._get_file_type()
-        
-        self._attempt_sql_insert('extracted_text', [file_type, text], "Text")
+
+        rows = [self._encode_payload('text', text)]
+        self._attempt_sql_upsert('extracted_text', ['content', 'content_codec', 'content_compressed'], rows, "Text")
 
     def save_links(self):
         """Save extracted links to the database."""
-        links = self.extractor.extract_links()
-        file_type = self._get_file_type()
-        
-        for link in links:
-            self._attempt_sql_insert('extracted_links', [file_type, link], "Link")
+        links = self.extractor.extract_links(with_pages=True)
+
+        rows = [(page_number, link) for page_number, link in links]
+        self._attempt_sql_upsert('extracted_links', ['page_number', 'link'], rows, "Links")
 
     def save_images(self):
         """Save extracted images to the database."""
-        images = self.extractor.extract_images()
-        file_type = self._get_file_type()
-        
-        for image_data in images:
+        rows, positions = [], []
+        for idx, page_number, image_data, cluster in self._clustered_images():
+            if not self._is_stored(cluster):
+                continue
             try:
-                img_byte_arr = self._get_image_bytes(image_data)
-                self._attempt_sql_insert('extracted_images', [file_type, img_byte_arr], "Image")
+                img_byte_arr, image = self._get_image_bytes(image_data, with_image=True)
+                byte_size = len(img_byte_arr)
+                blob_hash = BlobStore.digest(img_byte_arr)
+                location = None
+                if self.blob_store is not None:
+                    # Keep only the reference in the database; the bytes live in the blob store
+                    blob_hash, location = self.blob_store.put(img_byte_arr)
+                    img_byte_arr = None
+                cluster = cluster or {}
+                rows.append((page_number, img_byte_arr, blob_hash, byte_size,
+                             image.width, image.height, image.format, location, cluster.get('cluster_id'),
+                             cluster.get('representative')) + tuple(cluster.get(name) for name in HASH_NAMES))
+                positions.append(idx)
             except Exception as e:
-                print(f"Error saving image: {e}")
+                self._record_error(f"Error saving image {idx + 1}: {e}")
+        columns = ['page_number', 'image', 'blob_hash', 'byte_size', 'width', 'height', 'format', 'location',
+                   'cluster_id', 'is_representative'] + list(HASH_NAMES)
+        # Positions are the images' indexes in the document, so skipped or failed images leave gaps
+        self._attempt_sql_upsert('extracted_images', columns, rows, "Images", positions)
+
+    def read_text(self, document_id):
+        """
+        Read a document's stored text, decompressing it transparently.
+
+        Args:
+            document_id (str): The content hash of the source document.
+
+        Returns:
+            str: The stored text, or None if the document has no text row.
+        """
+        payloads = self._read_payloads('extracted_text', 'content', document_id)
+        return payloads[0] if payloads else None
+
+    def read_tables(self, document_id):
+        """
+        Read a document's stored tables as CSV strings, decompressing them transparently.
+
+        Args:
+            document_id (str): The content hash of the source document.
+
+        Returns:
+            list: The CSV text of each table, in extraction order.
+        """
+        return self._read_payloads('extracted_tables', 'table_data', document_id)
+
+    def _read_payloads(self, table_name, column, document_id):
+        """Fetch a document's payload column in position order, decompressing compressed rows."""
+        cursor = self.conn.cursor()
+        cursor.execute(f'SELECT {column}, content_compressed FROM {table_name} '
+                       f'WHERE document_id = %s ORDER BY position', (document_id,))
+        return [plain if compressed is None else decompress(bytes(compressed)).decode('utf-8')
+                for plain, compressed in cursor.fetchall()]
+
+    def _encode_payload(self, artifact_type, text):
+        """
+        Encode a text payload for storage according to the compression policy.
+
+        Returns:
+            tuple: (plain_text, codec, compressed_bytes); exactly one of plain_text and
+                compressed_bytes is set.
+        """
+        if self.compression is None:
+            return text, None, None
+        codec, payload = self.compression.compress(artifact_type, text.encode('utf-8'))
+        if codec is None:
+            return text, None, None
+        return None, codec, payload
+
+    def open_image(self, document_id, position):
+        """
+        Open a stored image for streaming reads, wherever its bytes live.
+
+        Args:
+            document_id (str): The content hash of the source document.
+            position (int): The 0-based index of the image within the document.
+
+        Returns:
+            A binary file-like object with the image bytes.
+
+        Raises:
+            KeyError: If no such image is stored.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT image, location FROM extracted_images WHERE document_id = %s AND position = %s',
+                       (document_id, position))
+        row = cursor.fetchone()
+        if row is None:
+            raise KeyError(f"No image {position} stored for document {document_id}")
+        image, location = row
+        if image is not None:
+            return BytesIO(image)
+        if self.blob_store is None:
+            raise ValueError("Image is stored out of line but no blob store is configured")
+        return self.blob_store.open(location)
 
     def save_tables(self):
         """Save extracted tables to the database."""
-        tables = self.extractor.extract_tables()
-        file_type = self._get_file_type()
-        
-        for idx, table in enumerate(tables):
-            table_data = '\n'.join([','.join(map(str, row)) for row in table])
-            self._attempt_sql_insert('extracted_tables', [file_type, table_data], f"Table {idx + 1}")
+        tables = self.extractor.extract_tables(with_pages=True)
+
+        rows = [(page_number,) + self._encode_payload('tables', '\n'.join([','.join(map(str, row)) for row in table]))
+                for page_number, table in tables]
+        self._attempt_sql_upsert('extracted_tables', ['page_number', 'table_data', 'content_codec', 'content_compressed'],
+                                 rows, "Tables")
 
     def save_metadata(self):
         """Save extracted metadata to the database."""
         metadata = self.extractor.extract_metadata()
-        file_type = self._get_file_type()
-        
-        for key, value in metadata.items():
-            self._attempt_sql_insert('extracted_metadata', [file_type, key, value], f"Metadata ({key})")
 
-    def _attempt_sql_insert(self, table_name, values, data_type):
-        """Generalized method to attempt inserting data into SQL with error handling."""
+        rows = [(key, value) for key, value in metadata.items()]
+        self._attempt_sql_upsert('extracted_metadata', ['`key`', '`value`'], rows, "Metadata")
+
+    def _ensure_document(self):
+        """Insert or refresh the `documents` row for the file being stored."""
+        if self._document_registered:
+            return
+        file_loader = self.extractor.file_loader
+        sql = (
+            'INSERT INTO documents (id, file_path, file_type, file_size) VALUES (%s, %s, %s, %s) '
+            'ON DUPLICATE KEY UPDATE file_path = VALUES(file_path), file_type = VALUES(file_type), '
+            'file_size = VALUES(file_size), updated_at = CURRENT_TIMESTAMP'
+        )
         cursor = self.conn.cursor()
-        placeholders = ', '.join(['%s'] * len(values))
-        sql = f'INSERT INTO {table_name} VALUES (NULL, {placeholders})'  # Updated to auto-increment ID
-        
+        cursor.execute(sql, (self._get_document_id(), file_loader.file_path,
+                             self._get_file_type(), os.path.getsize(file_loader.file_path)))
+        self.conn.commit()
+        self._document_registered = True
+
+    def _attempt_sql_upsert(self, table_name, columns, rows, data_type, positions=None):
+        """
+        Upsert one document's rows into a table and drop rows left over from a previous ingest.
+
+        Rows are keyed by (document_id, position), so re-running a file replaces its
+        rows in place. Rows at any other position are deleted. All statements for the
+        table run in a single transaction.
+
+        Args:
+            positions (list): The position of each row; None numbers the rows from 0.
+        """
         try:
-            cursor.execute(sql, values)
+            self._ensure_document()
+            document_id = self._get_document_id()
+            cursor = self.conn.cursor()
+            all_columns = ['document_id', 'position'] + columns
+            placeholders = ', '.join(['%s'] * len(all_columns))
+            updates = ', '.join(f'{column} = VALUES({column})' for column in columns)
+            sql = (f'INSERT INTO {table_name} ({", ".join(all_columns)}) VALUES ({placeholders}) '
+                   f'ON DUPLICATE KEY UPDATE {updates}')
+            if positions is None:
+                positions = range(len(rows))
+            values = [(document_id, position) + tuple(row) for position, row in zip(positions, rows)]
+            if values:
+                cursor.executemany(sql, values)
+            if positions == range(len(rows)):
+                cursor.execute(f'DELETE FROM {table_name} WHERE document_id = %s AND position >= %s',
+                               (document_id, len(values)))
+            elif values:
+                placeholders = ', '.join(['%s'] * len(values))
+                cursor.execute(f'DELETE FROM {table_name} WHERE document_id = %s AND position NOT IN ({placeholders})',
+                               (document_id,) + tuple(positions))
+            else:
+                cursor.execute(f'DELETE FROM {table_name} WHERE document_id = %s', (document_id,))
             self.conn.commit()
             print(f"{data_type} successfully saved to SQL database.")
         except Exception as e:
-            print(f"Error saving {data_type} to SQL database: {e}")
+            self.conn.rollback()
+            self._record_error(f"Error saving {data_type} to SQL database: {e}")
 
-    def _get_image_bytes(self, image_data):
-        """Convert image data to bytes."""
+    def _get_image_bytes(self, image_data, with_image=False):
+        """Convert image data to bytes, optionally returning the decoded image alongside."""
         img_byte_arr = BytesIO()
         image = Image.open(self._prepare_image_data(image_data))
         image.save(img_byte_arr, format=image.format)
         img_byte_arr.seek(0)
+        if with_image:
+            return img_byte_arr.getvalue(), image
         return img_byte_arr.getvalue()
 
     def close(self):
-        """Close the database connection."""
-        self.conn.close()
-        print("Database connection closed.")
\ No newline at end of file
+        """Close the database connection, unless it was provided by the caller."""
+        if self._owns_conn:
+            self.conn.close()
+            print("Database connection closed.")
@@ -1,12 +1,59 @@
+import asyncio
 import unittest
+from unittest import mock
+import gzip
+import json
 import os
 import shutil
-from data_extractor import DataExtractor
+import tempfile
+import threading
+import time
+import numpy as np
+from io import BytesIO
+from pdfminer.pdftypes import PDFStream
+from pdfminer.psparser import LIT
+from pptx import Presentation
+from PIL import Image
+from data_extractor import DataExtractor, ExtractionRequest, FIDELITY_LEVELS, KINDS
 from loaders.pdf_loader import PDFLoader
 from loaders.docx_loader import DOCXLoader
 from loaders.ppt_loader import  PPTLoader
 from storage.storage import Storage
-from storage.storage import StorageSQL
+from storage.storage import StorageSQL, StorageError
+from storage.blob_store import LocalBlobStore
+from storage.compression import CompressionPolicy, decompress
+from storage.bundle import BundleWriter, BundleReader, StorageBundle
+from storage.part_cache import PartCache
+from storage.pdf_images import decode_pdf_image, encode_pdf_image
+from storage.image_dedup import ImageDeduplicator, perceptual_hashes
+from pipeline.journal import BatchJournal, QUEUED, EXTRACTING, FAILED
+from pipeline.worker import SupervisedWorker, WorkerLimits, WorkerFailure
+from pipeline.scheduler import BatchScheduler, CostModel, count_matches, report_costs, PDF_IMAGE_PATTERN
+from pipeline.governor import MemoryGovernor
+from pipeline.probe import probe_document
+from pipeline.job_queue import JobQueue, path_hash
+from pipeline.watcher import DirectoryWatcher, WatchDaemon
+from main import get_loader
+from pipeline.service import ExtractionService
+
+def describe_document(file_path, request):
+    """Stand-in service task: report what the worker received."""
+    with open(file_path, 'rb') as file:
+        return {'data': file.read().decode('utf-8'), 'kinds': request.kinds}
+
+
+WARMED = False
+
+
+def mark_warm():
+    """Stand-in warm-up function: flag the worker process as warmed up."""
+    global WARMED
+    WARMED = True
+
+
+def is_warm():
+    return WARMED
+
 
 class TestStorage(unittest.TestCase):
 
@@ -331,5 +378,545 @@ class TestFileProcessing(unittest.TestCase):
         storage.save_links() 
         self.assertFalse(os.path.exists('output_folder/pdf_links.txt'), msg="Links should be saved to local storage")
 
+    def test_TC_25_content_hash_identifies_document(self):
+        """Test that the document identifier depends on file contents, not on the loader or path."""
+        pdf_hash = PDFLoader('input/special.pdf').content_hash()
+        self.assertEqual(len(pdf_hash), 64, msg="Document id should be a SHA-256 hex digest")
+        self.assertEqual(pdf_hash, PDFLoader('./input/special.pdf').content_hash(),
+                         msg="The same file should always map to the same document id")
+        self.assertNotEqual(pdf_hash, DOCXLoader('input/special.docx').content_hash(),
+                            msg="Different files should map to different document ids")
+
+    def test_TC_26_blob_store_is_content_addressed(self):
+        """Test that identical image bytes are stored once and read back unchanged."""
+        blob_store = LocalBlobStore(os.path.join(self.base_output_folder, 'blobs'))
+        digest, location = blob_store.put(b'image bytes')
+        self.assertEqual(blob_store.put(b'image bytes'), (digest, location), msg="Identical blobs should share a location")
+        self.assertEqual(blob_store.read(location), b'image bytes', msg="Blob should round-trip unchanged")
+        shutil.rmtree(os.path.join(self.base_output_folder, 'blobs'))
+
+    def test_TC_27_compressed_artifacts_read_back_transparently(self):
+        """Test that compressed artifacts are smaller on disk and read back as the original text."""
+        policy = CompressionPolicy.from_spec('gzip:text=9,links=0')
+        self.assertIsNone(policy.level_for('links'), msg="Level 0 should disable compression for that artifact type")
+        codec, payload = policy.compress('text', b'repeated text ' * 100)
+        self.assertEqual(codec, 'gzip')
+        self.assertLess(len(payload), 1400, msg="Compressed text should be smaller than the original")
+        self.assertEqual(decompress(payload), b'repeated text ' * 100, msg="Text should round-trip unchanged")
+        self.assertEqual(decompress(b'plain text'), b'plain text', msg="Uncompressed data should read back unchanged")
+
+    def test_TC_28_journal_resumes_unfinished_documents(self):
+        """Test that the checkpoint journal skips stored documents and keeps failed ones retryable."""
+        journal = BatchJournal(os.path.join(self.base_output_folder, 'journal.db'))
+        journal.enqueue(['a.pdf', 'b.docx', 'c.pptx'])
+        journal.mark_extracting('a.pdf', 'hash-a')
+        journal.mark_stored('a.pdf')
+        journal.mark_extracting('b.docx', 'hash-b')
+        journal.mark_failed('b.docx', 'Corrupt file')
+        journal.mark_extracting('c.pptx', 'hash-c')  # interrupted mid-extraction
+        self.assertTrue(journal.is_stored('a.pdf', 'hash-a'), msg="Stored documents should be skipped")
+        self.assertFalse(journal.is_stored('a.pdf', 'changed'), msg="Changed documents should be reprocessed")
+        self.assertEqual(journal.paths([QUEUED, EXTRACTING, FAILED]), ['b.docx', 'c.pptx'])
+        self.assertEqual(journal.failures(), {'b.docx': 'Corrupt file'})
+        journal.close()
+        for suffix in ['-wal', '-shm']:
+            if os.path.exists(os.path.join(self.base_output_folder, 'journal.db' + suffix)):
+                os.remove(os.path.join(self.base_output_folder, 'journal.db' + suffix))
+
+    def test_TC_29_supervised_worker_kills_hung_document(self):
+        """Test that a document exceeding its wall-time limit fails without blocking the next one."""
+        worker = SupervisedWorker(WorkerLimits(wall_time=0.5))
+        try:
+            with self.assertRaises(WorkerFailure, msg="A hung document should be recorded as failed"):
+                worker.run(time.sleep, 10)
+            self.assertEqual(worker.run(len, 'abc'), 3, msg="The recycled worker should keep processing the queue")
+        finally:
+            worker.close()
+
+    def test_TC_30_extraction_request_selects_kinds_and_pages(self):
+        """Test parsing of selective extraction requests."""
+        request = ExtractionRequest.from_spec('metadata, text', '1-3,7')
+        self.assertEqual(request.kinds, ['text', 'metadata'], msg="Kinds should follow the storage order")
+        self.assertEqual(request.pages, [1, 2, 3, 7])
+        self.assertFalse(request.includes_page(4))
+        self.assertEqual(ExtractionRequest().kinds, list(KINDS), msg="No spec should extract everything")
+        with self.assertRaises(ValueError):
+            ExtractionRequest.from_spec('text,ocr')
+        for pages in ('5-3', '0', '2,x'):
+            with self.assertRaises(ValueError, msg=f"'{pages}' should be rejected"):
+                ExtractionRequest.from_spec('text', pages)
+
+    def test_TC_31_scheduler_dispatches_longest_first(self):
+        """Test that the batch plan puts the most expensive documents first and the estimator can be refitted."""
+        model = CostModel.from_spec('base=0,pages=1,megabytes=0,images=0')
+        plan = BatchScheduler(1, cost_model=model).plan(['input/special.pptx', 'input/Document 2.pdf'])
+        self.assertEqual([estimate['file_path'] for estimate in plan], ['input/Document 2.pdf', 'input/special.pptx'],
+                         msg="The two-page PDF should be dispatched before the one-slide deck")
+        records = [{'pages': pages, 'megabytes': 0.0, 'images': 0, 'actual': 0.5 + 2 * pages} for pages in range(1, 7)]
+        fitted = CostModel.fit(records)
+        self.assertAlmostEqual(fitted.weights['pages'], 2.0, places=3, msg="Refitting should recover the per-page cost")
+
+    def test_TC_32_job_queue_requeues_expired_leases(self):
+        """Test that a document claimed by a dead worker is handed to another worker once its lease expires."""
+        job_queue = JobQueue.open(os.path.join(self.base_output_folder, 'queue.db'), max_attempts=2)
+        job_queue.enqueue(['small.docx', 'large.pdf'], {'small.docx': 1.0, 'large.pdf': 9.0})
+        job = job_queue.claim('node-a', lease_seconds=0)
+        self.assertEqual(job['file_path'], 'large.pdf', msg="The highest-priority document should be claimed first")
+        self.assertFalse(job_queue.heartbeat(job['id'], 'node-b', 60), msg="Only the owner may renew a lease")
+        time.sleep(0.01)
+        reclaimed = job_queue.claim('node-b', lease_seconds=60)
+        self.assertEqual((reclaimed['file_path'], reclaimed['attempts']), ('large.pdf', 2),
+                         msg="An expired lease should be reclaimed by another worker")
+        job_queue.complete(reclaimed['id'], 'node-b')
+        self.assertEqual(job_queue.stats(), {'pending': 1, 'claimed': 0, 'done': 1, 'failed': 0})
+        long_prefix = '/data/' + 'x' * 300
+        self.assertNotEqual(path_hash(long_prefix + '/a.pdf'), path_hash(long_prefix + '/b.pdf'),
+                            msg="Paths sharing a long prefix should get distinct queue keys")
+        job_queue.close()
+        for suffix in ['-wal', '-shm']:
+            if os.path.exists(os.path.join(self.base_output_folder, 'queue.db' + suffix)):
+                os.remove(os.path.join(self.base_output_folder, 'queue.db' + suffix))
+
+    def test_TC_33_watcher_waits_for_files_to_settle(self):
+        """Test that watched documents are only reported once they stop changing."""
+        watcher = DirectoryWatcher([self.base_output_folder], settle_seconds=0.2, poll_interval=0.05, use_inotify=False)
+        document = os.path.join(self.base_output_folder, 'incoming.pdf')
+        with open(document, 'wb') as file:
+            file.write(b'%PDF-1.4 partial')
+        with open(os.path.join(self.base_output_folder, 'notes.txt'), 'w') as file:
+            file.write('not a document')
+        self.assertEqual(watcher.poll(), [], msg="A file that was just written should not be reported yet")
+        ready = []
+        deadline = time.time() + 2
+        while not ready and time.time() < deadline:
+            ready = watcher.poll()
+        self.assertEqual([path for path, _ in ready], [os.path.abspath(document)],
+                         msg="Only the settled, supported document should be reported")
+        self.assertEqual(watcher.poll(), [], msg="An unchanged document should not be reported twice")
+        watcher.close()
+
+    def test_TC_34_bundle_reads_single_artifact(self):
+        """Test that any artifact can be read back from a bundle by name."""
+        bundle_path = os.path.join(self.base_output_folder, 'document.bundle')
+        writer = BundleWriter(bundle_path)
+        writer.add('text', 'text', gzip.compress(b'extracted text'), 'gzip')
+        writer.add('images/1.png', 'images', b'\x89PNG image bytes', width=10, height=20)
+        writer.add('tables/1.csv', 'tables', b'a,b\n1,2')
+        writer.close(document_id='abc')
+        with BundleReader(bundle_path) as reader:
+            self.assertEqual(reader.manifest['document_id'], 'abc')
+            self.assertEqual(reader.names('images'), ['images/1.png'])
+            self.assertEqual(reader.read('tables/1.csv'), b'a,b\n1,2')
+            self.assertEqual(reader.read_text('text'), 'extracted text', msg="Compressed artifacts should read back transparently")
+            self.assertEqual(reader.entry('images/1.png')['height'], 20)
+
+    def test_TC_35_pdf_text_fidelity_levels(self):
+        """Test that every fidelity level extracts the text of a PDF and unknown levels are rejected."""
+        with self.assertRaises(ValueError):
+            ExtractionRequest(fidelity='exact')
+        pdf_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'input', 'Document 2.pdf')
+        for fidelity in FIDELITY_LEVELS:
+            extractor = DataExtractor(PDFLoader(pdf_file), ExtractionRequest(kinds=['text'], fidelity=fidelity))
+            text = ' '.join(extractor.extract_text().split())
+            self.assertIn('Sample PDF for Python', text, msg=f"'{fidelity}' should keep the words of the document")
+
+    def test_TC_36_part_cache_reparses_only_changed_slides(self):
+        """Test that re-extracting an edited deck only parses the slides that changed."""
+        deck_path = os.path.join(self.base_output_folder, 'deck.pptx')
+        deck = Presentation()
+        for number in range(1, 4):
+            deck.slides.add_slide(deck.slide_layouts[5]).shapes.title.text = f'Slide {number}'
+        deck.save(deck_path)
+        cache = PartCache(os.path.join(self.base_output_folder, 'parts.db'))
+        extractor = DataExtractor(PPTLoader(deck_path), part_cache=cache)
+        self.assertEqual(extractor.extract_text(), DataExtractor(PPTLoader(deck_path)).extract_text())
+
+        deck = Presentation(deck_path)
+        deck.slides[1].shapes.title.text = 'Edited'
+        deck.save(deck_path)
+        hits, misses = cache.hits, cache.misses
+        extractor = DataExtractor(PPTLoader(deck_path), part_cache=cache)
+        self.assertEqual(extractor.extract_text(), 'Slide 1\nEdited\nSlide 3')
+        self.assertEqual((cache.hits - hits, cache.misses - misses), (2, 1),
+                         msg="Only the edited slide should be parsed again")
+        cache.close()
+
+    def test_TC_37_memory_governor_holds_back_documents(self):
+        """Test that documents are only admitted while their footprint fits the memory budget."""
+        governor = MemoryGovernor(budget_mb=500, base=100, pages=10, megabytes=0, images=0)
+        workers = [SupervisedWorker(), SupervisedWorker(), SupervisedWorker()]
+        self.assertEqual(governor.footprint({'pages': 20, 'megabytes': 3, 'images': 1}), 300)
+        self.assertTrue(governor.try_admit(workers[0], workers, 300))
+        self.assertFalse(governor.try_admit(workers[1], workers, 300), msg="A second large document should wait")
+        self.assertTrue(governor.try_admit(workers[1], workers, 150), msg="A smaller document that fits is admitted")
+        governor.release(workers[0], workers)
+        governor.release(workers[1], workers)
+        self.assertTrue(governor.try_admit(workers[2], workers, 900),
+                        msg="An oversized document runs once nothing else is in flight")
+
+    def test_TC_38_probe_flags_scanned_pdf(self):
+        """Test that probing a PDF with images but no text layer reports that it needs OCR."""
+        scanned_pdf = os.path.join(self.base_output_folder, 'scanned.pdf')
+        Image.new('RGB', (200, 100), 'white').save(scanned_pdf)
+        summary = probe_document(scanned_pdf)
+        self.assertNotIn('error', summary)
+        self.assertEqual((summary['pages'], summary['images'], summary['scanned_pages']), (1, 1, 1))
+        self.assertTrue(summary['needs_ocr'])
+        self.assertFalse(summary['encrypted'])
+        self.assertGreater(summary['estimated_seconds'], 0)
+        self.assertIn('error', probe_document(os.path.join(self.base_output_folder, 'missing.pdf')))
+
+    def test_TC_39_decode_raw_indexed_pdf_image(self):
+        """Test that a raw (non-JPEG) indexed PDF image is decoded instead of dropped."""
+        pdf_file = os.path.join(self.base_output_folder, 'indexed.pdf')
+        original = Image.fromarray((np.arange(64 * 32).reshape(32, 64) % 16).astype(np.uint8)).quantize(16)
+        original.save(pdf_file)  # Pillow stores palette images as raw Indexed streams
+        extractor = DataExtractor(PDFLoader(pdf_file))
+        images = extractor.extract_images()
+        self.assertEqual(len(images), 1)
+        decoded = decode_pdf_image(images[0]['stream'])
+        self.assertTrue(np.array_equal(np.asarray(decoded.convert('RGB')), np.asarray(original.convert('RGB'))))
+        stored = Image.open(BytesIO(encode_pdf_image(images[0]['stream'])))
+        self.assertEqual((stored.format, stored.size), ('PNG', (64, 32)))
+
+        # A 2-bit Indexed image whose Decode array reverses the palette indices
+        inverted = PDFStream({'Width': 4, 'Height': 1, 'BitsPerComponent': 2, 'Decode': [3, 0],
+                              'ColorSpace': [LIT('Indexed'), LIT('DeviceGray'), 3, bytes([0, 85, 170, 255])]},
+                             bytes([0b00011011]))
+        self.assertEqual(np.asarray(decode_pdf_image(inverted)).tolist(), [[255, 170, 85, 0]],
+                         msg="Decode should map samples straight to palette indices")
+
+    def test_TC_40_cluster_near_duplicate_images(self):
+        """Test that re-saved copies of an image share a cluster whose representative is the largest copy."""
+        x = np.linspace(0, 6, 300)
+        photo = Image.fromarray((np.outer(np.sin(x), np.cos(x * 1.7)) * 100 + 128).astype(np.uint8)).convert('RGB')
+        other = Image.fromarray((np.add.outer(x, x) * 20 % 255).astype(np.uint8)).convert('RGB')
+        copies = []
+        for image, size, quality in [(photo, (120, 120), 40), (other, (300, 300), 90), (photo, (200, 200), 75)]:
+            buffer = BytesIO()
+            image.resize(size).save(buffer, format='JPEG', quality=quality)
+            copies.append(Image.open(buffer))
+        clusters = ImageDeduplicator().cluster([photo, copies[0], None, copies[1], copies[2]])
+        self.assertIsNone(clusters[2], msg="Images that could not be opened get no cluster")
+        self.assertEqual([clusters[idx]['cluster_id'] for idx in (0, 1, 3, 4)], [1, 1, 2, 1])
+        self.assertEqual([clusters[idx]['representative'] for idx in (0, 1, 4)], [True, False, False])
+        self.assertEqual(clusters[0]['cluster_size'], 3)
+        self.assertTrue(ImageDeduplicator.from_spec('representatives:6').representatives_only)
+        self.assertIsNone(ImageDeduplicator.from_spec('none'))
+
+    def test_TC_41_sql_upsert_replaces_rows_of_a_document(self):
+        """Test that SQL rows are upserted by (document_id, position) and stale rows are deleted."""
+        conn = mock.MagicMock()
+        cursor = conn.cursor.return_value
+        cursor.fetchall.return_value = []  # no tables yet, so there is nothing to migrate
+        extractor = mock.MagicMock(file_loader=PDFLoader('input/special.pdf'))
+        extractor.extract_links.return_value = [(1, 'https://a.example'), (3, 'https://b.example')]
+        storage = StorageSQL(extractor, None, conn=conn)
+        cursor.reset_mock()
+        storage.save_links()
+
+        document_id = PDFLoader('input/special.pdf').content_hash()
+        sql, values = cursor.executemany.call_args.args
+        self.assertIn('ON DUPLICATE KEY UPDATE', sql)
+        self.assertEqual(values, [(document_id, 0, 1, 'https://a.example'), (document_id, 1, 3, 'https://b.example')],
+                         msg="Links should keep the page they were found on")
+        delete_sql, delete_args = cursor.execute.call_args.args
+        self.assertTrue(delete_sql.startswith('DELETE FROM extracted_links'))
+        self.assertEqual(delete_args, (document_id, 2), msg="Rows past the new link count should be deleted")
+
+        storage._attempt_sql_upsert('extracted_images', ['page_number'], [(1,), (2,)], "Images", positions=[0, 2])
+        sql, values = cursor.executemany.call_args.args
+        self.assertEqual([value[1] for value in values], [0, 2], msg="Images keep their index in the document")
+        delete_sql, delete_args = cursor.execute.call_args.args
+        self.assertIn('position NOT IN', delete_sql)
+        self.assertEqual(delete_args, (document_id, 0, 2))
+
+    def test_TC_42_storage_reads_back_latest_artifact_encoding(self):
+        """Test that re-saving an artifact with another compression policy replaces the earlier file."""
+        extractor = mock.MagicMock(file_loader=PDFLoader('input/special.pdf'))
+        with tempfile.TemporaryDirectory() as base_path:
+            extractor.extract_text.return_value = 'first run'
+            Storage(extractor, base_path).save_text()
+            extractor.extract_text.return_value = 'second run'
+            storage = Storage(extractor, base_path, CompressionPolicy('gzip'))
+            storage.save_text()
+            text_path = os.path.join(base_path, 'text', 'pdf_text.txt')
+            self.assertEqual(os.listdir(os.path.dirname(text_path)), ['pdf_text.txt.gz'])
+            self.assertEqual(storage.read_artifact(text_path), 'second run')
+
+    def test_TC_43_failed_sql_write_fails_the_document(self):
+        """Test that a failed upsert is reported instead of the document counting as stored."""
+        conn = mock.MagicMock()
+        cursor = conn.cursor.return_value
+        cursor.fetchall.return_value = []
+        cursor.executemany.side_effect = RuntimeError("Lost connection to MySQL server")
+        extractor = mock.MagicMock(file_loader=PDFLoader('input/special.pdf'),
+                                   request=ExtractionRequest(kinds=['links', 'metadata']))
+        extractor.extract_links.return_value = [(1, 'https://a.example')]
+        extractor.extract_metadata.return_value = {'Author': 'someone'}
+        with self.assertRaises(StorageError) as raised:
+            StorageSQL(extractor, None, conn=conn).save_requested()
+        self.assertIn('Links', str(raised.exception))
+        self.assertIn('Metadata', str(raised.exception), msg="Later kinds should still be attempted")
+        conn.rollback.assert_called()
+
+    def test_TC_44_unrequested_kinds_are_not_extracted(self):
+        """Test that saving a selective request never runs the extractors of other kinds."""
+        extractor = DataExtractor(PDFLoader('input/Document 2.pdf'), ExtractionRequest(kinds=['text'], pages=[1]))
+        conn = mock.MagicMock()
+        conn.cursor.return_value.fetchall.return_value = []
+        storage = StorageSQL(extractor, None, conn=conn)
+        calls = {}
+        for kind in KINDS:
+            method = getattr(extractor, f'extract_{kind}')
+            calls[kind] = mock.patch.object(extractor, f'extract_{kind}', wraps=method).start()
+        self.addCleanup(mock.patch.stopall)
+        storage.save_requested()
+        self.assertEqual([kind for kind in KINDS if calls[kind].called], ['text'])
+
+    def test_TC_45_service_extract_round_trip(self):
+        """Test an /extract request end to end: upload, result in the response, spool cleanup and path roots."""
+        async def scenario(spool_dir, root):
+            service = ExtractionService(describe_document, workers=1, spool_dir=spool_dir, allowed_roots=[root])
+            await service.start_workers()
+            server = await asyncio.start_server(service._handle_connection, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+
+            async def post(target, body=b''):
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                writer.write(f"POST {target} HTTP/1.1\r\nContent-Length: {len(body)}\r\n"
+                             f"Connection: close\r\n\r\n".encode('latin-1') + body)
+                response = await reader.read()
+                writer.close()
+                head, _, payload = response.partition(b'\r\n\r\n')
+                return int(head.split()[1]), json.loads(payload)
+
+            try:
+                responses = [await post('/extract?filename=doc.pdf&kinds=text&wait=1', b'uploaded bytes'),
+                             await post(f'/extract?path={os.path.abspath("input/special.pdf")}')]
+            finally:
+                server.close()
+                service.close()
+            return responses
+
+        with tempfile.TemporaryDirectory() as spool_dir, tempfile.TemporaryDirectory() as root:
+            (status, job), (denied, error) = asyncio.run(scenario(spool_dir, root))
+            self.assertEqual(status, 200)
+            self.assertEqual(job['state'], 'done')
+            self.assertEqual(job['result'], {'data': 'uploaded bytes', 'kinds': ['text']})
+            self.assertEqual(os.listdir(spool_dir), [], msg="The spooled upload should be deleted")
+            self.assertEqual(denied, 403, msg=f"Paths outside the allowed roots should be refused: {error}")
+
+    def test_TC_46_image_count_streams_large_pdfs(self):
+        """Test that PDF images are counted chunk by chunk, including matches split across chunks."""
+        data = b'x' * (1024 * 1024 - 5) + b'/Subtype /Image' + b'y' * 100 + b'/Subtype/Image'
+        self.assertEqual(count_matches(BytesIO(data), PDF_IMAGE_PATTERN), 2)
+        report_costs([{'file_path': 'a.pdf', 'predicted': 0.0, 'actual': 1.0}])  # must not divide by zero
+
+    def test_TC_47_watch_daemon_survives_failing_documents(self):
+        """Test upper-case extensions, a process call that raises, and forgetting deleted files."""
+        self.assertIsInstance(get_loader('REPORT.PDF'), PDFLoader, msg="Extensions should match case-insensitively")
+        with tempfile.TemporaryDirectory() as directory:
+            watcher = DirectoryWatcher([directory], settle_seconds=0.05, poll_interval=0.01, use_inotify=False)
+            daemon = WatchDaemon(watcher, workers=1)
+
+            def process(worker, file_path):
+                raise RuntimeError("broken document")
+
+            thread = threading.Thread(target=daemon._work_loop, args=(daemon.workers[0], process), daemon=True)
+            thread.start()
+            daemon.queue.put(('REPORT.PDF', time.time()))
+            deadline = time.time() + 2
+            while daemon.queue.unfinished_tasks and time.time() < deadline:
+                time.sleep(0.01)
+            daemon.stop()
+            thread.join()
+            self.assertEqual((daemon.in_flight, daemon.failed, daemon.queue.unfinished_tasks), (0, 1, 0))
+
+            document = os.path.join(directory, 'REPORT.PDF')
+            with open(document, 'wb') as file:
+                file.write(b'%PDF-1.4')
+            ready = []
+            deadline = time.time() + 2
+            while not ready and time.time() < deadline:
+                ready = watcher.poll()
+            self.assertEqual([path for path, _ in ready], [document])
+            os.remove(document)
+            watcher.poll()
+            self.assertEqual(watcher._reported, {}, msg="Deleted files should be forgotten")
+            watcher.close()
+
+    def test_TC_48_bundle_keeps_image_bytes_and_discards_failed_writes(self):
+        """Test that images are stored byte for byte and a failing extraction leaves no partial bundle."""
+        buffer = BytesIO()
+        Image.new('RGB', (4, 3), 'red').save(buffer, format='JPEG', quality=50)
+        extractor = mock.Mock()
+        extractor.file_loader.content_hash.return_value = 'doc'
+        extractor.file_loader.file_path = 'doc.pdf'
+        extractor.extract_images.return_value = [(1, buffer.getvalue())]
+        with tempfile.TemporaryDirectory() as base_path:
+            extractor.request.kinds = ['images']
+            StorageBundle(extractor, base_path).save_requested()
+            with BundleReader(os.path.join(base_path, 'bundles', 'doc.bundle')) as reader:
+                self.assertEqual(reader.read('images/1.jpeg'), buffer.getvalue(), msg="Images should not be re-encoded")
+
+            extractor.request.kinds = ['images', 'links']
+            extractor.extract_links.side_effect = RuntimeError("extraction failed")
+            with self.assertRaises(RuntimeError):
+                StorageBundle(extractor, base_path).save_requested()
+            self.assertEqual(os.listdir(os.path.join(base_path, 'bundles')), ['doc.bundle'],
+                             msg="The partial .tmp bundle should be removed")
+
+    def test_TC_49_corrupt_image_is_stored_without_a_cluster(self):
+        """Test that an image that fails to decode while hashing is stored without a cluster instead of failing the save."""
+        buffer = BytesIO()
+        Image.fromarray(np.random.default_rng(0).integers(0, 255, (64, 64, 3), dtype=np.uint8)).save(buffer, format='JPEG')
+        intact, truncated = buffer.getvalue(), buffer.getvalue()[:len(buffer.getvalue()) // 2]
+        self.assertEqual(perceptual_hashes([Image.open(BytesIO(truncated))])['hashed'], [])
+        extractor = mock.Mock()
+        extractor.file_loader.content_hash.return_value = 'doc'
+        extractor.file_loader.file_path = 'doc.pdf'
+        extractor.request.kinds = ['images']
+        extractor.extract_images.return_value = [(1, intact), (2, truncated)]
+        with tempfile.TemporaryDirectory() as base_path:
+            StorageBundle(extractor, base_path, image_dedup=ImageDeduplicator()).save_requested()
+            with BundleReader(os.path.join(base_path, 'bundles', 'doc.bundle')) as reader:
+                self.assertEqual(reader.names('images'), ['images/1.jpeg', 'images/2.jpeg'])
+                self.assertEqual(reader.entry('images/1.jpeg')['cluster_id'], 1)
+                self.assertNotIn('cluster_id', reader.entry('images/2.jpeg'), msg="A corrupt image gets no cluster")
+
+    def test_TC_50_spilled_package_images_survive_deduplication(self):
+        """Test that images spilled to temporary files by the part cache can be hashed and then stored."""
+        with tempfile.TemporaryDirectory() as directory:
+            picture = os.path.join(directory, 'picture.png')
+            Image.new('RGB', (40, 30), 'blue').save(picture)
+            deck_path = os.path.join(directory, 'deck.pptx')
+            deck = Presentation()
+            for _ in range(2):
+                deck.slides.add_slide(deck.slide_layouts[6]).shapes.add_picture(picture, 0, 0)
+            deck.save(deck_path)
+            cache = PartCache(os.path.join(directory, 'parts.db'))
+            extractor = DataExtractor(PPTLoader(deck_path), ExtractionRequest(kinds=['images']),
+                                      part_cache=cache, image_spill_mb=0.000001)
+            Storage(extractor, os.path.join(directory, 'fs'), image_dedup=ImageDeduplicator()).save_requested()
+            self.assertEqual(sorted(os.listdir(os.path.join(directory, 'fs', 'images'))),
+                             ['ppt_clusters.json', 'ppt_image_1.png', 'ppt_image_2.png'])
+            bundle = StorageBundle(extractor, directory, image_dedup=ImageDeduplicator())
+            bundle.save_requested()
+            with BundleReader(bundle.bundle_path) as reader:
+                self.assertEqual(reader.names('images'), ['images/1.png', 'images/2.png'])
+                self.assertEqual(reader.entry('images/2.png')['cluster_id'], 1)
+            cache.close()
+
+    def test_TC_51_pptx_images_record_their_slide(self):
+        """Test that PPTX images carry the slide they come from, with and without the part cache."""
+        with tempfile.TemporaryDirectory() as directory:
+            picture = os.path.join(directory, 'picture.png')
+            Image.new('RGB', (40, 30), 'green').save(picture)
+            deck_path = os.path.join(directory, 'deck.pptx')
+            deck = Presentation()
+            for number in range(1, 4):
+                slide = deck.slides.add_slide(deck.slide_layouts[6])
+                if number != 2:
+                    slide.shapes.add_picture(picture, 0, 0)
+            deck.save(deck_path)
+            cache = PartCache(os.path.join(directory, 'parts.db'))
+            for extractor in [DataExtractor(PPTLoader(deck_path)), DataExtractor(PPTLoader(deck_path), part_cache=cache)]:
+                self.assertEqual([page for page, _ in extractor.extract_images(with_pages=True)], [1, 3])
+            cache.close()
+
+            conn = mock.MagicMock()
+            conn.cursor.return_value.fetchall.return_value = []
+            storage = StorageSQL(DataExtractor(PPTLoader(deck_path)), None, conn=conn)
+            storage.save_images()
+            _, values = conn.cursor.return_value.executemany.call_args.args
+            self.assertEqual([value[2] for value in values], [1, 3], msg="Image rows should record their slide")
+
+    def test_TC_52_large_docx_and_pptx_images_are_spilled(self):
+        """Test that DOCX and PPTX images above the spill threshold are moved to temporary files and still stored."""
+        with tempfile.TemporaryDirectory() as directory:
+            picture = os.path.join(directory, 'picture.png')
+            Image.new('RGB', (40, 30), 'red').save(picture)
+            deck_path = os.path.join(directory, 'deck.pptx')
+            deck = Presentation()
+            deck.slides.add_slide(deck.slide_layouts[6]).shapes.add_picture(picture, 0, 0)
+            deck.save(deck_path)
+            extractor = DataExtractor(PPTLoader(deck_path), ExtractionRequest(kinds=['images']), image_spill_mb=0.000001)
+            (image,) = extractor.extract_images()
+            self.assertFalse(isinstance(image, bytes), msg="An image above the threshold should be a temporary file")
+            with open(picture, 'rb') as file:
+                self.assertEqual(image.read(), file.read())
+            self.assertIsInstance(DataExtractor(PPTLoader(deck_path)).extract_images()[0], bytes)
+            Storage(extractor, os.path.join(directory, 'fs')).save_requested()
+            self.assertEqual(os.listdir(os.path.join(directory, 'fs', 'images')), ['ppt_image_1.png'])
+
+    def test_TC_53_service_survives_errors_and_rewarms_recycled_workers(self):
+        """Test that an unexpected error fails only its job and that a replaced worker is warmed up again."""
+        worker = SupervisedWorker(warmup=mark_warm)
+        self.assertTrue(worker.run(is_warm))
+        worker.recycle()
+        self.assertTrue(worker.run(is_warm), msg="A replacement worker should be warmed up before its first document")
+        worker.close()
+
+        async def scenario():
+            service = ExtractionService(describe_document, workers=1)
+            await service.start_workers()
+            try:
+                with mock.patch.object(service.workers[0], 'run', side_effect=RuntimeError("lost pipe")):
+                    failed = service.submit('missing.pdf', ExtractionRequest())
+                    await asyncio.wait_for(failed['done'], 5)
+                with tempfile.NamedTemporaryFile('w', suffix='.pdf', delete=False) as file:
+                    file.write('still served')
+                done = service.submit(file.name, ExtractionRequest(kinds=['text']))
+                await asyncio.wait_for(done['done'], 10)
+                os.remove(file.name)
+            finally:
+                service.close()
+            return failed, done
+
+        failed, done = asyncio.run(scenario())
+        self.assertEqual((failed['state'], failed['error']), ('failed', 'RuntimeError: lost pipe'))
+        self.assertEqual(done['state'], 'done', msg="The worker slot should keep serving after an unexpected error")
+
+    def test_TC_54_part_cache_parses_only_requested_kinds(self):
+        """Test that cached part results are filled in per kind, parsing slides only for the kinds requested."""
+        with tempfile.TemporaryDirectory() as directory:
+            deck_path = os.path.join(directory, 'deck.pptx')
+            deck = Presentation()
+            deck.slides.add_slide(deck.slide_layouts[5]).shapes.title.text = 'Only slide'
+            deck.save(deck_path)
+            cache = PartCache(os.path.join(directory, 'parts.db'))
+            parse_slide = DataExtractor._parse_slide
+            with mock.patch.object(DataExtractor, '_parse_slide', autospec=True, side_effect=parse_slide) as parsed:
+                DataExtractor(PPTLoader(deck_path), ExtractionRequest(kinds=['metadata']), part_cache=cache).extract_metadata()
+                self.assertEqual(parsed.call_count, 0, msg="A metadata request should not parse any slide")
+                extractor = DataExtractor(PPTLoader(deck_path), ExtractionRequest(kinds=['text']), part_cache=cache)
+                self.assertEqual(extractor.extract_text(), 'Only slide')
+                self.assertEqual(parsed.call_args.args[2], ['text'])
+                extractor = DataExtractor(PPTLoader(deck_path), ExtractionRequest(kinds=['text', 'tables']), part_cache=cache)
+                self.assertEqual((extractor.extract_text(), extractor.extract_tables()), ('Only slide', []))
+                self.assertEqual(parsed.call_args.args[2], ['tables'], msg="Only the kind missing from the cache is parsed")
+                extractor = DataExtractor(PPTLoader(deck_path), ExtractionRequest(kinds=['text', 'tables']), part_cache=cache)
+                extractor.extract_text()
+                self.assertEqual(parsed.call_count, 2, msg="Kinds already cached should not be parsed again")
+            cache.close()
+
+    def test_TC_55_bundle_recompresses_decoded_pdf_bitmaps(self):
+        """Test that a decoded PDF bitmap is stored in the bundle as a properly compressed PNG with the same pixels."""
+        with tempfile.TemporaryDirectory() as directory:
+            x = np.arange(256)
+            original = Image.fromarray(((np.add.outer(x, x) // 8) % 16).astype(np.uint8)).quantize(16)
+            pdf_file = os.path.join(directory, 'bitmap.pdf')
+            original.save(pdf_file)  # a raw Indexed stream, decoded to PNG on extraction
+            extractor = DataExtractor(PDFLoader(pdf_file), ExtractionRequest(kinds=['images']))
+            fast_png = encode_pdf_image(extractor.extract_images()[0]['stream'])
+            bundle = StorageBundle(extractor, directory)
+            bundle.save_requested()
+            with BundleReader(bundle.bundle_path) as reader:
+                stored = reader.read('images/1.png')
+            self.assertLess(len(stored), len(fast_png), msg="The bundle should not keep the fast, lightly compressed PNG")
+            self.assertTrue(np.array_equal(np.asarray(Image.open(BytesIO(stored)).convert('RGB')),
+                                           np.asarray(original.convert('RGB'))))
+
 if __name__ == '__main__':
     unittest.main()